@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Register the signal receivers that keep caches, the DM inbox and the
+        # suggestion refresh queue in step, whatever the entry point (views,
+        # management commands, the shell, the outbox worker)
+        from . import (  # noqa: F401
+            authentication, blocks, dm_channels, friendships, inbox, membership, reactions, realtime, suggestions,
+        )
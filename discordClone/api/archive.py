@@ -0,0 +1,180 @@
+"""
+Hot/cold tiers for message storage.
+
+Recent messages live in ``UserMessages`` as usual. Whole months of older
+messages can be moved to ``ArchivedMessage`` by the archive_messages command:
+each row keeps the keys history reads need (channel, author, time_stamp,
+message_id) as plain columns and everything else in a zlib-compressed JSON
+payload. On PostgreSQL the archive is range-partitioned by month, one
+partition per archived month, so old data can be detached, backed up or
+dropped a month at a time and never has to be vacuumed again; other backends
+keep a single archive table.
+
+The hot table itself stays unpartitioned: reactions, mentions and
+notifications reference message_id on its own, which PostgreSQL does not
+allow against a table partitioned on time_stamp.
+
+History reads span both tiers when MESSAGE_ARCHIVE_ENABLED is set; see
+MessageCursorPagination.
+"""
+import json
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from notifications.models import Notifications
+from user_messages.models import ArchivedMessage, UserMessages
+
+from .reactions import _emoji_counts
+
+COMPRESSION_LEVEL = 6
+
+_ARCHIVE = ArchivedMessage._meta.db_table
+_MENTIONS = UserMessages.mentions.through
+
+
+def archive_enabled():
+    return getattr(settings, 'MESSAGE_ARCHIVE_ENABLED', False)
+
+
+def pack(data):
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode(), COMPRESSION_LEVEL)
+
+
+def unpack(payload):
+    return json.loads(zlib.decompress(bytes(payload)))
+
+
+def month_start(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(month):
+    return month_start(month + timedelta(days=32))
+
+
+def partition_name(month):
+    return f'{_ARCHIVE}_p{month:%Y%m}'
+
+
+def ensure_partition(month):
+    """Create the archive partition holding ``month`` (PostgreSQL only; a no-op elsewhere)"""
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {_ARCHIVE} '
+            f'FOR VALUES FROM (%s) TO (%s)',
+            [month, next_month(month)],
+        )
+
+
+def archived_partitions():
+    """Names of the existing monthly archive partitions, oldest first (PostgreSQL only)"""
+    if connection.vendor != 'postgresql':
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = %s::regclass ORDER BY c.relname',
+            [_ARCHIVE],
+        )
+        return [name for name, in cursor.fetchall()]
+
+
+def _archive_batch(messages):
+    """Copy ``messages`` into the archive and delete them from the hot table"""
+    message_ids = [message.message_id for message in messages]
+    mentions = {}
+    for message_id, user_id in (
+        _MENTIONS.objects.filter(usermessages_id__in=message_ids).values_list('usermessages_id', 'users_id')
+    ):
+        mentions.setdefault(message_id, []).append(user_id)
+    reactions = _emoji_counts(message_ids)
+
+    with transaction.atomic():
+        ArchivedMessage.objects.bulk_create([
+            ArchivedMessage(
+                message_id=message.message_id,
+                message_channel_id_id=message.message_channel_id_id,
+                dm_channel_id=message.dm_channel_id,
+                user_channel_id_id=message.user_channel_id_id,
+                time_stamp=message.time_stamp,
+                payload=pack({
+                    'content': message.content,
+                    'attachment_url': message.attachment_url,
+                    'attachment_type': message.attachment_type,
+                    'is_edited': message.is_edited,
+                    'edited_at': message.edited_at.isoformat() if message.edited_at else None,
+                    'is_pinned': message.is_pinned,
+                    'mention_everyone': message.mention_everyone,
+                    'mentions': mentions.get(message.message_id, []),
+                    'reactions': reactions.get(message.message_id, []),
+                }),
+            )
+            for message in messages
+        ])
+        # Keep notifications about archived messages; only the link goes
+        Notifications.objects.filter(message_id__in=message_ids).update(message=None)
+        UserMessages.objects.filter(message_id__in=message_ids).delete()
+
+
+def archive_month(month, batch_size=5000):
+    """
+    Move the messages sent in ``month`` to the archive, ``batch_size`` at a
+    time, and return how many were moved. Pinned messages stay in the hot
+    table. Reactions are kept as per-emoji counts; the reactors themselves
+    are not archived.
+    """
+    ensure_partition(month)
+    messages = (
+        UserMessages.objects
+        .filter(time_stamp__gte=month, time_stamp__lt=next_month(month), is_pinned=False)
+        .order_by('message_id')
+    )
+    moved = 0
+    last_id = 0
+    while True:
+        batch = list(messages.filter(message_id__gt=last_id)[:batch_size])
+        if not batch:
+            return moved
+        _archive_batch(batch)
+        moved += len(batch)
+        last_id = batch[-1].message_id
+
+
+def archive_before(cutoff, batch_size=5000):
+    """
+    Archive every whole month (in UTC) before the one containing ``cutoff``.
+    Returns ``[(month, moved), ...]``.
+    """
+    cutoff = month_start(cutoff.astimezone(dt_timezone.utc))
+    oldest = (
+        UserMessages.objects
+        .filter(time_stamp__lt=cutoff, is_pinned=False)
+        .order_by('time_stamp')
+        .values_list('time_stamp', flat=True)
+        .first()
+    )
+    results = []
+    if oldest is None:
+        return results
+    month = month_start(oldest.astimezone(dt_timezone.utc))
+    while month < cutoff:
+        results.append((month, archive_month(month, batch_size)))
+        month = next_month(month)
+    return results
+
+
+def archived_history(channel_id=None, dm_channel_id=None):
+    """The archived half of a channel or DM channel's history"""
+    messages = ArchivedMessage.objects.select_related('user_channel_id')
+    if dm_channel_id is not None:
+        return messages.filter(dm_channel_id=dm_channel_id)
+    return messages.filter(message_channel_id=channel_id)
+
+
+def parse_archived_datetime(value):
+    return datetime.fromisoformat(value) if value else None
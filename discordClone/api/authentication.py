@@ -0,0 +1,113 @@
+import copy
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from users.models import Users, users_updated
+
+from .cache import MISSING, LRUCache
+
+_tokens = LRUCache(
+    maxsize=getattr(settings, 'TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'TOKEN_CACHE_TTL', 60),
+)
+# user_id -> token key, so a user's cached entry can be dropped when they change
+_token_keys = LRUCache(maxsize=getattr(settings, 'TOKEN_CACHE_SIZE', 10000))
+
+# Changes to these Users fields can revoke a token
+AUTH_FIELDS = {'is_active', 'password'}
+
+
+def _shared_cache():
+    alias = getattr(settings, 'TOKEN_CACHE_BACKEND', None)
+    return caches[alias] if alias else None
+
+
+def _shared_key(key):
+    return f'auth-token:{key}'
+
+
+def _forget_token(key):
+    _tokens.delete(key)
+    shared = _shared_cache()
+    if shared is not None:
+        shared.delete(_shared_key(key))
+
+
+def invalidate_token(key):
+    """
+    Forget a cached token now and again once the transaction commits, so a
+    request that read the old row before the commit can't re-cache it
+    """
+    _forget_token(key)
+    transaction.on_commit(lambda: _forget_token(key))
+
+
+def invalidate_user_tokens(user_ids):
+    for user_id in user_ids:
+        key = _token_keys.get(user_id)
+        if key is not MISSING:
+            _token_keys.delete(user_id)
+            invalidate_token(key)
+    if _shared_cache() is not None:
+        # This process may never have cached the tokens, but another one may have
+        for key in Token.objects.filter(user__in=user_ids).values_list('key', flat=True):
+            invalidate_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that remembers token -> user lookups for
+    TOKEN_CACHE_TTL seconds.
+
+    When TOKEN_CACHE_BACKEND names a Django cache, resolved users are kept
+    only there, so a logout or deactivation in one worker process is seen by
+    every other one straight away. Otherwise they are kept in an in-process
+    LRU, which other processes don't invalidate: with several workers and no
+    shared backend, a revoked token keeps working elsewhere for up to
+    TOKEN_CACHE_TTL. Entries are dropped when a token is deleted (logout) or
+    its user is saved or bulk-updated (e.g. deactivated).
+    """
+
+    def authenticate_credentials(self, key):
+        shared = _shared_cache()
+        if shared is not None:
+            user = shared.get(_shared_key(key))
+            if user is None:
+                # Raises AuthenticationFailed for unknown tokens and inactive users
+                user, _ = super().authenticate_credentials(key)
+                shared.set(_shared_key(key), user, getattr(settings, 'TOKEN_CACHE_TTL', 60))
+            # Unpickled afresh by every get
+            return user, key
+
+        user = _tokens.get(key)
+        if user is MISSING:
+            user, _ = super().authenticate_credentials(key)
+            _tokens.set(key, user)
+            _token_keys.set(user.pk, key)
+
+        # Hand each request its own copy so views can't mutate the cached one
+        return copy.copy(user), key
+
+
+# Signals to invalidate cached tokens
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance=None, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=Users)
+def user_changed(sender, instance=None, created=False, **kwargs):
+    if not created:
+        invalidate_user_tokens([instance.pk])
+
+
+@receiver(users_updated, sender=Users)
+def users_bulk_updated(sender, user_ids=(), fields=(), **kwargs):
+    if AUTH_FIELDS & fields:
+        invalidate_user_tokens(user_ids)
@@ -0,0 +1,63 @@
+"""
+Per-user block lists with an in-process cache.
+
+The ids each user blocked are loaded from the (user, blocked_user) index and
+cached as a sorted ``array``, so "hide the authors this user blocked" is
+answered from memory once warm. Entries are dropped by the signal receivers
+below when a block is created or removed, and expire after BLOCK_CACHE_TTL
+seconds so that changes made by other worker processes are picked up. That
+lag is fine for hiding messages, but not for refusing a write: sending a DM
+or a friend request checks block_exists() against the database instead.
+"""
+from array import array
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from friends.models import BlockedUser
+
+from .cache import MISSING, LRUCache
+
+_block_lists = LRUCache(
+    maxsize=getattr(settings, 'BLOCK_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'BLOCK_CACHE_TTL', 60),
+)
+
+
+def blocked_ids(user_id):
+    """The users ``user_id`` blocked, as a sorted array"""
+    ids = _block_lists.get(user_id)
+    if ids is MISSING:
+        ids = array('i', sorted(
+            BlockedUser.objects.filter(user_id=user_id).order_by().values_list('blocked_user_id', flat=True)
+        ))
+        _block_lists.set(user_id, ids)
+    return ids
+
+
+def block_exists(user_id, other_user_id):
+    """True if either user blocked the other, read from the database (the unique (user, blocked_user) index)"""
+    return BlockedUser.objects.filter(
+        Q(user_id=user_id, blocked_user_id=other_user_id) | Q(user_id=other_user_id, blocked_user_id=user_id)
+    ).exists()
+
+
+def blockers_of(user_id, user_ids):
+    """The ids among ``user_ids`` that blocked ``user_id``, read from the database"""
+    if not user_ids:
+        return set()
+    return set(BlockedUser.objects.filter(blocked_user_id=user_id, user_id__in=user_ids).values_list('user_id', flat=True))
+
+
+def invalidate_blocks(*user_ids):
+    for user_id in user_ids:
+        _block_lists.delete(user_id)
+
+
+# Signals to invalidate cached block lists
+@receiver(post_save, sender=BlockedUser)
+@receiver(post_delete, sender=BlockedUser)
+def block_changed(sender, instance=None, **kwargs):
+    invalidate_blocks(instance.user_id)
@@ -0,0 +1,66 @@
+"""
+Direct message channel lookup by pair of users.
+
+A DM channel is stored once per pair with ``user1`` the lower user id (a
+check constraint enforces it), so finding the channel between two users is
+one probe of the (user1, user2) unique index. The pair -> channel id mapping
+never changes while the channel exists, so it is also cached in-process;
+entries are dropped when the channel is deleted and expire after
+DM_CHANNEL_CACHE_TTL seconds so that deletions in other processes are
+picked up.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from channels.models import DirectMessageChannel
+
+from .cache import MISSING, LRUCache
+
+_pairs = LRUCache(
+    maxsize=getattr(settings, 'DM_CHANNEL_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'DM_CHANNEL_CACHE_TTL', 300),
+)
+
+
+def find_dm_channel_id(user_id, other_user_id):
+    """The id of the DM channel between two users, or None if there is none"""
+    pair = DirectMessageChannel.ordered_pair(user_id, other_user_id)
+    dm_channel_id = _pairs.get(pair)
+    if dm_channel_id is MISSING:
+        user1_id, user2_id = pair
+        dm_channel_id = (
+            DirectMessageChannel.objects
+            .filter(user1_id=user1_id, user2_id=user2_id)
+            .values_list('dm_channel_id', flat=True)
+            .first()
+        )
+        if dm_channel_id is None:
+            # Don't cache misses; the channel may be created any moment
+            return None
+        _pairs.set(pair, dm_channel_id)
+    return dm_channel_id
+
+
+def get_or_create_dm_channel(user, other_user, **defaults):
+    """Return ``(channel, created)`` for the DM channel between two users"""
+    user1, user2 = (user, other_user) if user.pk <= other_user.pk else (other_user, user)
+    try:
+        with transaction.atomic():
+            dm_channel, created = DirectMessageChannel.objects.get_or_create(user1=user1, user2=user2, defaults=defaults)
+    except IntegrityError:
+        # Created concurrently between the lookup and the insert
+        dm_channel, created = DirectMessageChannel.objects.get(user1=user1, user2=user2), False
+    _pairs.set((user1.pk, user2.pk), dm_channel.pk)
+    return dm_channel, created
+
+
+def invalidate_dm_channel(user1_id, user2_id):
+    _pairs.delete(DirectMessageChannel.ordered_pair(user1_id, user2_id))
+
+
+# Signals to invalidate cached pairs
+@receiver(post_delete, sender=DirectMessageChannel)
+def dm_channel_deleted(sender, instance=None, **kwargs):
+    invalidate_dm_channel(instance.user1_id, instance.user2_id)
@@ -0,0 +1,204 @@
+"""
+Read-only fast paths for the hottest list serializers.
+
+A ValuesSerializer is compiled once from an existing ModelSerializer: every
+field becomes an extractor reading one column of a ``.values()`` row, using
+the DRF field's own ``to_representation`` where it does more than pass the
+value through (datetimes). Nested single objects read the joined columns of
+the same row; fields that need their own query (reactions, mentions, roles)
+are filled in per batch by ``get_<field>`` hooks. The output is the same
+JSON as the ModelSerializer's, without building a model instance and a
+bound field tree per row.
+
+Only use these for reads; anything writable keeps using the serializers in
+api.serializers. Parity is checked by the tests.
+"""
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+from servers.models import ServerRole
+from user_messages.models import UserMessages
+
+from .friendships import friendships
+from .reactions import summarize_reactions
+from .serializers import FriendSerializer, MessageSerializer, ServerMemberSerializer, ServerRoleSerializer
+
+PLAIN, DATETIME, NESTED, DEFERRED = 'plain', 'datetime', 'nested', 'deferred'
+
+# Fields whose to_representation returns database values unchanged
+_PASSTHROUGH = (
+    serializers.CharField, serializers.IntegerField, serializers.BooleanField,
+    serializers.ChoiceField, serializers.ReadOnlyField,
+)
+
+
+def _is_iso_datetime(field):
+    """A DateTimeField rendering ISO 8601 in the current time zone, which _build inlines"""
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    return (
+        isinstance(field, serializers.DateTimeField)
+        and isinstance(output_format, str) and output_format.lower() == ISO_8601
+        and not hasattr(field, 'timezone')
+    )
+
+
+def _compile(serializer, prefix=''):
+    """Return ``(columns, extractors)`` for the fields of a serializer instance"""
+    columns, extractors = [], []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, (serializers.SerializerMethodField, serializers.ManyRelatedField,
+                              serializers.ListSerializer)):
+            extractors.append((name, DEFERRED, None))
+            continue
+        path = prefix + field.source.replace('.', '__')
+        if isinstance(field, serializers.BaseSerializer):
+            nested_columns, nested_extractors = _compile(field, path + '__')
+            # The foreign key itself tells a missing object (None) apart
+            columns += [path, *nested_columns]
+            extractors.append((name, NESTED, (path, nested_extractors)))
+        elif isinstance(field, serializers.RelatedField):
+            # .values() already yields the primary key
+            columns.append(path)
+            extractors.append((name, PLAIN, (path, None)))
+        elif _is_iso_datetime(field):
+            columns.append(path)
+            extractors.append((name, DATETIME, (path, field)))
+        else:
+            columns.append(path)
+            convert = None if isinstance(field, _PASSTHROUGH) else field.to_representation
+            extractors.append((name, PLAIN, (path, convert)))
+    return columns, extractors
+
+
+def _build(extractors, row, deferred, pk, tz):
+    data = {}
+    for name, kind, spec in extractors:
+        if kind is PLAIN:
+            path, convert = spec
+            value = row[path]
+            data[name] = value if value is None or convert is None else convert(value)
+        elif kind is DATETIME:
+            path, field = spec
+            value = row[path]
+            if value is None:
+                data[name] = None
+            elif tz is None or value.tzinfo is None:
+                data[name] = field.to_representation(value)
+            else:
+                # DateTimeField.to_representation, without resolving the time zone per value
+                value = value.astimezone(tz).isoformat()
+                data[name] = value[:-6] + 'Z' if value.endswith('+00:00') else value
+        elif kind is NESTED:
+            path, nested = spec
+            data[name] = None if row[path] is None else _build(nested, row, deferred, pk, tz)
+        else:
+            data[name] = deferred[name].get(pk, [])
+    return data
+
+
+class ValuesSerializer:
+    """
+    Base class; set ``serializer_class`` to the ModelSerializer to mirror and
+    ``pk`` to the model's primary key name.
+    """
+    serializer_class = None
+    pk = 'pk'
+
+    _compiled = None
+
+    def __init__(self, context=None):
+        self.context = context or {}
+
+    @classmethod
+    def compiled(cls):
+        # Cached on the class itself, not inherited from the base
+        if cls.__dict__.get('_compiled') is None:
+            cls._compiled = _compile(cls.serializer_class())
+        return cls._compiled
+
+    def values(self, queryset, *extra):
+        """``queryset`` as the .values() rows to_representation() expects, plus ``extra`` columns"""
+        columns, _ = self.compiled()
+        return queryset.values(*dict.fromkeys([self.pk, *columns, *extra]))
+
+    def to_representation(self, rows):
+        rows = list(rows)
+        _, extractors = self.compiled()
+        pks = [row[self.pk] for row in rows]
+        deferred = {
+            name: getattr(self, f'get_{name}')(pks)
+            for name, kind, _ in extractors if kind is DEFERRED
+        }
+        tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        return [_build(extractors, row, deferred, row[self.pk], tz) for row in rows]
+
+    def serialize(self, queryset):
+        return self.to_representation(self.values(queryset))
+
+
+class ServerRoleValuesSerializer(ValuesSerializer):
+    serializer_class = ServerRoleSerializer
+    pk = 'id'
+
+
+class MessageValuesSerializer(ValuesSerializer):
+    serializer_class = MessageSerializer
+    pk = 'message_id'
+
+    def serialize_ids(self, message_ids):
+        """Serialize messages by id, in the order given"""
+        rows = {row['message_id']: row for row in self.values(UserMessages.objects.filter(message_id__in=message_ids))}
+        return self.to_representation(rows[message_id] for message_id in message_ids if message_id in rows)
+
+    def get_reactions(self, message_ids):
+        request = self.context.get('request')
+        return summarize_reactions(message_ids, getattr(request, 'user', None))
+
+    def get_mentions(self, message_ids):
+        mentions = {}
+        for message_id, user_id in (
+            UserMessages.mentions.through.objects
+            .filter(usermessages_id__in=message_ids)
+            .order_by('id')
+            .values_list('usermessages_id', 'users_id')
+        ):
+            mentions.setdefault(message_id, []).append(user_id)
+        return mentions
+
+
+class ServerMemberValuesSerializer(ValuesSerializer):
+    serializer_class = ServerMemberSerializer
+    pk = 'id'
+
+    def get_roles(self, member_ids):
+        role_serializer = ServerRoleValuesSerializer(self.context)
+        # Ordered like the roles relation (by -position), tagged with the member
+        rows = list(role_serializer.values(ServerRole.objects.filter(members__in=member_ids), 'members'))
+        roles = {}
+        for row, data in zip(rows, role_serializer.to_representation(rows)):
+            roles.setdefault(row['members'], []).append(data)
+        return roles
+
+
+class FriendValuesSerializer(ValuesSerializer):
+    serializer_class = FriendSerializer
+    pk = 'friends_id'
+
+    def serialize_friends_of(self, user_id):
+        """
+        Serialize a user's friendships as seen from their side: user_friend_id
+        and its fields are the other user, whichever side of the row they are.
+        """
+        lower, higher = friendships(user_id)
+        lower = self.values(lower)
+        # The same columns read from the other side, in the same order
+        mirrored = [
+            'users_id' + column[len('user_friend_id'):] if column.startswith('user_friend_id') else column
+            for column in lower.query.values_select
+        ]
+        rows = lower.order_by().union(higher.order_by().values_list(*mirrored), all=True).order_by(self.pk)
+        return self.to_representation(rows)
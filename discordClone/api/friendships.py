@@ -0,0 +1,82 @@
+"""
+Friendship graph with an in-process adjacency cache.
+
+A friendship is one Friends row with the lower user id in ``users_id`` (a
+check constraint enforces it). Each user's friends are cached as a sorted
+``array`` of user ids, loaded with one UNION of the two halves of the pair
+index and kept for FRIEND_CACHE_TTL seconds, so friendship checks, friend
+id lists and mutual friends are answered from memory once warm. Entries are
+dropped by the signal receivers below whenever a friendship is created or
+removed (accepting a request, blocking), and expire so that changes made by
+other worker processes are picked up.
+"""
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from friends.models import Friends
+
+from .cache import MISSING, LRUCache
+
+_adjacency = LRUCache(
+    maxsize=getattr(settings, 'FRIEND_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'FRIEND_CACHE_TTL', 60),
+)
+
+
+def friendships(user_id):
+    """Friends rows of ``user_id``: the half where they are users_id and the half where they are user_friend_id"""
+    return (
+        Friends.objects.filter(users_id=user_id, status=True),
+        Friends.objects.filter(user_friend_id=user_id, status=True),
+    )
+
+
+def friend_ids(user_id):
+    """The user ids of ``user_id``'s friends as a sorted array"""
+    ids = _adjacency.get(user_id)
+    if ids is MISSING:
+        lower, higher = friendships(user_id)
+        ids = array('i', sorted(
+            lower.order_by().values_list('user_friend_id', flat=True)
+            .union(higher.order_by().values_list('users_id', flat=True), all=True)
+        ))
+        _adjacency.set(user_id, ids)
+    return ids
+
+
+def are_friends(user_id, other_user_id):
+    ids = friend_ids(user_id)
+    i = bisect_left(ids, other_user_id)
+    return i < len(ids) and ids[i] == other_user_id
+
+
+def mutual_friend_ids(user_id, other_user_id):
+    """Sorted user ids of the friends two users have in common"""
+    return sorted(set(friend_ids(user_id)).intersection(friend_ids(other_user_id)))
+
+
+def add_friendship(user, other_user):
+    """Record a friendship between two users; does nothing if it already exists"""
+    users_id, user_friend_id = sorted((user, other_user), key=lambda u: u.pk)
+    return Friends.objects.get_or_create(users_id=users_id, user_friend_id=user_friend_id)
+
+
+def remove_friendship(user_id, other_user_id):
+    users_id, user_friend_id = Friends.ordered_pair(user_id, other_user_id)
+    Friends.objects.filter(users_id=users_id, user_friend_id=user_friend_id).delete()
+
+
+def invalidate_friends(*user_ids):
+    for user_id in user_ids:
+        _adjacency.delete(user_id)
+
+
+# Signals to invalidate cached adjacency lists
+@receiver(post_save, sender=Friends)
+@receiver(post_delete, sender=Friends)
+def friendship_changed(sender, instance=None, **kwargs):
+    invalidate_friends(instance.users_id_id, instance.user_friend_id_id)
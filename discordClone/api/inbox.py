@@ -0,0 +1,111 @@
+"""
+Per-user DM inbox.
+
+Every participant of a DM channel has a DMInbox row holding a copy of the
+peer's profile and a preview of the newest message, so a user's
+conversation list is one range scan of (user, -last_message_at) instead of
+an OR over DirectMessageChannel.user1/user2 and a user lookup per channel.
+Rows are created with the channel, rewritten in the same transaction as
+each new direct message, and the peer columns follow profile changes
+through the signal receivers below. Unread counts are not copied here: they
+are counted from the user's ReadState marker, the same way as the badges in
+api.read_states.
+"""
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from channels.models import DirectMessageChannel, DMInbox, ReadState
+from users.models import Users
+
+from .read_states import count_unread
+
+PREVIEW_LENGTH = DMInbox._meta.get_field('last_message_preview').max_length
+
+# Users columns cached on the inbox rows where they are the peer
+PEER_FIELDS = {
+    'username': 'peer_username',
+    'email': 'peer_email',
+    'display_name': 'peer_display_name',
+    'avatar': 'peer_avatar',
+    'created_at': 'peer_created_at',
+}
+
+
+def _peer_columns(peer):
+    return {column: getattr(peer, field) for field, column in PEER_FIELDS.items()}
+
+
+def ensure_inbox(dm_channel, message=None):
+    """
+    Create the missing inbox rows of a DM channel, with ``message`` as their
+    preview if given. Existing rows are left alone.
+    """
+    preview = _preview(message) if message is not None else {}
+    DMInbox.objects.bulk_create([
+        DMInbox(
+            user=user, dm_channel=dm_channel, peer=peer,
+            last_message_at=dm_channel.last_message_at,
+            **_peer_columns(peer), **preview
+        )
+        for user, peer in ((dm_channel.user1, dm_channel.user2), (dm_channel.user2, dm_channel.user1))
+    ], ignore_conflicts=True)
+
+
+def _preview(message):
+    return {
+        'last_message_id': message.message_id,
+        'last_message_author_id': message.user_channel_id_id,
+        'last_message_preview': (message.content or '')[:PREVIEW_LENGTH],
+    }
+
+
+def message_sent(message, sent_at):
+    """
+    Move a new direct message to the top of both participants' inboxes.
+    Call in the transaction that creates the message.
+    """
+    updated = DMInbox.objects.filter(dm_channel_id=message.dm_channel_id).update(
+        last_message_at=sent_at, **_preview(message)
+    )
+    if updated < 2:
+        ensure_inbox(message.dm_channel, message)
+
+
+def inbox(user):
+    """
+    The user's DM inbox, most recent conversation first, in one query. Each
+    row is annotated with ``unread_count`` from the user's read marker.
+    """
+    marker = ReadState.objects.filter(user=user, dm_channel=OuterRef('dm_channel_id')).values('last_read_message_id')
+    return (
+        DMInbox.objects
+        .filter(user=user)
+        .select_related('dm_channel')
+        .only('dm_channel__user1', 'dm_channel__user2', 'dm_channel__created_at',
+              'peer', *PEER_FIELDS.values(), 'last_message_id', 'last_message_author_id',
+              'last_message_preview', 'last_message_at')
+        .annotate(last_read=Coalesce(Subquery(marker), Value(0)))
+        .annotate(unread_count=count_unread(user, 'last_read', dm_channel_id='dm_channel_id'))
+        .order_by('-last_message_at', '-dm_channel_id')
+    )
+
+
+def peer(entry):
+    """An unsaved Users instance built from the cached peer columns of an inbox row"""
+    return Users(user_id=entry.peer_id, **{field: getattr(entry, column) for field, column in PEER_FIELDS.items()})
+
+
+# Signals to keep the inbox in step with channels and profiles
+@receiver(post_save, sender=DirectMessageChannel)
+def dm_channel_created(sender, instance=None, created=False, **kwargs):
+    if created:
+        ensure_inbox(instance)
+
+
+@receiver(post_save, sender=Users)
+def peer_changed(sender, instance=None, created=False, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not PEER_FIELDS.keys() & set(update_fields)):
+        return
+    DMInbox.objects.filter(peer=instance).update(**_peer_columns(instance))
@@ -0,0 +1,45 @@
+"""
+Helpers shared by the bench_* management commands.
+
+The benchmarks generate their data in the configured database, which in a
+deployment is the production one. They only ever create new rows, under a
+per-run prefix so they can't collide with real users or servers, inside a
+transaction that is rolled back at the end; and they refuse to run against
+anything but SQLite or a test database unless given --allow-database.
+"""
+import uuid
+from contextlib import contextmanager
+
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+
+
+def add_database_argument(parser):
+    parser.add_argument(
+        '--allow-database', action='store_true',
+        help='Run against a database that is not SQLite or a test database (the data is still rolled back)',
+    )
+
+
+def check_database(options):
+    """Raise CommandError unless the database is disposable or --allow-database was given"""
+    name = str(connection.settings_dict.get('NAME') or '')
+    if connection.vendor == 'sqlite' or name.startswith('test') or options['allow_database']:
+        return
+    raise CommandError(
+        f'Refusing to generate benchmark data in the {connection.vendor} database "{name}". '
+        f'Pass --allow-database to run anyway; everything generated is rolled back.'
+    )
+
+
+def run_prefix(name):
+    """A name prefix unique to this run, e.g. ``bench-search-1a2b3c4d-``"""
+    return f'bench-{name}-{uuid.uuid4().hex[:8]}-'
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction that is always rolled back"""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
@@ -0,0 +1,38 @@
+from datetime import timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.archive import archive_before, archive_enabled, archived_partitions, month_start, partition_name
+
+
+class Command(BaseCommand):
+    help = 'Move whole months of old messages from the message table to the compressed archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-months', type=int, default=6,
+                            help='Months (besides the current one) to keep in the message table')
+        parser.add_argument('--batch', type=int, default=5000, help='Messages moved per transaction')
+        parser.add_argument('--list', action='store_true', help='List the archive partitions and exit')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name in archived_partitions():
+                self.stdout.write(name)
+            return
+
+        # Archived messages are only visible to history reads with the archive
+        # enabled, so refuse to move anything out of sight
+        if not archive_enabled():
+            raise CommandError('Set MESSAGE_ARCHIVE_ENABLED = True before archiving messages')
+        if options['keep_months'] < 0:
+            raise CommandError('--keep-months must not be negative')
+
+        cutoff = month_start(timezone.now().astimezone(dt_timezone.utc))
+        for _ in range(options['keep_months']):
+            cutoff = month_start(cutoff - timedelta(days=1))
+
+        results = archive_before(cutoff, options['batch'])
+        for month, moved in results:
+            self.stdout.write(f'{month:%Y-%m}: archived {moved} messages into {partition_name(month)}')
+        self.stdout.write(f'Archived {sum(moved for _, moved in results)} messages sent before {cutoff:%Y-%m-%d}')
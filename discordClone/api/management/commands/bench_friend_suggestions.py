@@ -0,0 +1,100 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api.friendships import add_friendship, friend_ids
+from api.suggestions import refresh_all, refresh_stale, suggestions_for
+from friends.models import Friends
+from servers.models import Servers, ServerMember
+from users.models import Users
+
+
+class Command(BaseCommand):
+    help = 'Time the friend suggestion job and read path on a synthetic friendship graph'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--edges', type=int, default=1_000_000, help='Friendships in the generated graph')
+        parser.add_argument('--community', type=int, default=200,
+                            help='Users per community; each community shares a server')
+        parser.add_argument('--local', type=float, default=0.8,
+                            help='Share of friendships made within a community')
+        parser.add_argument('--batch', type=int, default=500, help='Users per refresh batch')
+        parser.add_argument('--changes', type=int, default=1000, help='New friendships for the incremental run')
+        parser.add_argument('--reads', type=int, default=2000, help='Suggestion reads to time')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        # Everything generated is rolled back at the end
+        with transaction.atomic():
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        count, community = options['users'], options['community']
+        self.stdout.write(f'Generating {count} users and {options["edges"]} friendships in {connection.vendor}...')
+        start = time.perf_counter()
+        Users.objects.bulk_create([
+            Users(username=f'bench-suggest-{i}', email=f'bench-suggest-{i}@example.com') for i in range(count)
+        ], batch_size=5000)
+        user_ids = list(Users.objects.filter(username__startswith='bench-suggest-').order_by('user_id')
+                        .values_list('user_id', flat=True))
+
+        pairs = set()
+        while len(pairs) < options['edges']:
+            a = rng.randrange(count)
+            if rng.random() < options['local']:
+                base = a - a % community
+                b = rng.randrange(base, min(base + community, count))
+            else:
+                b = rng.randrange(count)
+            if a != b:
+                pairs.add(Friends.ordered_pair(user_ids[a], user_ids[b]))
+        # bulk_create skips the signals, so nothing is queued for refresh
+        Friends.objects.bulk_create(
+            [Friends(users_id_id=a, user_friend_id_id=b) for a, b in pairs], batch_size=10_000
+        )
+        del pairs
+
+        for base in range(0, count, community):
+            members = user_ids[base:base + community]
+            server = Servers.objects.create(name=f'bench-suggest-{base}', owner_id_id=members[0], is_public=False)
+            ServerMember.objects.bulk_create([ServerMember(server=server, user_id=user_id) for user_id in members])
+            Servers.objects.filter(pk=server.pk).update(member_count=len(members))
+        self.stdout.write(f'Generated in {time.perf_counter() - start:.1f}s')
+
+        # Full run: every user
+        start = time.perf_counter()
+        users, rows = refresh_all(options['batch'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'Full refresh: {users} users, {rows} suggestions in {elapsed:.1f}s '
+                          f'({users / elapsed:.0f} users/s)')
+
+        # Incremental run: only the users around new friendships
+        users_by_id = Users.objects.in_bulk(rng.sample(user_ids, min(options['changes'] * 2, count)))
+        sample = list(users_by_id.values())
+        for i in range(0, len(sample) - 1, 2):
+            if sample[i].pk not in friend_ids(sample[i + 1].pk):
+                add_friendship(sample[i], sample[i + 1])
+        start = time.perf_counter()
+        users, rows = refresh_stale(options['batch'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'Incremental refresh after {len(sample) // 2} new friendships: {users} users, '
+                          f'{rows} suggestions in {elapsed:.1f}s')
+
+        # Read path: one indexed fetch per request, with the friend ids cached
+        readers = list(Users.objects.in_bulk(rng.sample(user_ids, min(options['reads'], count))).values())
+        for user in readers:
+            friend_ids(user.pk)
+        timings = []
+        for user in readers:
+            start = time.perf_counter()
+            suggestions_for(user)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        self.stdout.write(f'Reads: median {statistics.median(timings) * 1000:.2f} ms, '
+                          f'p99 {timings[int(len(timings) * 0.99)] * 1000:.2f} ms')
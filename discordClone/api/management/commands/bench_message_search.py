@@ -0,0 +1,107 @@
+import random
+import statistics
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.management.bench import add_database_argument, check_database, rolled_back, run_prefix
+from api.search import search_messages
+from channels.models import Channels
+from servers.models import Servers, ServerMember
+from user_messages.models import UserMessages
+from users.models import Users
+
+
+class Command(BaseCommand):
+    help = 'Generate a message corpus and compare full-text search against an icontains scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=3_000_000, help='Messages in the generated corpus')
+        parser.add_argument('--vocabulary', type=int, default=20_000, help='Distinct words in the corpus')
+        parser.add_argument('--batch', type=int, default=10_000, help='Messages per bulk insert')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query; the median is reported')
+        parser.add_argument('--seed', type=int, default=42)
+        add_database_argument(parser)
+
+    def handle(self, *args, **options):
+        check_database(options)
+        # Everything generated is rolled back at the end
+        with rolled_back():
+            self.run(options)
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        words = self.make_vocabulary(rng, options['vocabulary'])
+
+        name = run_prefix('search')
+        user = Users.objects.create(username=name, email=f'{name}@example.com')
+        server = Servers.objects.create(name=name, owner_id=user, is_public=False)
+        ServerMember.objects.create(server=server, user=user)
+        channel = Channels.objects.create(discord_server_id=server, name='bench-search')
+        self.generate(rng, words, channel, user, options['messages'], options['batch'])
+
+        # A frequent, a mid-frequency and a rare word, plus a two-word query
+        queries = [words[0], words[len(words) // 100], words[-1], f'{words[1]} {words[50]}']
+        self.stdout.write(f'{"query":<24} {"sort":<10} {"fts ms":>9} {"icontains ms":>13} {"hits":>5}')
+        for query in queries:
+            for sort in ('relevance', 'recent'):
+                fts, hits = self.time(options['repeat'], lambda: search_messages(
+                    query, limit=25, sort=sort, server_id=server.server_id
+                )[0])
+                scan, _ = self.time(options['repeat'], lambda: list(
+                    UserMessages.objects
+                    .filter(message_channel_id__discord_server_id=server, content__icontains=query)
+                    .order_by('-message_id')
+                    .values_list('message_id', flat=True)[:25]
+                ))
+                self.stdout.write(f'{query:<24} {sort:<10} {fts * 1000:9.2f} {scan * 1000:13.2f} {len(hits):5}')
+
+        # Paging deep into a frequent word's results stays a keyset range scan
+        cursor, pages = None, 0
+        start = time.perf_counter()
+        while pages < 20:
+            hits, cursor = search_messages(words[0], limit=50, sort='recent', cursor=cursor, server_id=server.server_id)
+            pages += 1
+            if cursor is None:
+                break
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'{pages} pages of "{words[0]}" by recency: {elapsed / pages * 1000:.2f} ms/page')
+
+    def make_vocabulary(self, rng, size):
+        words = set()
+        while len(words) < size:
+            words.add(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))))
+        return sorted(words, key=lambda word: rng.random())
+
+    def generate(self, rng, words, channel, user, count, batch_size):
+        # Zipf-like word frequencies, like natural text
+        cum_weights = []
+        total = 0.0
+        for rank in range(len(words)):
+            total += 1.0 / (rank + 1)
+            cum_weights.append(total)
+
+        self.stdout.write(f'Generating {count} messages in {connection.vendor}...')
+        start = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            size = min(batch_size, count - offset)
+            UserMessages.objects.bulk_create([
+                UserMessages(
+                    message_channel_id=channel,
+                    user_channel_id=user,
+                    content=' '.join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(4, 30)))
+                )
+                for _ in range(size)
+            ])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'Inserted {count} messages in {elapsed:.1f}s ({count / elapsed:.0f}/s, index maintained)')
+
+    def time(self, repeat, fn):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings), result
@@ -0,0 +1,94 @@
+import importlib.util
+import io
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from api.management.bench import add_database_argument, check_database, rolled_back, run_prefix
+from api.reactions import toggle_reaction
+from api.renderers import MessagePackParser, MessagePackRenderer, ORJSONParser, ORJSONRenderer
+from api.serializers import MessageSerializer
+from channels.models import Channels
+from servers.models import Servers, ServerMember
+from user_messages.models import UserMessages
+from users.models import Users
+
+EMOJIS = ['👍', '🎉', '😂', '❤️', '👀']
+
+
+class Command(BaseCommand):
+    help = 'Compare render and parse throughput of the API wire formats on MessageSerializer pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=100, help='Messages per rendered page')
+        parser.add_argument('--iterations', type=int, default=200, help='Pages rendered per run')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per format; the median is reported')
+        parser.add_argument('--seed', type=int, default=42)
+        add_database_argument(parser)
+
+    def handle(self, *args, **options):
+        check_database(options)
+        rng = random.Random(options['seed'])
+        prefix = run_prefix('render')
+        # The page is generated and serialized in a transaction that is rolled back
+        with rolled_back():
+            users = [
+                Users.objects.create(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com') for i in range(5)
+            ]
+            server = Servers.objects.create(name=prefix, owner_id=users[0], is_public=False)
+            for user in users:
+                ServerMember.objects.create(server=server, user=user)
+            channel = Channels.objects.create(discord_server_id=server, name='bench-render')
+
+            # A realistic page: varied content, mentions and reaction summaries
+            for _ in range(options['page_size']):
+                message = UserMessages.objects.create(
+                    message_channel_id=channel,
+                    user_channel_id=rng.choice(users),
+                    content=' '.join(rng.choice(['hello', 'world', 'déjà', 'vu', '🎉', 'lorem', 'ipsum'])
+                                     for _ in range(rng.randint(3, 40))),
+                )
+                message.mentions.add(*rng.sample(users, rng.randint(0, 2)))
+                for user in rng.sample(users, rng.randint(0, len(users))):
+                    toggle_reaction(message, user, rng.choice(EMOJIS))
+            data = MessageSerializer(
+                UserMessages.objects.filter(message_channel_id=channel).with_related(), many=True
+            ).data
+
+        formats = [
+            ('json (DRF)', JSONRenderer(), JSONParser()),
+            ('orjson', ORJSONRenderer(), ORJSONParser()),
+        ]
+        if importlib.util.find_spec('msgpack') is not None:
+            formats.append(('msgpack', MessagePackRenderer(), MessagePackParser()))
+        else:
+            self.stdout.write('msgpack is not installed; skipping MessagePack')
+
+        iterations = options['iterations']
+        self.stdout.write(f'{len(data)} messages per page, {iterations} pages per run')
+        self.stdout.write(f'{"format":<12} {"bytes":>8} {"render pages/s":>15} {"render MB/s":>12} {"parse pages/s":>14}')
+        baseline = None
+        for name, renderer, parser in formats:
+            body = renderer.render(data)
+            render = self.time(options['repeat'], iterations, lambda: renderer.render(data))
+            parse = self.time(options['repeat'], iterations, lambda: parser.parse(io.BytesIO(body)))
+            pages_per_second = iterations / render
+            baseline = baseline or pages_per_second
+            self.stdout.write(
+                f'{name:<12} {len(body):8} {pages_per_second:15.0f} '
+                f'{len(body) * iterations / render / 1e6:12.1f} {iterations / parse:14.0f}'
+                f'  ({pages_per_second / baseline:.1f}x)'
+            )
+
+    def time(self, repeat, iterations, fn):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                fn()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
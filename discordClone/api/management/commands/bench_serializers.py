@@ -0,0 +1,115 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.renderers import JSONRenderer
+
+from api.fast_serializers import FriendValuesSerializer, MessageValuesSerializer, ServerMemberValuesSerializer
+from api.friendships import friendships
+from api.management.bench import add_database_argument, check_database, rolled_back, run_prefix
+from api.reactions import toggle_reaction
+from api.serializers import FriendSerializer, MessageSerializer, ServerMemberSerializer
+from channels.models import Channels
+from friends.models import Friends
+from servers.models import Servers, ServerMember, ServerRole
+from user_messages.models import UserMessages
+from users.models import Users
+
+
+def friends_of(user_id):
+    """
+    What FriendListView would hand FriendSerializer: both halves of the
+    user's friendships, with the rows where they are user_friend_id
+    mirrored (in memory) so user_friend_id is always the other user.
+    """
+    lower, higher = friendships(user_id)
+    rows = list(lower.select_related('user_friend_id'))
+    for row in higher.select_related('users_id'):
+        row.user_friend_id = row.users_id
+        rows.append(row)
+    return sorted(rows, key=lambda row: row.friends_id)
+
+
+class Command(BaseCommand):
+    help = 'Compare the values fast-path serializers with the ModelSerializers on long lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000, help='Items per list')
+        parser.add_argument('--repeat', type=int, default=7, help='Runs per serializer; the median is reported')
+        add_database_argument(parser)
+
+    def handle(self, *args, **options):
+        check_database(options)
+        count = options['items']
+        prefix = run_prefix('ser')
+        self.stdout.write(f'Generating {count} users, members, friends and messages in {connection.vendor}...')
+        # Everything generated is rolled back at the end
+        with rolled_back():
+            Users.objects.bulk_create([
+                Users(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com', display_name=f'Bench {i}')
+                for i in range(count + 1)
+            ])
+            users = list(Users.objects.filter(username__startswith=prefix).order_by('user_id'))
+            # From the middle, so the owner's friendships are stored on both sides of the pair
+            others = users[:]
+            owner = others.pop(len(others) // 2)
+            server = Servers.objects.create(name=prefix, owner_id=owner, is_public=False)
+            self.run(options, server, owner, others)
+
+    def run(self, options, server, owner, others):
+        roles = [ServerRole.objects.create(server=server, name=f'role{i}', position=i) for i in range(3)]
+        ServerMember.objects.bulk_create([ServerMember(server=server, user=user) for user in others])
+        # bulk_create skips the counter signals
+        Servers.objects.filter(pk=server.pk).update(member_count=len(others))
+        Through = ServerMember.roles.through
+        Through.objects.bulk_create([
+            Through(servermember_id=member_id, serverrole_id=roles[i % 3].id)
+            for i, member_id in enumerate(ServerMember.objects.filter(server=server).values_list('id', flat=True))
+        ])
+        # Pairs are stored as (lower id, higher id), like friendships.add_friendship does
+        Friends.objects.bulk_create([
+            Friends(users_id_id=a, user_friend_id_id=b)
+            for a, b in (Friends.ordered_pair(owner.user_id, user.user_id) for user in others)
+        ])
+        channel = Channels.objects.create(discord_server_id=server, name='bench')
+        UserMessages.objects.bulk_create([
+            UserMessages(message_channel_id=channel, user_channel_id=user, content=f'Message {i} from {user.username}')
+            for i, user in enumerate(others)
+        ])
+        messages = UserMessages.objects.filter(message_channel_id=channel).order_by('message_id')
+        for message in messages[:len(others) // 10]:
+            toggle_reaction(message, owner, '👍')
+
+        request = type('Request', (), {'user': owner})()
+        members = ServerMember.objects.filter(server=server).order_by('id')
+        cases = [
+            ('messages',
+             lambda: MessageSerializer(messages.with_related(), many=True, context={'request': request}).data,
+             lambda: MessageValuesSerializer({'request': request}).serialize(messages)),
+            ('members',
+             lambda: ServerMemberSerializer(members.select_related('user').prefetch_related('roles'), many=True).data,
+             lambda: ServerMemberValuesSerializer().serialize(members)),
+            # FriendListView's UNION of both halves of the pair
+            ('friends',
+             lambda: FriendSerializer(friends_of(owner.user_id), many=True).data,
+             lambda: FriendValuesSerializer().serialize_friends_of(owner.user_id)),
+        ]
+
+        self.stdout.write(f'{"list":<10} {"items":>6} {"DRF ms":>9} {"values ms":>10} {"speedup":>8}')
+        for name, drf, fast in cases:
+            # Same bytes on the wire, or the comparison is meaningless
+            assert JSONRenderer().render(drf()) == JSONRenderer().render(fast()), f'{name} output differs'
+            drf_time = self.time(options['repeat'], drf)
+            fast_time = self.time(options['repeat'], fast)
+            self.stdout.write(
+                f'{name:<10} {len(fast()):6} {drf_time * 1000:9.1f} {fast_time * 1000:10.1f} {drf_time / fast_time:7.1f}x'
+            )
+
+    def time(self, repeat, fn):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory
+
+from api.authentication import CachedTokenAuthentication, invalidate_token
+from users.models import Users
+
+
+class Command(BaseCommand):
+    help = 'Compare per-request authentication overhead of stock and cached token authentication'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Authenticated requests per run')
+
+    def handle(self, *args, **options):
+        iterations = options['requests']
+
+        # Work on a throwaway user; everything is rolled back afterwards
+        with transaction.atomic():
+            user = Users.objects.create_user(
+                username='bench-token-auth',
+                email='bench-token-auth@example.com',
+                password='bench-password'
+            )
+            token, _ = Token.objects.get_or_create(user=user)
+            factory = APIRequestFactory()
+            request = factory.get('/api/profile/', HTTP_AUTHORIZATION=f'Token {token.key}')
+
+            for name, authenticator in [
+                ('TokenAuthentication', TokenAuthentication()),
+                ('CachedTokenAuthentication', CachedTokenAuthentication()),
+            ]:
+                invalidate_token(token.key)
+                elapsed, queries = self.run(authenticator, request, iterations)
+                self.stdout.write(
+                    f'{name:<28} {elapsed / iterations * 1e6:9.1f} us/request '
+                    f'{queries / iterations:6.2f} queries/request'
+                )
+
+            invalidate_token(token.key)
+            transaction.set_rollback(True)
+
+    def run(self, authenticator, request, iterations):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                user, _ = authenticator.authenticate(request)
+            elapsed = time.perf_counter() - start
+        return elapsed, len(ctx.captured_queries)
@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.transfer import CHUNK_SIZE, export_jsonl
+from servers.models import Servers
+
+
+class Command(BaseCommand):
+    help = 'Export a server with its members, channels, messages and reactions as JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('server_id', type=int)
+        parser.add_argument('-o', '--output', help='File to write to (default: standard output)')
+        parser.add_argument('--gzip', action='store_true', help='Compress the export with gzip')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Messages fetched per query')
+
+    def handle(self, *args, **options):
+        try:
+            server = Servers.objects.select_related('owner_id').get(pk=options['server_id'])
+        except Servers.DoesNotExist:
+            raise CommandError(f'Server {options["server_id"]} does not exist')
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for data in export_jsonl(server, compress=options['gzip'], chunk_size=options['chunk_size']):
+                output.write(data)
+        finally:
+            if options['output']:
+                output.close()
+        if options['output']:
+            self.stdout.write(f'Exported server {server.server_id} to {options["output"]}')
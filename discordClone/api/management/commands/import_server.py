@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.transfer import CHUNK_SIZE, TransferError, import_server, open_stream
+
+
+class Command(BaseCommand):
+    help = 'Import a server from a JSONL export (plain or gzip-compressed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Export file to import')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows per bulk insert')
+
+    def handle(self, *args, **options):
+        with open(options['path'], 'rb') as export:
+            try:
+                server, counts = import_server(open_stream(export), chunk_size=options['chunk_size'])
+            except TransferError as error:
+                raise CommandError(f'Import failed: {error}')
+
+        summary = ', '.join(f'{count} {name.replace("_", " ")}' for name, count in counts.items())
+        self.stdout.write(f'Imported server {server.server_id} ({server.name}): {summary}')
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.realtime import GatewayConnection, InProcessBroker, Subscription, channel_topic
+
+
+class Command(BaseCommand):
+    help = 'Measure WebSocket gateway fan-out latency with many concurrent in-memory sockets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=5000, help='Number of concurrent connections')
+        parser.add_argument('--channels', type=int, default=10, help='Number of channels the sockets are spread over')
+        parser.add_argument('--messages', type=int, default=200, help='Messages published per channel')
+        parser.add_argument('--rate', type=float, default=500.0, help='Messages published per second in total')
+
+    def handle(self, *args, **options):
+        results = asyncio.run(self.run(**options))
+        latencies = sorted(results['latencies'])
+        if not latencies:
+            self.stderr.write('No events were delivered')
+            return
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000
+
+        self.stdout.write(f"Sockets:            {options['sockets']}")
+        self.stdout.write(f"Channels:           {options['channels']}")
+        self.stdout.write(f"Messages published: {results['published']}")
+        self.stdout.write(f"Deliveries:         {len(latencies)} / {results['expected']}")
+        self.stdout.write(f"Throughput:         {len(latencies) / results['elapsed']:.0f} deliveries/s")
+        self.stdout.write(f"Latency mean:       {statistics.fmean(latencies) * 1000:.2f} ms")
+        self.stdout.write(f"Latency p50:        {percentile(50):.2f} ms")
+        self.stdout.write(f"Latency p95:        {percentile(95):.2f} ms")
+        self.stdout.write(f"Latency p99:        {percentile(99):.2f} ms")
+        self.stdout.write(f"Latency max:        {latencies[-1] * 1000:.2f} ms")
+
+    async def run(self, sockets, channels, messages, rate, **options):
+        broker = InProcessBroker()
+        published_at = {}
+        latencies = []
+        done = asyncio.Event()
+        expected = sum(
+            messages * len(range(channel, sockets, channels)) for channel in range(channels)
+        )
+
+        async def send(message):
+            if message['type'] == 'websocket.send':
+                latencies.append(time.perf_counter() - published_at[message['text']])
+                if len(latencies) >= expected:
+                    done.set()
+
+        async def receive():
+            await asyncio.Event().wait()
+
+        # Each socket runs the gateway's real write loop; authentication and
+        # the subscribe handshake are skipped since they don't affect fan-out
+        # (GatewayTests in api/tests.py covers them).
+        connections = []
+        for i in range(sockets):
+            connection = GatewayConnection({'type': 'websocket'}, receive, send, broker=broker)
+            connection.subscription = Subscription(maxsize=messages + 1)
+            broker.subscribe(channel_topic(i % channels), connection.subscription)
+            connections.append(asyncio.ensure_future(connection.write_loop()))
+
+        def publisher():
+            # Publish from a separate thread, like a sync Django view would
+            interval = 1.0 / rate
+            for n in range(messages):
+                for channel in range(channels):
+                    payload = json.dumps({
+                        'op': 'event',
+                        'type': 'message_create',
+                        'topic': channel_topic(channel),
+                        'data': {'message_id': n * channels + channel, 'content': 'x' * 64},
+                    })
+                    published_at[payload] = time.perf_counter()
+                    broker.publish_encoded(channel_topic(channel), payload)
+                    time.sleep(interval)
+
+        start = time.perf_counter()
+        thread = threading.Thread(target=publisher)
+        thread.start()
+        try:
+            await asyncio.wait_for(done.wait(), timeout=max(60.0, messages * channels / rate * 4))
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - start
+        await asyncio.get_running_loop().run_in_executor(None, thread.join)
+
+        for task in connections:
+            task.cancel()
+
+        return {
+            'latencies': latencies,
+            'expected': expected,
+            'published': messages * channels,
+            'elapsed': elapsed,
+        }
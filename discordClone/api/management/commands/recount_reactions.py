@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.reactions import recount_reactions
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-emoji reaction counters from the reaction rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('message_ids', nargs='*', type=int, help='Only recount these messages')
+
+    def handle(self, *args, **options):
+        written = recount_reactions(options['message_ids'] or None)
+        self.stdout.write(f'Wrote {written} reaction counters')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from servers.models import Servers
+
+
+class Command(BaseCommand):
+    help = 'Rewrite the member, role and invite counter columns of servers from the rows they count'
+
+    def add_arguments(self, parser):
+        parser.add_argument('server_ids', nargs='*', type=int, help='Only recount these servers')
+
+    def handle(self, *args, **options):
+        servers = Servers.objects.all()
+        if options['server_ids']:
+            servers = servers.filter(pk__in=options['server_ids'])
+        self.stdout.write(f'Recounted {servers.recount()} servers')
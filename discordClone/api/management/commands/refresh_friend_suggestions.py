@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.suggestions import refresh_all, refresh_stale
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored friend suggestions of users whose friends or servers changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recompute every active user, not just the queued ones')
+        parser.add_argument('--batch', type=int, default=500, help='Users recomputed per transaction')
+
+    def handle(self, *args, **options):
+        refresh = refresh_all if options['all'] else refresh_stale
+        users, rows = refresh(options['batch'])
+        self.stdout.write(f'Refreshed suggestions for {users} users ({rows} suggestions stored)')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.outbox import NotificationWorker
+
+
+class Command(BaseCommand):
+    help = 'Drain the notification outbox, writing coalesced notifications in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Write a single batch and exit')
+
+    def handle(self, *args, **options):
+        worker = NotificationWorker()
+        if options['once']:
+            written = worker.run_once()
+            self.stdout.write(f'Wrote {len(written)} notifications')
+            return
+
+        self.stdout.write('Notification worker running')
+        worker.run_forever()
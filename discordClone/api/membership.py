@@ -0,0 +1,183 @@
+"""
+Shared membership and permission resolver for server-scoped views.
+
+Resolving whether a user belongs to a server (and with which permissions)
+is cached per request and across requests in a bounded LRU keyed on
+(user, server). Entries are dropped by the signal receivers below when
+memberships, roles or servers change, both right away and again once the
+transaction commits (so a concurrent request can't re-cache the old row), and
+expire after MEMBERSHIP_CACHE_TTL seconds so that changes made by other worker
+processes are picked up; those can take up to that long to be seen there.
+"""
+import itertools
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from channels.models import Channels
+from servers.models import ALL_PERMISSIONS, ServerMember, ServerRole, Servers, has_permission
+
+from .cache import MISSING, LRUCache
+
+# Cached stand-in for "not a member", so misses are cached too
+NOT_MEMBER = object()
+
+_memberships = LRUCache(
+    maxsize=getattr(settings, 'MEMBERSHIP_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'MEMBERSHIP_CACHE_TTL', 30),
+)
+_channel_servers = LRUCache(
+    maxsize=getattr(settings, 'MEMBERSHIP_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'MEMBERSHIP_CACHE_TTL', 30),
+)
+
+# Bumping a server's generation invalidates every cached membership in it.
+# Generations are unique and increasing; servers without an entry (never
+# bumped, or evicted to bound the dict) are at the floor, which only rises,
+# so an evicted server can't come back to a generation it had cached under.
+_generations = OrderedDict()
+_generation_limit = getattr(settings, 'MEMBERSHIP_CACHE_SIZE', 10000)
+_generation_floor = 0
+_next_generation = itertools.count(1)
+_generations_lock = threading.Lock()
+
+
+class Membership:
+    """A user's resolved standing in a server"""
+    __slots__ = ('server_id', 'member_id', 'role', 'permission_mask')
+
+    def __init__(self, server_id, member_id, role, permission_mask):
+        self.server_id = server_id
+        self.member_id = member_id
+        self.role = role
+        self.permission_mask = permission_mask
+
+    @property
+    def is_member(self):
+        """False for an owner who has no ServerMember row"""
+        return self.member_id is not None
+
+    def has_permission(self, permission):
+        return has_permission(self.role, self.permission_mask, permission)
+
+
+def _generation(server_id):
+    return _generations.get(server_id, _generation_floor)
+
+
+def _bump_generation(server_id):
+    global _generation_floor
+    with _generations_lock:
+        _generations[server_id] = next(_next_generation)
+        _generations.move_to_end(server_id)
+        while len(_generations) > _generation_limit:
+            _, evicted = _generations.popitem(last=False)
+            _generation_floor = max(_generation_floor, evicted)
+
+
+def _delete_membership(user_id, server_id):
+    _memberships.delete((user_id, server_id, _generation(server_id)))
+
+
+def invalidate_server(server_id):
+    _bump_generation(server_id)
+    transaction.on_commit(lambda: _bump_generation(server_id))
+
+
+def invalidate_membership(user_id, server_id):
+    _delete_membership(user_id, server_id)
+    transaction.on_commit(lambda: _delete_membership(user_id, server_id))
+
+
+def _load_membership(user_id, server_id):
+    row = (
+        ServerMember.objects
+        .filter(server_id=server_id, user_id=user_id)
+        .values_list('pk', 'role', 'permission_mask')
+        .first()
+    )
+    if row is not None:
+        return Membership(server_id, *row)
+
+    # Server owners can see their server even without a ServerMember row
+    if Servers.objects.filter(pk=server_id, owner_id=user_id).exists():
+        return Membership(server_id, None, 'owner', ALL_PERMISSIONS)
+    return None
+
+
+def resolve_membership(request, server_id):
+    """
+    Return the requesting user's Membership in a server, or None when they
+    are not a member (or the server doesn't exist).
+    """
+    server_id = int(server_id)
+    user_id = request.user.pk
+
+    per_request = request.__dict__.setdefault('_memberships', {})
+    if server_id in per_request:
+        return per_request[server_id]
+
+    key = (user_id, server_id, _generation(server_id))
+    membership = _memberships.get(key)
+    if membership is MISSING:
+        membership = _load_membership(user_id, server_id)
+        _memberships.set(key, NOT_MEMBER if membership is None else membership)
+    elif membership is NOT_MEMBER:
+        membership = None
+
+    per_request[server_id] = membership
+    return membership
+
+
+def resolve_channel_server(channel_id):
+    """Return the server_id a text channel belongs to, or None if it doesn't exist"""
+    channel_id = int(channel_id)
+    server_id = _channel_servers.get(channel_id)
+    if server_id is MISSING:
+        server_id = (
+            Channels.objects
+            .filter(channel_id=channel_id)
+            .values_list('discord_server_id', flat=True)
+            .first()
+        )
+        if server_id is None:
+            # Don't cache misses; the channel may be created any moment
+            return None
+        _channel_servers.set(channel_id, server_id)
+    return server_id
+
+
+# Signals to invalidate cached memberships
+@receiver(post_save, sender=ServerMember)
+@receiver(post_delete, sender=ServerMember)
+def membership_changed(sender, instance=None, **kwargs):
+    invalidate_membership(instance.user_id, instance.server_id)
+
+
+@receiver(post_save, sender=ServerRole)
+@receiver(post_delete, sender=ServerRole)
+def server_role_changed(sender, instance=None, **kwargs):
+    invalidate_server(instance.server_id)
+
+
+@receiver(m2m_changed, sender=ServerMember.roles.through)
+def member_roles_changed(sender, instance=None, action=None, reverse=False, **kwargs):
+    if action.startswith('post_'):
+        invalidate_server(instance.server_id)
+
+
+@receiver(post_save, sender=Servers)
+@receiver(post_delete, sender=Servers)
+def server_changed(sender, instance=None, **kwargs):
+    # Ownership may have changed or the server may be gone
+    invalidate_server(instance.pk)
+
+
+@receiver(post_delete, sender=Channels)
+def channel_deleted(sender, instance=None, **kwargs):
+    _channel_servers.delete(instance.channel_id)
+    transaction.on_commit(lambda: _channel_servers.delete(instance.channel_id))
@@ -0,0 +1,130 @@
+"""
+Mention parsing for channel messages.
+
+``@username`` tokens are resolved to server members and stored in
+UserMessages.mentions. ``@role`` and ``@everyone`` can reach thousands of
+members, so they are not expanded in the request: the author's notification
+is queued once and the outbox worker expands it to the audience in batches.
+Members who blocked the author are not notified either way.
+"""
+import re
+from collections import defaultdict
+
+from django.db.models import CharField, Value
+
+from servers.models import ServerMember, ServerRole
+from user_messages.models import UserMessages
+
+from .blocks import blockers_of
+from .outbox import enqueue_fanout, enqueue_notification
+
+MENTION_RE = re.compile(r'(?<![\w@])@([\w.+-]+)')
+EVERYONE = 'everyone'
+# Usernames may contain these, but a mention ending in one is usually followed by punctuation
+TRAILING_PUNCTUATION = '.+-'
+
+
+def parse_mentions(content):
+    """
+    Return the set of names mentioned in ``content``, without the ``@``.
+    Names keep any trailing punctuation; resolve_mentions falls back to the
+    name without it.
+    """
+    return set(MENTION_RE.findall(content or ''))
+
+
+def _spellings(name):
+    """The name as written, then without trailing punctuation (``@bob.`` -> ``bob``)"""
+    stripped = name.rstrip(TRAILING_PUNCTUATION)
+    return (name, stripped) if stripped and stripped != name else (name,)
+
+
+def mentions_everyone(names):
+    return any(EVERYONE in _spellings(name) for name in names)
+
+
+def resolve_mentions(server_id, names):
+    """
+    Resolve mentioned names in one query.
+
+    Returns ``(user_ids, role_ids)``: members of the server whose username
+    was mentioned and roles of the server whose name was mentioned. A name
+    that matches nothing as written is looked up without its trailing
+    punctuation.
+    """
+    names = {name for name in names if not mentions_everyone([name])}
+    lookup = {spelling for name in names for spelling in _spellings(name)}
+    if not lookup:
+        return set(), set()
+
+    users = (
+        ServerMember.objects
+        .filter(server_id=server_id, user__username__in=lookup)
+        .order_by()
+        .values_list(Value('user', output_field=CharField()), 'user_id', 'user__username')
+    )
+    roles = (
+        ServerRole.objects
+        .filter(server_id=server_id, name__in=lookup)
+        .order_by()
+        .values_list(Value('role', output_field=CharField()), 'id', 'name')
+    )
+    found = defaultdict(list)
+    for kind, pk, name in users.union(roles, all=True):
+        found[name].append((kind, pk))
+
+    user_ids, role_ids = set(), set()
+    for name in names:
+        spelling = next((spelling for spelling in _spellings(name) if spelling in found), None)
+        for kind, pk in found.get(spelling, ()):
+            (user_ids if kind == 'user' else role_ids).add(pk)
+    return user_ids, role_ids
+
+
+def process_mentions(message, server_id):
+    """
+    Record the mentions in a newly created channel message and queue the
+    mention notifications. Returns the ids of the directly mentioned users
+    to notify (those who blocked the author are left out).
+    """
+    names = parse_mentions(message.content)
+    if not names:
+        return set()
+
+    author = message.user_channel_id
+    user_ids, role_ids = resolve_mentions(server_id, names)
+    user_ids.discard(author.user_id)
+
+    if user_ids:
+        Mention = UserMessages.mentions.through
+        Mention.objects.bulk_create(
+            [Mention(usermessages_id=message.message_id, users_id=user_id) for user_id in user_ids],
+            ignore_conflicts=True
+        )
+        user_ids -= blockers_of(author.user_id, user_ids)
+
+    notification = {
+        'notification_type': 'mention',
+        'title': 'New Mention',
+        'content': f'{author.username} mentioned you',
+        'message_id': message.message_id,
+        'channel_id': message.message_channel_id_id,
+    }
+    for user_id in user_ids:
+        enqueue_notification(user_id=user_id, server_id=server_id, **notification)
+
+    mention_everyone = mentions_everyone(names)
+    if mention_everyone or role_ids:
+        enqueue_fanout(
+            server_id=server_id,
+            role_ids=None if mention_everyone else sorted(role_ids),
+            exclude_user_ids=sorted(user_ids | {author.user_id}),
+            author_id=author.user_id,
+            **notification
+        )
+
+    if mention_everyone:
+        message.mention_everyone = True
+        UserMessages.objects.filter(pk=message.pk).update(mention_everyone=True)
+
+    return user_ids
@@ -3,6 +3,7 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 from users.models import Users
+from notifications.models import Notifications
 
 # Create your models here.
 class UserProfile(models.Model):
@@ -46,3 +47,21 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
             import logging
             logger = logging.getLogger(__name__)
             logger.error(f"Error creating token or profile for user {instance.username}: {str(e)}")
+
+# Signal to push new notifications to the user's notification stream
+@receiver(post_save, sender=Notifications)
+def publish_notification(sender, instance=None, created=False, **kwargs):
+    """
+    Publish a newly created notification to its recipient's live stream
+
+    Args:
+        sender: The model class that sent the signal
+        instance: The notification being saved
+        created: Boolean indicating if this is a new instance
+        kwargs: Additional keyword arguments
+    """
+    if created:
+        from .realtime import publish_event, user_topic
+        from .serializers import NotificationSerializer
+
+        publish_event(user_topic(instance.user_id_id), 'notification', NotificationSerializer(instance).data)
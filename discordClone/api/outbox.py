@@ -0,0 +1,298 @@
+"""
+Notification outbox.
+
+Views don't write Notifications rows themselves; they enqueue a lightweight
+event once their transaction commits. A worker drains the queue, coalesces
+bursts (several DMs from the same sender become one "N new messages"
+notification) and writes each batch with a single bulk_create. Fan-out
+events (e.g. an @everyone mention) are expanded to their recipients by the
+worker, in chunks, rather than in the request.
+
+By default the queue is an in-process stand-in and the worker runs as a
+daemon thread. Setting NOTIFICATION_QUEUE_URL to a ``redis://`` URL uses a
+Redis list instead, which ``manage.py run_notification_worker`` can drain
+from a separate process.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+
+from notifications.models import Notifications
+from servers.models import ServerMember
+
+from .read_states import bump_mentions
+from .realtime import publish_event, user_topic
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_FIELDS = ('notification_type', 'title', 'content', 'message_id', 'friend_request_id', 'channel_id', 'server_id')
+
+
+class LocalQueue:
+    """In-process queue stand-in"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def put(self, event):
+        self._queue.put(event)
+
+    def get_batch(self, max_items, window):
+        """
+        Block for the first event, then keep collecting for up to ``window``
+        seconds (or until ``max_items``) so bursts land in the same batch.
+        """
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + window
+        while len(batch) < max_items:
+            remaining = deadline - time.monotonic()
+            try:
+                # Past the deadline, still take whatever is already queued
+                batch.append(self._queue.get(block=remaining > 0, timeout=max(remaining, 0) or None))
+            except queue.Empty:
+                break
+        return batch
+
+
+class RedisQueue:
+    """Queue backed by a Redis list. Requires the optional ``redis`` package."""
+
+    def __init__(self, url, key='discordclone:notification-outbox'):
+        import redis
+
+        self.key = key
+        self._client = redis.Redis.from_url(url)
+
+    def put(self, event):
+        self._client.lpush(self.key, json.dumps(event))
+
+    def get_batch(self, max_items, window):
+        _, first = self._client.brpop(self.key)
+        batch = [json.loads(first)]
+        deadline = time.monotonic() + window
+        while len(batch) < max_items:
+            item = self._client.rpop(self.key)
+            if item is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                time.sleep(min(0.05, remaining))
+                continue
+            batch.append(json.loads(item))
+        return batch
+
+
+_queue = None
+_worker = None
+_lock = threading.RLock()
+
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        with _lock:
+            if _queue is None:
+                url = getattr(settings, 'NOTIFICATION_QUEUE_URL', None)
+                _queue = RedisQueue(url) if url else LocalQueue()
+    return _queue
+
+
+def coalesce(events):
+    """
+    Merge events that share a ``group`` key into one notification.
+
+    The newest event of a group supplies the related objects; when more than
+    one event was merged its ``group_title``/``group_content`` are used, with
+    ``{count}`` filled in.
+    """
+    groups = {}
+    for event in events:
+        key = event.get('group') or id(event)
+        if key in groups:
+            merged = groups[key]
+            merged['count'] += 1
+            merged['event'] = event
+        else:
+            groups[key] = {'event': event, 'count': 1}
+
+    merged_events = []
+    for group in groups.values():
+        event = dict(group['event'])
+        if group['count'] > 1:
+            event['title'] = event.get('group_title', event['title'])
+            event['content'] = event.get('group_content', event['content']).format(count=group['count'])
+        merged_events.append(event)
+    return merged_events
+
+
+def _insert_notifications(notifications):
+    """Bulk insert notifications and publish them to the notification streams"""
+    try:
+        with transaction.atomic():
+            Notifications.objects.bulk_create(notifications)
+    except IntegrityError:
+        # Something referenced by the batch was deleted after it was queued;
+        # write the rest one by one and drop the ones that no longer fit
+        written = []
+        for notification in notifications:
+            try:
+                with transaction.atomic():
+                    notification.save(force_insert=True)
+                written.append(notification)
+            except IntegrityError:
+                logger.warning(f"Dropped notification for user {notification.user_id_id}: related object is gone")
+        # save() already published these through post_save
+        return written
+
+    # bulk_create skips post_save, so push to the notification streams here
+    from .serializers import NotificationSerializer
+    for notification in notifications:
+        if notification.pk is not None:
+            publish_event(user_topic(notification.user_id_id), 'notification', NotificationSerializer(notification).data)
+    return notifications
+
+
+def _build(event, user_id):
+    return Notifications(user_id_id=user_id, **{field: event.get(field) for field in NOTIFICATION_FIELDS})
+
+
+def expand_audience(event, chunk_size):
+    """Yield the user ids a fan-out event is addressed to, ``chunk_size`` at a time"""
+    members = ServerMember.objects.filter(server_id=event['server_id'])
+    if event.get('role_ids') is not None:
+        members = members.filter(roles__in=event['role_ids'])
+    if event.get('author_id') is not None:
+        members = members.exclude(user__blocked_users__blocked_user_id=event['author_id'])
+    user_ids = (
+        members
+        .exclude(user_id__in=event.get('exclude_user_ids') or [])
+        .values_list('user_id', flat=True)
+        .distinct()
+        .order_by('user_id')
+    )
+
+    last_id = 0
+    while True:
+        chunk = list(user_ids.filter(user_id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]
+
+
+def write_notifications(events, chunk_size=None):
+    """
+    Coalesce a batch of events and write them with bulk inserts.
+
+    Events addressed to a single user are written together; fan-out events
+    (role and @everyone mentions) are expanded and written ``chunk_size``
+    recipients at a time.
+    """
+    chunk_size = chunk_size or getattr(settings, 'NOTIFICATION_BATCH_SIZE', 500)
+    direct = [event for event in events if 'audience' not in event]
+    written = _insert_notifications([_build(event, event['user_id']) for event in coalesce(direct)])
+
+    for event in events:
+        if 'audience' in event:
+            for user_ids in expand_audience(event['audience'], chunk_size):
+                written += _insert_notifications([_build(event, user_id) for user_id in user_ids])
+                if event['notification_type'] == 'mention' and event.get('channel_id'):
+                    # Role and @everyone mentions count towards mention badges too
+                    bump_mentions(user_ids, channel_id=event['channel_id'])
+    return written
+
+
+class NotificationWorker:
+    """Drains the outbox queue in batches"""
+
+    def __init__(self, outbox=None):
+        self.queue = outbox or get_queue()
+        self.max_batch = getattr(settings, 'NOTIFICATION_BATCH_SIZE', 500)
+        self.window = getattr(settings, 'NOTIFICATION_COALESCE_WINDOW', 1.0)
+
+    def run_once(self):
+        events = self.queue.get_batch(self.max_batch, self.window)
+        close_old_connections()
+        try:
+            return write_notifications(events)
+        except Exception as e:
+            logger.error(f"Failed to write {len(events)} notifications: {str(e)}")
+            return []
+        finally:
+            close_old_connections()
+
+    def run_forever(self):
+        while True:
+            self.run_once()
+
+
+def start_worker():
+    """Start the in-process worker thread if it isn't running yet"""
+    global _worker
+    if _worker is None:
+        with _lock:
+            if _worker is None:
+                _worker = threading.Thread(
+                    target=NotificationWorker().run_forever,
+                    name='notification-outbox-worker',
+                    daemon=True
+                )
+                _worker.start()
+
+
+def enqueue_notification(user_id, notification_type, title, content, group=None,
+                         group_title=None, group_content=None, **related):
+    """
+    Queue a notification to be written after the current transaction commits.
+
+    ``related`` takes message_id, friend_request_id, channel_id and server_id.
+    Events with the same ``group`` in one batch are merged, using
+    ``group_title`` and ``group_content`` (which may contain ``{count}``).
+    """
+    event = {
+        'user_id': user_id,
+        'notification_type': notification_type,
+        'title': title,
+        'content': content,
+        **related,
+    }
+    if group is not None:
+        event.update(group=group, group_title=group_title or title, group_content=group_content or content)
+    _enqueue(event)
+
+
+def enqueue_fanout(server_id, notification_type, title, content, role_ids=None,
+                   exclude_user_ids=(), author_id=None, **related):
+    """
+    Queue one notification per member of a server (or of ``role_ids`` in it),
+    leaving out members who blocked ``author_id``.
+
+    The recipients are only looked up by the worker, so mentioning a large
+    audience costs the request a single queued event.
+    """
+    event = {
+        'audience': {
+            'server_id': server_id,
+            'role_ids': list(role_ids) if role_ids is not None else None,
+            'exclude_user_ids': list(exclude_user_ids),
+            'author_id': author_id,
+        },
+        'notification_type': notification_type,
+        'title': title,
+        'content': content,
+        'server_id': server_id,
+        **related,
+    }
+    _enqueue(event)
+
+
+def _enqueue(event):
+    if getattr(settings, 'NOTIFICATION_WORKER_IN_PROCESS', True):
+        start_worker()
+    outbox = get_queue()
+    transaction.on_commit(lambda: outbox.put(event))
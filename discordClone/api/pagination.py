@@ -0,0 +1,183 @@
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+class BoundedLimitPagination(BasePagination):
+    """Base for the keyset paginators: a ``limit`` parameter capped at max_limit"""
+    default_limit = 50
+    max_limit = 100
+
+    def get_limit(self, request):
+        limit = request.query_params.get('limit')
+        if limit is None:
+            return self.default_limit
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValidationError({'limit': 'Limit must be an integer'})
+        return max(1, min(limit, self.max_limit))
+
+    def get_paginated_response(self, data):
+        # Pages are returned as plain lists; clients page by passing the
+        # first or last ID back as the cursor.
+        return Response(data)
+
+
+class MessageCursorPagination(BoundedLimitPagination):
+    """
+    Keyset pagination for message history.
+
+    Pages are anchored on a message_id instead of an offset, so every page is a
+    single range scan over the (channel, time_stamp, message_id) index no matter
+    how deep into the history it is. Query parameters:
+
+        before=<message_id>  messages older than the anchor
+        after=<message_id>   messages newer than the anchor
+        around=<message_id>  messages on both sides of the anchor (inclusive)
+        limit=<n>            page size, capped at max_limit
+
+    With no anchor the most recent page is returned. Results are always in
+    chronological order.
+
+    If the view has a ``get_archive_queryset()`` returning a queryset, the
+    history continues into the message archive: each page is read from both
+    tiers with the same keyset and merged.
+    """
+    anchor_params = ('before', 'after', 'around')
+
+    def get_anchor(self, request):
+        anchors = [(name, request.query_params[name]) for name in self.anchor_params
+                   if name in request.query_params]
+        if not anchors:
+            return None, None
+        if len(anchors) > 1:
+            raise ValidationError({'error': 'Only one of before, after or around may be given'})
+
+        name, value = anchors[0]
+        try:
+            return name, int(value)
+        except ValueError:
+            raise ValidationError({name: 'Must be a message ID'})
+
+    def get_tiers(self, queryset, view):
+        archive = getattr(view, 'get_archive_queryset', None)
+        archive = archive() if archive is not None else None
+        return [queryset] if archive is None else [queryset, archive]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        limit = self.get_limit(request)
+        direction, anchor_id = self.get_anchor(request)
+        tiers = self.get_tiers(queryset, view)
+
+        if direction is None:
+            return self._older(tiers, None, limit)
+
+        # Resolve the anchor's position within this channel's history
+        anchor_ts = None
+        for tier in tiers:
+            anchor_ts = tier.filter(message_id=anchor_id).values_list('time_stamp', flat=True).first()
+            if anchor_ts is not None:
+                break
+        if anchor_ts is None:
+            raise NotFound('Message not found')
+        anchor = (anchor_ts, anchor_id)
+
+        if direction == 'before':
+            return self._older(tiers, anchor, limit)
+        if direction == 'after':
+            return self._newer(tiers, anchor, limit)
+
+        # around: the anchor itself plus up to half a page on either side
+        older = self._older(tiers, anchor, limit // 2)
+        newer = self._newer(tiers, anchor, limit - len(older) - 1, inclusive=True)
+        return older + newer
+
+    @staticmethod
+    def _merge(pages, limit, reverse):
+        if len(pages) == 1:
+            return pages[0]
+        merged = sorted(
+            (message for page in pages for message in page),
+            key=lambda message: (message.time_stamp, message.message_id),
+            reverse=reverse,
+        )
+        return merged[:limit]
+
+    def _older(self, tiers, anchor, limit):
+        if limit <= 0:
+            return []
+        pages = []
+        for queryset in tiers:
+            if anchor is not None:
+                ts, message_id = anchor
+                queryset = queryset.filter(Q(time_stamp__lt=ts) | Q(time_stamp=ts, message_id__lt=message_id))
+            pages.append(list(queryset.order_by('-time_stamp', '-message_id')[:limit]))
+        page = self._merge(pages, limit, reverse=True)
+        page.reverse()
+        return page
+
+    def _newer(self, tiers, anchor, limit, inclusive=False):
+        if limit < 0:
+            return []
+        ts, message_id = anchor
+        if inclusive:
+            keyset = Q(time_stamp=ts, message_id__gte=message_id)
+            limit += 1
+        else:
+            keyset = Q(time_stamp=ts, message_id__gt=message_id)
+        pages = [
+            list(queryset.filter(Q(time_stamp__gt=ts) | keyset).order_by('time_stamp', 'message_id')[:limit])
+            for queryset in tiers
+        ]
+        return self._merge(pages, limit, reverse=False)
+
+
+class MessageSearchPagination(BoundedLimitPagination):
+    """
+    Page size for message search. The keyset cursor itself is handled by
+    api.search, since it depends on the sort order.
+    """
+    default_limit = 25
+    max_limit = 50
+
+
+class ServerCursorPagination(BoundedLimitPagination):
+    """
+    Keyset pagination for a user's server list, ordered by server_id.
+
+    ``after=<server_id>`` returns the servers following that one.
+    """
+    default_limit = 200
+    max_limit = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        limit = self.get_limit(request)
+        after = request.query_params.get('after')
+        if after is not None:
+            try:
+                queryset = queryset.filter(server_id__gt=int(after))
+            except ValueError:
+                raise ValidationError({'after': 'Must be a server ID'})
+        return list(queryset.order_by('server_id')[:limit])
+
+
+class UserCursorPagination(BoundedLimitPagination):
+    """
+    Keyset pagination for browsing users, ordered by user_id.
+
+    ``after=<user_id>`` returns the users following that one.
+    """
+    default_limit = 20
+    max_limit = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        limit = self.get_limit(request)
+        after = request.query_params.get('after')
+        if after is not None:
+            try:
+                queryset = queryset.filter(user_id__gt=int(after))
+            except ValueError:
+                raise ValidationError({'after': 'Must be a user ID'})
+        return list(queryset.order_by('user_id')[:limit])
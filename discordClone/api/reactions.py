@@ -0,0 +1,174 @@
+"""
+Reaction summaries for message lists.
+
+Rather than emitting one object per MessageReaction row, messages carry one
+summary per emoji: the total count, whether the requesting user reacted, and
+the first few reactors. Summaries for a whole page of messages are built with
+a fixed number of grouped queries.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Min, Window
+from django.db.models.functions import Greatest, RowNumber
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from user_messages.models import MessageReaction, MessageReactionCount, UserMessages
+
+# Number of reacting users included with each emoji summary
+REACTION_SAMPLE_SIZE = 3
+
+
+def use_reaction_counters():
+    return getattr(settings, 'REACTION_COUNTERS_ENABLED', True)
+
+
+def toggle_reaction(message, user, emoji):
+    """
+    Add the user's reaction to a message, or remove it if it already exists.
+
+    Keeps MessageReactionCount in step with the reaction rows (removals go
+    through reaction_deleted below). Returns a ``(reaction, created)`` tuple;
+    ``reaction`` is None when it was removed.
+    """
+    with transaction.atomic():
+        reaction, created = MessageReaction.objects.get_or_create(
+            message=message,
+            user=user,
+            emoji=emoji
+        )
+
+        if created:
+            counter, _ = MessageReactionCount.objects.select_for_update().get_or_create(
+                message=message,
+                emoji=emoji
+            )
+            MessageReactionCount.objects.filter(pk=counter.pk).update(count=F('count') + 1)
+            return reaction, True
+
+        reaction.delete()
+        return None, False
+
+
+def recount_reactions(message_ids=None):
+    """
+    Rebuild MessageReactionCount from the reaction rows, for all messages or
+    just ``message_ids``. Returns the number of counters written.
+    """
+    reactions = MessageReaction.objects.all()
+    counters = MessageReactionCount.objects.all()
+    if message_ids is not None:
+        reactions = reactions.filter(message_id__in=message_ids)
+        counters = counters.filter(message_id__in=message_ids)
+    rows = (
+        reactions
+        .values('message_id', 'emoji')
+        .annotate(total=Count('reaction_id'), first_at=Min('created_at'))
+        .order_by()
+    )
+    with transaction.atomic():
+        counters.delete()
+        created = MessageReactionCount.objects.bulk_create([
+            MessageReactionCount(message_id=row['message_id'], emoji=row['emoji'],
+                                 count=row['total'], created_at=row['first_at'])
+            for row in rows
+        ], batch_size=1000)
+    return len(created)
+
+
+def _emoji_counts(message_ids):
+    """Return ``{message_id: [(emoji, count), ...]}`` in first-reacted order"""
+    if use_reaction_counters():
+        rows = (
+            MessageReactionCount.objects
+            .filter(message_id__in=message_ids, count__gt=0)
+            .order_by('created_at', 'id')
+            .values_list('message_id', 'emoji', 'count')
+        )
+    else:
+        rows = (
+            MessageReaction.objects
+            .filter(message_id__in=message_ids)
+            .values('message_id', 'emoji')
+            .annotate(total=Count('reaction_id'), first_at=Min('created_at'))
+            .order_by('first_at')
+            .values_list('message_id', 'emoji', 'total')
+        )
+
+    counts = defaultdict(list)
+    for message_id, emoji, count in rows:
+        counts[message_id].append((emoji, count))
+    return counts
+
+
+def _reactor_samples(message_ids):
+    """Return ``{(message_id, emoji): [user, ...]}`` with the earliest reactors"""
+    rows = (
+        MessageReaction.objects
+        .filter(message_id__in=message_ids)
+        .annotate(position=Window(
+            expression=RowNumber(),
+            partition_by=[F('message_id'), F('emoji')],
+            order_by=[F('created_at').asc(), F('reaction_id').asc()],
+        ))
+        .filter(position__lte=REACTION_SAMPLE_SIZE)
+        .order_by('message_id', 'emoji', 'position')
+        .values_list('message_id', 'emoji', 'user_id', 'user__username')
+    )
+
+    samples = defaultdict(list)
+    for message_id, emoji, user_id, username in rows:
+        samples[(message_id, emoji)].append({'user_id': user_id, 'username': username})
+    return samples
+
+
+def summarize_reactions(message_ids, user=None):
+    """
+    Build reaction summaries for a page of messages.
+
+    Returns ``{message_id: [{'emoji', 'count', 'me', 'users'}, ...]}``. Messages
+    without reactions are absent from the result.
+    """
+    message_ids = list(message_ids)
+    if not message_ids:
+        return {}
+
+    counts = _emoji_counts(message_ids)
+    if not counts:
+        return {}
+
+    samples = _reactor_samples(message_ids)
+
+    own = set()
+    if user is not None and user.is_authenticated:
+        own = set(
+            MessageReaction.objects
+            .filter(message_id__in=message_ids, user=user)
+            .values_list('message_id', 'emoji')
+        )
+
+    summaries = {}
+    for message_id, emojis in counts.items():
+        summaries[message_id] = [
+            {
+                'emoji': emoji,
+                'count': count,
+                'me': (message_id, emoji) in own,
+                'users': samples.get((message_id, emoji), []),
+            }
+            for emoji, count in emojis
+        ]
+    return summaries
+
+
+# Signals to keep the counters in step with deleted reactions
+@receiver(post_delete, sender=MessageReaction)
+def reaction_deleted(sender, instance=None, origin=None, **kwargs):
+    # Deleting the message takes its counters with it
+    if isinstance(origin, UserMessages) or getattr(origin, 'model', None) is UserMessages:
+        return
+    counters = MessageReactionCount.objects.filter(message_id=instance.message_id, emoji=instance.emoji)
+    counters.update(count=Greatest(F('count') - 1, 0))
+    counters.filter(count=0).delete()
@@ -0,0 +1,178 @@
+"""
+Read markers and unread badges for text channels and DM channels.
+
+Each ReadState row stores the last message a user has read in a channel
+together with a mention counter. Mentions only touch the mentioned users'
+rows, so the counter is bumped when a message is created and recomputed when
+the user moves their marker. Unread counts are not stored: bumping them would
+write a row per member for every message, so they are counted from the
+marker when badges are read, stopping at UNREAD_COUNT_LIMIT. Channels keep
+their newest message_id, so a channel is unread whenever its last_message_id
+is past the user's marker, even without a ReadState row.
+"""
+from django.db.models import Case, CharField, F, FilteredRelation, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from channels.models import Channels, DirectMessageChannel, ReadState
+from servers.models import ServerMember
+from user_messages.models import UserMessages
+
+# Unread counts stop here; clients show "100+"
+UNREAD_COUNT_LIMIT = 100
+
+
+class CappedCount(Subquery):
+    """COUNT(*) over a sliced queryset, so counting stops at its LIMIT"""
+    template = '(SELECT COUNT(*) FROM (%(subquery)s) capped)'
+    output_field = IntegerField()
+
+
+def unread_messages(user, channel_id=None, dm_channel_id=None, after=0):
+    """Messages in a channel or DM channel after ``after`` that the user did not write"""
+    if channel_id is not None:
+        messages = UserMessages.objects.filter(message_channel_id=channel_id)
+    else:
+        messages = UserMessages.objects.filter(dm_channel_id=dm_channel_id)
+    return messages.filter(message_id__gt=after).exclude(user_channel_id=user).order_by()
+
+
+def count_unread(user, after, **outer):
+    """
+    Expression counting the user's unread messages in the outer channel, up
+    to UNREAD_COUNT_LIMIT. ``after`` names the outer marker column and
+    ``outer`` the outer channel column as ``channel_id`` or ``dm_channel_id``;
+    the count is only run when the outer last_message_id is past the marker.
+    """
+    target = {key: OuterRef(field) for key, field in outer.items()}
+    messages = unread_messages(user, after=OuterRef(after), **target).values('pk')[:UNREAD_COUNT_LIMIT]
+    return Case(When(last_message_id__gt=F(after), then=CappedCount(messages)), default=0, output_field=IntegerField())
+
+
+def _target(channel_id=None, dm_channel_id=None):
+    if channel_id is not None:
+        return {'channel_id': channel_id}
+    return {'dm_channel_id': dm_channel_id}
+
+
+def _ensure_states(user_ids, **target):
+    ReadState.objects.bulk_create(
+        [ReadState(user_id=user_id, **target) for user_id in user_ids],
+        ignore_conflicts=True
+    )
+
+
+def bump_mentions(user_ids, channel_id=None, dm_channel_id=None):
+    """Count a new mention for each user"""
+    if not user_ids:
+        return
+    target = _target(channel_id, dm_channel_id)
+    _ensure_states(user_ids, **target)
+    ReadState.objects.filter(user_id__in=user_ids, **target).update(mention_count=F('mention_count') + 1)
+
+
+def message_created(message, mentioned_user_ids=()):
+    """
+    Update read state for a new message: the channel's newest message moves
+    to it, mentioned users (and the recipient of a DM) gain a mention, and
+    the author's own marker moves to the message. Other readers' rows are
+    not touched; their unread counts follow from last_message_id.
+    """
+    author_id = message.user_channel_id_id
+    if message.dm_channel_id:
+        target = {'dm_channel_id': message.dm_channel_id}
+        DirectMessageChannel.objects.filter(pk=message.dm_channel_id).update(last_message_id=message.message_id)
+        dm_channel = message.dm_channel
+        # Every direct message counts as a mention of the recipient
+        mentioned_user_ids = {dm_channel.user1_id, dm_channel.user2_id} - {author_id}
+    else:
+        target = {'channel_id': message.message_channel_id_id}
+        Channels.objects.filter(pk=message.message_channel_id_id).update(last_message_id=message.message_id)
+
+    bump_mentions(list(mentioned_user_ids), **target)
+
+    _ensure_states([author_id], **target)
+    ReadState.objects.filter(user_id=author_id, **target).update(
+        last_read_message_id=message.message_id, mention_count=0
+    )
+
+
+def mark_read(user, message_id, channel_id=None, dm_channel_id=None):
+    """
+    Move a user's read marker to ``message_id`` and recompute their mention
+    count from the messages after it. Markers never move backwards. The
+    returned state carries the (capped) ``unread_count`` after its marker.
+    """
+    target = _target(channel_id, dm_channel_id)
+    state, _ = ReadState.objects.get_or_create(user=user, **target)
+    if message_id > state.last_read_message_id:
+        state.last_read_message_id = message_id
+        messages = unread_messages(user, after=message_id, **target)
+        if dm_channel_id is not None:
+            state.mention_count = messages.count()
+        else:
+            state.mention_count = messages.filter(Q(mentions=user) | Q(mention_everyone=True)).distinct().count()
+        state.save(update_fields=['last_read_message_id', 'mention_count', 'updated_at'])
+
+    messages = unread_messages(user, after=state.last_read_message_id, **target)
+    state.unread_count = messages[:UNREAD_COUNT_LIMIT].count()
+    return state
+
+
+def badges(user):
+    """
+    Read state for every text channel and DM channel the user can see, as
+    one UNION query. Every column is an expression so both halves select
+    them in the same order. Unread counts are only run for channels whose
+    newest message is past the marker.
+    """
+    channels = (
+        Channels.objects
+        # Like resolve_membership, owners see their servers without a member row
+        .filter(
+            Q(discord_server_id__in=ServerMember.objects.filter(user=user).values('server'))
+            | Q(discord_server_id__owner_id=user)
+        )
+        .annotate(state=FilteredRelation('read_states', condition=Q(read_states__user=user)))
+        .annotate(last_read=Coalesce('state__last_read_message_id', 0))
+        .order_by()
+        .values_list(
+            Value('channel', output_field=CharField()),
+            F('channel_id'),
+            F('discord_server_id'),
+            F('last_message_id'),
+            F('last_read'),
+            count_unread(user, 'last_read', channel_id='channel_id'),
+            Coalesce('state__mention_count', 0),
+        )
+    )
+    dm_channels = (
+        DirectMessageChannel.objects
+        .filter(Q(user1=user) | Q(user2=user))
+        .annotate(state=FilteredRelation('read_states', condition=Q(read_states__user=user)))
+        .annotate(last_read=Coalesce('state__last_read_message_id', 0))
+        .order_by()
+        .values_list(
+            Value('dm', output_field=CharField()),
+            F('dm_channel_id'),
+            Value(None, output_field=IntegerField()),
+            F('last_message_id'),
+            F('last_read'),
+            count_unread(user, 'last_read', dm_channel_id='dm_channel_id'),
+            Coalesce('state__mention_count', 0),
+        )
+    )
+
+    result = {'channels': [], 'dm_channels': []}
+    for kind, pk, server_id, last_message_id, last_read, unread_count, mention_count in channels.union(dm_channels, all=True):
+        badge = {
+            'last_message_id': last_message_id,
+            'last_read_message_id': last_read,
+            'unread': bool(last_message_id and last_message_id > last_read),
+            'unread_count': unread_count,
+            'mention_count': mention_count,
+        }
+        if kind == 'channel':
+            result['channels'].append({'channel_id': pk, 'server_id': server_id, **badge})
+        else:
+            result['dm_channels'].append({'dm_channel_id': pk, **badge})
+    return result
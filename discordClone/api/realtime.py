@@ -0,0 +1,419 @@
+"""
+Real-time event fan-out.
+
+Views publish message events to a topic per text channel (``channel:<id>``) or
+DM conversation (``dm:<id>``), and notifications to a topic per user
+(``user:<id>``). The WebSocket gateway mounted in asgi.py subscribes connected
+clients to the topics they ask for and pushes every event on them; the
+notification stream serves the user topics over Server-Sent Events.
+
+By default events are fanned out in-process. Setting ``REALTIME_BROKER_URL``
+to a ``redis://`` URL relays them through Redis pub/sub (or any local
+Redis-compatible server), so every worker process sees every event.
+
+Access is checked when a client subscribes and again whenever the user may
+have lost it: removing a server member publishes a revalidate message on the
+user's ``gateway:<id>`` topic, and every gateway connection of that user
+re-checks its subscriptions and drops the ones it can no longer see.
+
+Like the message lists, the gateway hides messages and reactions from the
+users a client blocked. Blocking or unblocking someone revalidates the
+blocker's connections, which reload their block list from the database.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from friends.models import BlockedUser
+from servers.models import ServerMember
+
+logger = logging.getLogger(__name__)
+
+GATEWAY_PATH = '/ws/gateway/'
+
+# Close codes sent to clients
+CLOSE_UNAUTHORIZED = 4001
+CLOSE_NOT_FOUND = 4004
+CLOSE_SLOW_CONSUMER = 4008
+
+
+def channel_topic(channel_id):
+    return f'channel:{channel_id}'
+
+
+def dm_topic(dm_channel_id):
+    return f'dm:{dm_channel_id}'
+
+
+def user_topic(user_id):
+    return f'user:{user_id}'
+
+
+def gateway_topic(user_id):
+    return f'gateway:{user_id}'
+
+
+# Control message telling a user's gateway connections to re-check access
+REVALIDATE = json.dumps({'op': 'revalidate'})
+
+# Event types whose data names the user behind them, and where
+MESSAGE_EVENTS = {'message_create', 'message_update'}
+REACTION_EVENTS = {'reaction_add', 'reaction_remove'}
+
+
+class Subscription:
+    """
+    A connection's inbox.
+
+    Bound to the event loop that reads from it; ``deliver`` may be called from
+    any thread (sync views publish from worker threads).
+    """
+
+    def __init__(self, maxsize=1000):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.topics = set()
+        self.overflowed = False
+
+    def deliver(self, payload):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is self.loop:
+            self._put(payload)
+        else:
+            self.loop.call_soon_threadsafe(self._put, payload)
+
+    def _put(self, payload):
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            # The client can't keep up; the gateway will disconnect it
+            self.overflowed = True
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InProcessBroker:
+    """Topic-based pub/sub between threads and event loops of one process"""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic, subscription):
+        with self._lock:
+            self._subscribers[topic].add(subscription)
+        subscription.topics.add(topic)
+
+    def unsubscribe(self, topic, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[topic]
+        subscription.topics.discard(topic)
+
+    def unsubscribe_all(self, subscription):
+        for topic in list(subscription.topics):
+            self.unsubscribe(topic, subscription)
+
+    def publish(self, topic, event):
+        """Encode an event once and hand it to every subscriber of the topic"""
+        payload = event if isinstance(event, str) else json.dumps(event, cls=DjangoJSONEncoder)
+        self.publish_encoded(topic, payload)
+
+    def publish_encoded(self, topic, payload):
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for subscription in subscribers:
+            subscription.deliver(payload)
+
+    def subscriber_count(self, topic):
+        with self._lock:
+            return len(self._subscribers.get(topic, ()))
+
+
+class RedisBroker(InProcessBroker):
+    """
+    Relays events through Redis pub/sub.
+
+    Publishes go to Redis; a listener thread forwards everything on the
+    ``prefix*`` pattern to the local subscribers, so fan-out to sockets stays
+    in-process. Requires the optional ``redis`` package.
+    """
+
+    def __init__(self, url, prefix='discordclone:'):
+        super().__init__()
+        import redis
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._listener = threading.Thread(target=self._listen, name='realtime-redis-listener', daemon=True)
+        self._listener.start()
+
+    def publish(self, topic, event):
+        payload = event if isinstance(event, str) else json.dumps(event, cls=DjangoJSONEncoder)
+        self._client.publish(self.prefix + topic, payload)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + '*')
+                for message in pubsub.listen():
+                    topic = message['channel'].decode()[len(self.prefix):]
+                    self.publish_encoded(topic, message['data'].decode())
+            except Exception as e:
+                logger.error(f"Realtime Redis listener error: {str(e)}")
+                time.sleep(1)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Return the process-wide broker configured by REALTIME_BROKER_URL"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                url = getattr(settings, 'REALTIME_BROKER_URL', None)
+                _broker = RedisBroker(url) if url else InProcessBroker()
+    return _broker
+
+
+def publish_event(topic, event_type, data):
+    """Publish an event once the surrounding transaction commits"""
+    event = {'op': 'event', 'type': event_type, 'topic': topic, 'data': data}
+    transaction.on_commit(lambda: get_broker().publish(topic, event))
+
+
+def message_topic(message):
+    if message.message_channel_id_id:
+        return channel_topic(message.message_channel_id_id)
+    return dm_topic(message.dm_channel_id)
+
+
+def publish_message_event(event_type, message, data):
+    publish_event(message_topic(message), event_type, data)
+
+
+def request_revalidation(user_id):
+    """Make the user's gateway connections re-check their subscriptions once the transaction commits"""
+    transaction.on_commit(lambda: get_broker().publish(gateway_topic(user_id), REVALIDATE))
+
+
+# WebSocket gateway
+
+@sync_to_async
+def authenticate_token(token_key):
+    """Return the active user owning an auth token, or None"""
+    from rest_framework.exceptions import AuthenticationFailed
+    from .authentication import CachedTokenAuthentication
+
+    try:
+        user, _ = CachedTokenAuthentication().authenticate_credentials(token_key)
+    except AuthenticationFailed:
+        return None
+    return user
+
+
+@sync_to_async
+def _resolve_topic(user, request):
+    """Return the topic the user asked for, or None if they can't see it"""
+    from channels.models import Channels, DirectMessageChannel
+    from servers.models import ServerMember
+
+    try:
+        channel_id = int(request['channel_id']) if request.get('channel_id') is not None else None
+        dm_channel_id = int(request['dm_channel_id']) if request.get('dm_channel_id') is not None else None
+    except (TypeError, ValueError):
+        return None
+
+    if channel_id is not None:
+        channel = Channels.objects.select_related('discord_server_id').filter(channel_id=channel_id).first()
+        if channel is None:
+            return None
+        server = channel.discord_server_id
+        if server.owner_id_id != user.pk and not ServerMember.objects.filter(server=server, user=user).exists():
+            return None
+        return channel_topic(channel.channel_id)
+
+    if dm_channel_id is not None:
+        dm_channel = DirectMessageChannel.objects.filter(dm_channel_id=dm_channel_id).first()
+        if dm_channel is None or user.pk not in (dm_channel.user1_id, dm_channel.user2_id):
+            return None
+        return dm_topic(dm_channel.dm_channel_id)
+
+    return None
+
+
+@sync_to_async
+def _load_blocked_ids(user_id):
+    """The users ``user_id`` blocked, fresh from the database rather than this process's cache"""
+    from .blocks import blocked_ids, invalidate_blocks
+
+    invalidate_blocks(user_id)
+    return set(blocked_ids(user_id))
+
+
+def event_user_id(payload):
+    """The author of a message event or the reacting user of a reaction event, else None"""
+    event = json.loads(payload)
+    data = event.get('data') or {}
+    if event.get('type') in MESSAGE_EVENTS:
+        return (data.get('author') or {}).get('user_id')
+    if event.get('type') in REACTION_EVENTS:
+        return data.get('user_id')
+    return None
+
+
+class GatewayConnection:
+    """
+    One WebSocket client.
+
+    Clients connect to ``/ws/gateway/?token=<auth token>`` and send
+    ``{"op": "subscribe", "channel_id": 1}`` or
+    ``{"op": "subscribe", "dm_channel_id": 1}`` (and ``"unsubscribe"``) to
+    choose which conversations they receive events for.
+    """
+
+    def __init__(self, scope, receive, send, broker=None):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.broker = broker or get_broker()
+        self.user = None
+        self.subscription = None
+        # topic -> the subscribe request that resolved to it
+        self.requests = {}
+        # Users whose messages and reactions are not forwarded
+        self.blocked = set()
+
+    async def send_json(self, data):
+        await self.send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+    async def close(self, code=1000):
+        await self.send({'type': 'websocket.close', 'code': code})
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+
+        if self.scope.get('path') != GATEWAY_PATH:
+            await self.close(CLOSE_NOT_FOUND)
+            return
+
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        token_key = query.get('token', [None])[0]
+        self.user = await authenticate_token(token_key) if token_key else None
+        if self.user is None:
+            await self.close(CLOSE_UNAUTHORIZED)
+            return
+
+        await self.send({'type': 'websocket.accept'})
+        self.blocked = await _load_blocked_ids(self.user.pk)
+        self.subscription = Subscription()
+        self.broker.subscribe(gateway_topic(self.user.pk), self.subscription)
+
+        reader = asyncio.ensure_future(self.read_loop())
+        writer = asyncio.ensure_future(self.write_loop())
+        try:
+            await asyncio.wait([reader, writer], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            reader.cancel()
+            writer.cancel()
+            self.broker.unsubscribe_all(self.subscription)
+
+    async def read_loop(self):
+        while True:
+            message = await self.receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            if message['type'] != 'websocket.receive' or not message.get('text'):
+                continue
+
+            try:
+                request = json.loads(message['text'])
+            except ValueError:
+                await self.send_json({'op': 'error', 'error': 'Invalid JSON'})
+                continue
+            await self.handle(request)
+
+    async def handle(self, request):
+        op = request.get('op')
+        if op not in ('subscribe', 'unsubscribe'):
+            await self.send_json({'op': 'error', 'error': f'Unknown op: {op}'})
+            return
+
+        topic = await _resolve_topic(self.user, request)
+        if topic is None:
+            await self.send_json({'op': 'error', 'error': 'Channel not found or access denied'})
+            return
+
+        if op == 'subscribe':
+            self.requests[topic] = request
+            self.broker.subscribe(topic, self.subscription)
+            await self.send_json({'op': 'subscribed', 'topic': topic})
+        else:
+            self.requests.pop(topic, None)
+            self.broker.unsubscribe(topic, self.subscription)
+            await self.send_json({'op': 'unsubscribed', 'topic': topic})
+
+    async def revalidate(self):
+        """Reload the block list and drop the subscriptions the user no longer has access to"""
+        self.blocked = await _load_blocked_ids(self.user.pk)
+        for topic, request in list(self.requests.items()):
+            if await _resolve_topic(self.user, request) != topic:
+                del self.requests[topic]
+                self.broker.unsubscribe(topic, self.subscription)
+                await self.send_json({'op': 'unsubscribed', 'topic': topic, 'reason': 'Access revoked'})
+
+    async def write_loop(self):
+        while True:
+            payload = await self.subscription.get()
+            if self.subscription.overflowed:
+                await self.close(CLOSE_SLOW_CONSUMER)
+                return
+            if payload == REVALIDATE:
+                await self.revalidate()
+                continue
+            # Only clients that blocked someone pay for decoding events
+            if self.blocked and event_user_id(payload) in self.blocked:
+                continue
+            await self.send({'type': 'websocket.send', 'text': payload})
+
+
+async def gateway_application(scope, receive, send):
+    """ASGI application serving the WebSocket gateway"""
+    await GatewayConnection(scope, receive, send).run()
+
+
+# Signals to re-check gateway subscriptions when a user may have lost access
+@receiver(post_delete, sender=ServerMember)
+def member_removed(sender, instance=None, **kwargs):
+    request_revalidation(instance.user_id)
+
+
+@receiver(post_save, sender=BlockedUser)
+@receiver(post_delete, sender=BlockedUser)
+def block_changed(sender, instance=None, **kwargs):
+    request_revalidation(instance.user_id)
@@ -0,0 +1,103 @@
+"""
+Faster wire formats for the API.
+
+``ORJSONRenderer`` and ``ORJSONParser`` are drop-in replacements for DRF's
+JSON renderer and parser backed by orjson, which encodes serializer output
+several times faster than the standard library. The output decodes to the
+same values as JSONRenderer's compact output and is byte-for-byte the same
+for everything but floats: orjson writes ``1e16`` where json writes
+``1e+16``, and writes NaN and infinities as ``null`` where JSONRenderer
+raises. Values orjson doesn't handle natively (datetimes, decimals, lazy
+strings, ...) go through DRF's own encoder, and data orjson can't encode at
+all (e.g. integers wider than 64 bits) is rendered by JSONRenderer. Pretty
+printed responses (``Accept: application/json; indent=4`` and the browsable
+API) and deployments without orjson fall back to the stock implementation.
+
+``MessagePackRenderer`` and ``MessagePackParser`` add an opt-in
+``application/msgpack`` format for clients that ask for it in ``Accept`` /
+``Content-Type``; they need the msgpack package. Streamed lists (see
+api.streaming) are always JSON and answer 406 when only MessagePack is
+acceptable.
+
+All of them are enabled through REST_FRAMEWORK in settings.py.
+"""
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+_encoder = JSONEncoder()
+
+# Datetimes go through DRF's encoder, so e.g. UTC is written as "Z" like before
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+
+def _default(obj):
+    return _encoder.default(obj)
+
+
+def dumps(data):
+    """Encode ``data`` as compact JSON bytes, like JSONRenderer (see above for the differences)"""
+    if orjson is None:
+        return JSONRenderer().render(data)
+    try:
+        ret = orjson.dumps(data, default=_default, option=ORJSON_OPTIONS)
+    except orjson.JSONEncodeError:
+        return JSONRenderer().render(data)
+    # Keep the output a strict JavaScript subset, like JSONRenderer does
+    if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+        ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return ret
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+class ORJSONParser(JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        import msgpack
+
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        import msgpack
+
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as exc:
+            raise ParseError('MessagePack parse error - %s' % str(exc))
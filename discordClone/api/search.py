@@ -0,0 +1,179 @@
+"""
+Full-text search over message content.
+
+Backed by the index created in user_messages migration 0007: a generated
+``search_vector`` tsvector column with a GIN index on PostgreSQL, and the
+``user_messages_search`` FTS5 table on SQLite. Results are ranked by
+relevance (or by recency), paged with a keyset cursor and come with a
+highlighted snippet of the matching content.
+"""
+import html
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection
+
+from channels.models import Channels
+from user_messages.models import UserMessages
+
+SEARCH_CONFIG = 'english'
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_STOP = '</mark>'
+SORTS = ('relevance', 'recent')
+
+_MESSAGES = UserMessages._meta.db_table
+_CHANNELS = Channels._meta.db_table
+_TERM_RE = re.compile(r'\w+')
+# Private-use characters marking highlights until the snippet is escaped
+_START, _STOP = '\ue000', '\ue001'
+_HEADLINE_OPTIONS = f'StartSel="{_START}", StopSel="{_STOP}", MaxFragments=2, MaxWords=24, MinWords=8'
+
+
+class SearchUnavailable(Exception):
+    """The database backend has no full-text index"""
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _scope_sql(channel_id=None, dm_channel_id=None, server_id=None):
+    channel_column = UserMessages._meta.get_field('message_channel_id').column
+    if channel_id is not None:
+        return f'm.{channel_column} = %s', [channel_id]
+    if dm_channel_id is not None:
+        return f'm.{UserMessages._meta.get_field("dm_channel").column} = %s', [dm_channel_id]
+    server_column = Channels._meta.get_field('discord_server_id').column
+    return f'm.{channel_column} IN (SELECT channel_id FROM {_CHANNELS} WHERE {server_column} = %s)', [server_id]
+
+
+def parse_cursor(cursor, sort):
+    """
+    Cursors are ``<message_id>`` for recent and ``<rank>:<message_id>`` for
+    relevance. Ranks are passed back exactly as the database produced them
+    (numeric on PostgreSQL, a round-tripping float repr on SQLite), so the
+    keyset comparison is exact.
+    """
+    try:
+        if sort == 'recent':
+            return None, int(cursor)
+        rank, message_id = cursor.split(':')
+        return Decimal(rank), int(message_id)
+    except (ValueError, InvalidOperation):
+        raise InvalidCursor('Invalid cursor')
+
+
+def make_cursor(rank, message_id, sort):
+    if sort == 'recent':
+        return str(message_id)
+    return f'{rank}:{message_id}'
+
+
+def _fts_query(query):
+    # Quote every term so FTS5 query syntax in user input is taken literally
+    return ' '.join(f'"{term}"' for term in _TERM_RE.findall(query))
+
+
+def _match_sql(vendor, query):
+    """Return (from/where SQL, params, rank SQL, message id SQL) matching ``query``"""
+    if vendor == 'postgresql':
+        return (
+            f'{_MESSAGES} m, websearch_to_tsquery(%s::regconfig, %s) q WHERE m.search_vector @@ q',
+            [SEARCH_CONFIG, query],
+            'ts_rank_cd(m.search_vector, q)::numeric',
+            'm.message_id',
+        )
+    if vendor == 'sqlite':
+        return (
+            f'user_messages_search s JOIN {_MESSAGES} m ON m.message_id = s.rowid WHERE user_messages_search MATCH %s',
+            [_fts_query(query)],
+            '-bm25(user_messages_search)',
+            # FTS5 can walk its own rowids in order and stop at the LIMIT
+            's.rowid',
+        )
+    raise SearchUnavailable(f'Full-text search is not available on {vendor}')
+
+
+def _snippets(vendor, query, message_ids):
+    """Highlighted excerpts of the matching messages, HTML-escaped apart from the highlights"""
+    if not message_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(message_ids))
+    if vendor == 'postgresql':
+        sql = (
+            f"SELECT message_id, ts_headline(%s::regconfig, content, websearch_to_tsquery(%s::regconfig, %s), %s) "
+            f"FROM {_MESSAGES} WHERE message_id IN ({placeholders})"
+        )
+        params = [SEARCH_CONFIG, SEARCH_CONFIG, query, _HEADLINE_OPTIONS, *message_ids]
+    else:
+        sql = (
+            "SELECT rowid, snippet(user_messages_search, 0, %s, %s, '…', 24) "
+            f"FROM user_messages_search WHERE user_messages_search MATCH %s AND rowid IN ({placeholders})"
+        )
+        params = [_START, _STOP, _fts_query(query), *message_ids]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    return {
+        message_id: html.escape(snippet).replace(_START, HIGHLIGHT_START).replace(_STOP, HIGHLIGHT_STOP)
+        for message_id, snippet in rows
+    }
+
+
+def search_messages(query, limit, sort='relevance', cursor=None, channel_id=None, dm_channel_id=None, server_id=None):
+    """
+    Search messages in one channel, DM channel or server.
+
+    Returns ``(hits, next_cursor)`` where each hit is a dict with the
+    message_id, its rank and a highlighted snippet, best match first (or
+    newest first, unranked, when sorting by recency). Relevance has to rank
+    every match, so very common terms are cheaper to page by recency.
+    """
+    vendor = connection.vendor
+    if vendor == 'sqlite' and not _TERM_RE.search(query):
+        return [], None
+
+    match_sql, params, rank_sql, id_sql = _match_sql(vendor, query)
+    scope_sql, scope_params = _scope_sql(channel_id, dm_channel_id, server_id)
+    rank = message_id = None
+    if cursor is not None:
+        rank, message_id = parse_cursor(cursor, sort)
+        if vendor == 'sqlite' and rank is not None:
+            rank = float(rank)
+
+    if sort == 'recent':
+        # Newest first needs no ranking, so the scan can stop after a page
+        keyset_sql, keyset_params = ('', []) if cursor is None else (f'AND {id_sql} < %s', [message_id])
+        sql = (
+            f'SELECT {id_sql}, NULL FROM {match_sql} AND {scope_sql} {keyset_sql} '
+            f'ORDER BY {id_sql} DESC LIMIT %s'
+        )
+    else:
+        keyset_sql, keyset_params = '', []
+        if cursor is not None:
+            keyset_sql = 'WHERE hits.score < %s OR (hits.score = %s AND hits.message_id < %s)'
+            keyset_params = [rank, rank, message_id]
+        sql = (
+            f'SELECT hits.message_id, hits.score FROM ('
+            f'SELECT m.message_id AS message_id, {rank_sql} AS score FROM {match_sql} AND {scope_sql}'
+            f') hits {keyset_sql} ORDER BY hits.score DESC, hits.message_id DESC LIMIT %s'
+        )
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, [*params, *scope_params, *keyset_params, limit])
+        rows = db_cursor.fetchall()
+
+    snippets = _snippets(vendor, query, [message_id for message_id, _ in rows])
+    hits = [
+        {
+            'message_id': message_id,
+            'rank': float(rank) if rank is not None else None,
+            'snippet': snippets.get(message_id, ''),
+        }
+        for message_id, rank in rows
+    ]
+    next_cursor = None
+    if len(rows) == limit:
+        last_id, last_rank = rows[-1]
+        next_cursor = make_cursor(last_rank, last_id, sort)
+    return hits, next_cursor
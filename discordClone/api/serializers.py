@@ -1,11 +1,14 @@
 from rest_framework import serializers
 from users.models import Users
 from servers.models import Servers, ServerMember, ServerRole, ServerInvite
-from channels.models import Channels, DirectMessageChannel
-from user_messages.models import UserMessages, MessageReaction
-from friends.models import Friends, FriendRequest, BlockedUser
+from channels.models import Channels, DirectMessageChannel, DMInbox
+from user_messages.models import UserMessages, MessageReaction, ArchivedMessage
+from friends.models import Friends, FriendRequest, BlockedUser, FriendSuggestion
 from notifications.models import Notifications
 from .models import UserProfile
+from .archive import parse_archived_datetime, unpack
+from .inbox import peer
+from .reactions import summarize_reactions
 
 # User Serializers
 class UserSerializer(serializers.ModelSerializer):
@@ -73,15 +76,66 @@ class DirectMessageChannelSerializer(serializers.ModelSerializer):
         model = DirectMessageChannel
         fields = ['dm_channel_id', 'user1', 'user2', 'user1_details', 'user2_details', 'created_at', 'last_message_at']
 
+class DMInboxSerializer(serializers.ModelSerializer):
+    """
+    A DMInbox row in the shape of DirectMessageChannelSerializer, plus the
+    peer, a preview of the newest message and the unread count. The
+    participants' details come from the cached peer columns and the
+    requesting user, so no users are loaded.
+    """
+    user1 = serializers.ReadOnlyField(source='dm_channel.user1_id')
+    user2 = serializers.ReadOnlyField(source='dm_channel.user2_id')
+    user1_details = serializers.SerializerMethodField()
+    user2_details = serializers.SerializerMethodField()
+    created_at = serializers.DateTimeField(source='dm_channel.created_at', read_only=True)
+    peer = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+    # Annotated by api.inbox.inbox()
+    unread_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = DMInbox
+        fields = ['dm_channel_id', 'user1', 'user2', 'user1_details', 'user2_details', 'created_at',
+                  'last_message_at', 'peer', 'last_message', 'unread_count']
+        read_only_fields = fields
+
+    def _details(self, obj, user_id):
+        if user_id == obj.peer_id:
+            return UserSerializer(peer(obj)).data
+        return UserSerializer(self.context['request'].user).data
+
+    def get_user1_details(self, obj):
+        return self._details(obj, obj.dm_channel.user1_id)
+
+    def get_user2_details(self, obj):
+        return self._details(obj, obj.dm_channel.user2_id)
+
+    def get_peer(self, obj):
+        return {
+            'user_id': obj.peer_id,
+            'username': obj.peer_username,
+            'display_name': obj.peer_display_name,
+            'avatar': obj.peer_avatar,
+        }
+
+    def get_last_message(self, obj):
+        if obj.last_message_id is None:
+            return None
+        return {
+            'message_id': obj.last_message_id,
+            'author_id': obj.last_message_author_id,
+            'preview': obj.last_message_preview,
+        }
+
 # Server Role Serializer
 class ServerRoleSerializer(serializers.ModelSerializer):
     class Meta:
         model = ServerRole
         fields = ['id', 'server', 'name', 'color', 'position', 'is_default',
                  'manage_channels', 'manage_server', 'manage_roles', 'manage_messages',
-                 'kick_members', 'ban_members', 'create_invites',
+                 'kick_members', 'ban_members', 'create_invites', 'permissions',
                  'created_at', 'updated_at']
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['permissions', 'created_at', 'updated_at']
 
 # Server Invite Serializer
 class ServerInviteSerializer(serializers.ModelSerializer):
@@ -125,13 +179,21 @@ class ServerSerializer(serializers.ModelSerializer):
                  'is_public', 'invite_code', 'created_at', 'updated_at', 'channels',
                  'member_count', 'roles_count', 'invites_count']
 
+    # The counts are annotated by Servers.objects.with_counts(); fall back to
+    # counting for servers that were loaded without it.
     def get_member_count(self, obj):
+        if hasattr(obj, 'num_members'):
+            return obj.num_members
         return ServerMember.objects.filter(server=obj).count()
 
     def get_roles_count(self, obj):
+        if hasattr(obj, 'num_roles'):
+            return obj.num_roles
         return ServerRole.objects.filter(server=obj).count()
 
     def get_invites_count(self, obj):
+        if hasattr(obj, 'num_invites'):
+            return obj.num_invites
         return ServerInvite.objects.filter(server=obj).count()
 
 class ServerCreateSerializer(serializers.ModelSerializer):
@@ -176,14 +238,70 @@ class MessageReactionSerializer(serializers.ModelSerializer):
         model = MessageReaction
         fields = ['reaction_id', 'message', 'user', 'username', 'emoji', 'created_at']
 
+class MessageListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Build reaction summaries for the whole page in one pass
+        messages = list(data.all() if hasattr(data, 'all') else data)
+        request = self.context.get('request')
+        self.context['reaction_summaries'] = summarize_reactions(
+            [message.message_id for message in messages],
+            getattr(request, 'user', None)
+        )
+        return super().to_representation(messages)
+
 class MessageSerializer(serializers.ModelSerializer):
     author = UserSerializer(source='user_channel_id', read_only=True)
-    reactions = MessageReactionSerializer(many=True, read_only=True)
+    reactions = serializers.SerializerMethodField()
 
     class Meta:
         model = UserMessages
         fields = ['message_id', 'message_channel_id', 'dm_channel', 'author', 'content', 'attachment_url',
-                 'attachment_type', 'is_edited', 'edited_at', 'is_pinned', 'reactions', 'time_stamp']
+                 'attachment_type', 'is_edited', 'edited_at', 'is_pinned', 'reactions', 'mentions',
+                 'mention_everyone', 'time_stamp']
+        read_only_fields = ['mentions', 'mention_everyone']
+        list_serializer_class = MessageListSerializer
+
+    def get_reactions(self, obj):
+        summaries = self.context.get('reaction_summaries')
+        if summaries is None:
+            request = self.context.get('request')
+            summaries = summarize_reactions([obj.message_id], getattr(request, 'user', None))
+        return summaries.get(obj.message_id, [])
+
+class ArchivedMessageSerializer(serializers.ModelSerializer):
+    """
+    Renders an archived message in the same shape as MessageSerializer.
+    Reactions only keep their counts once archived.
+    """
+    author = UserSerializer(source='user_channel_id', read_only=True)
+
+    class Meta:
+        model = ArchivedMessage
+        fields = ['message_id', 'message_channel_id', 'dm_channel', 'author', 'time_stamp']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        payload = unpack(instance.payload)
+        edited_at = serializers.DateTimeField().to_representation(parse_archived_datetime(payload['edited_at']))
+        return {
+            'message_id': data['message_id'],
+            'message_channel_id': data['message_channel_id'],
+            'dm_channel': data['dm_channel'],
+            'author': data['author'],
+            'content': payload['content'],
+            'attachment_url': payload['attachment_url'],
+            'attachment_type': payload['attachment_type'],
+            'is_edited': payload['is_edited'],
+            'edited_at': edited_at,
+            'is_pinned': payload['is_pinned'],
+            'reactions': [
+                {'emoji': emoji, 'count': count, 'me': False, 'users': []}
+                for emoji, count in payload['reactions']
+            ],
+            'mentions': payload['mentions'],
+            'mention_everyone': payload['mention_everyone'],
+            'time_stamp': data['time_stamp'],
+        }
 
 class MessageCreateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -212,6 +330,16 @@ class FriendSerializer(serializers.ModelSerializer):
         model = Friends
         fields = ['friends_id', 'user_friend_id', 'username', 'display_name', 'status', 'created_at']
 
+class FriendSuggestionSerializer(serializers.ModelSerializer):
+    user_id = serializers.IntegerField(source='suggested_user_id', read_only=True)
+    username = serializers.CharField(source='suggested_user.username', read_only=True)
+    display_name = serializers.CharField(source='suggested_user.display_name', read_only=True)
+    avatar = serializers.CharField(source='suggested_user.avatar', read_only=True, allow_null=True)
+
+    class Meta:
+        model = FriendSuggestion
+        fields = ['user_id', 'username', 'display_name', 'avatar', 'mutual_friend_count', 'shared_server_count', 'score']
+
 class BlockedUserSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source='blocked_user.username', read_only=True)
 
@@ -0,0 +1,146 @@
+"""
+Streaming JSON responses for large lists.
+
+Instead of serializing a whole queryset and rendering it in one go, the
+list is read a chunk at a time with keyset pagination (each chunk is a
+``LIMIT`` query for the rows after the last one seen, in the queryset's
+ordering), serialized and written out as it goes, so a worker only ever
+holds one chunk of rows and dicts in memory. Server-side cursors would do
+the same in one query, but they don't survive a transaction-mode connection
+pooler (see DISABLE_SERVER_SIDE_CURSORS in settings). The output is the same
+JSON array the non-streaming Response would render.
+
+The generators are synchronous, since they drive the ORM. Under ASGI,
+Django consumes a sync streaming body with ``sync_to_async(list)``, which
+buffers all of it before sending; IncrementalStreamingResponse pulls it a
+part at a time instead, so memory stays flat on either kind of server.
+"""
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q, QuerySet
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotAcceptable
+
+from .renderers import dumps
+
+
+def chunk_size():
+    return getattr(settings, 'STREAMING_CHUNK_SIZE', 500)
+
+
+def chunked(iterable, size):
+    """Yield lists of up to ``size`` items from ``iterable``"""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _keyset(queryset):
+    """
+    The ordering of ``queryset`` as ``(field, descending)`` pairs, ending
+    with the primary key so that every row has a distinct key. The fields
+    must be plain, non-null columns.
+    """
+    meta = queryset.model._meta
+    ordering = queryset.query.order_by or (meta.ordering if queryset.query.default_ordering else ())
+    keys = []
+    for field in ordering:
+        if not isinstance(field, str) or field == '?':
+            raise ValueError(f'Cannot paginate by {field!r}, order by field names')
+        name = field.lstrip('-')
+        keys.append((meta.pk.name if name == 'pk' else name, field.startswith('-')))
+    if not keys or keys[-1][0] not in (meta.pk.name, meta.pk.attname):
+        keys.append((meta.pk.name, False))
+    return keys
+
+
+def _key(row, name):
+    # Rows are model instances, named tuples, or .values() dicts
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+
+def _after(keys, row):
+    """A filter for the rows that come after ``row`` in the ``keys`` ordering"""
+    values = [_key(row, name) for name, _ in keys]
+    # (a > x) or (a = x and ((b > y) or (b = y and ...)))
+    condition = None
+    for (name, descending), value in reversed(list(zip(keys, values))):
+        beyond = Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+        condition = beyond if condition is None else beyond | (Q(**{name: value}) & condition)
+    if len(keys) > 1:
+        # Bound the leading column on its own as well, so an index on it is used
+        name, descending = keys[0]
+        condition &= Q(**{f'{name}__{"lte" if descending else "gte"}': values[0]})
+    return condition
+
+
+def iterate(queryset, size=None):
+    """
+    Iterate a queryset a chunk at a time, each chunk read with its own query
+    for the ``size`` rows after the last one; prefetches are done per chunk
+    """
+    size = size or chunk_size()
+    keys = _keyset(queryset)
+    queryset = queryset.order_by(*(f'-{name}' if descending else name for name, descending in keys))
+    page = queryset
+    while True:
+        chunk = list(page[:size])
+        yield from chunk
+        if len(chunk) < size:
+            return
+        page = queryset.filter(_after(keys, chunk[-1]))
+
+
+def require_json(request):
+    """
+    Streamed lists are always JSON; refuse requests negotiated to another
+    format (e.g. ``Accept: application/msgpack``) rather than ignore them.
+    The browsable API is let through and shown the raw JSON.
+    """
+    if request.accepted_renderer.format not in ('json', 'api'):
+        raise NotAcceptable('This list is only available as JSON.')
+
+
+def stream_json_array(items, serialize, size=None):
+    """
+    Yield a JSON array of ``items`` as bytes. ``serialize`` turns a chunk of
+    items into a list of dicts, typically ``Serializer(chunk, many=True).data``.
+    """
+    size = size or chunk_size()
+    if isinstance(items, QuerySet):
+        items = iterate(items, size)
+    yield b'['
+    separator = b''
+    for chunk in chunked(items, size):
+        # Encode the chunk as one array and drop its brackets
+        yield separator + dumps(serialize(chunk))[1:-1]
+        separator = b','
+    yield b']'
+
+
+class IncrementalStreamingResponse(StreamingHttpResponse):
+    """
+    A StreamingHttpResponse whose sync iterator is also streamed under ASGI:
+    each part is produced by its own thread-sensitive sync_to_async call, on
+    the thread that ran the view, so open database cursors stay usable.
+    """
+
+    async def __aiter__(self):
+        if self.is_async:
+            async for part in super().__aiter__():
+                yield part
+            return
+        content = self.streaming_content
+        step = sync_to_async(next, thread_sensitive=True)
+        while (part := await step(content, None)) is not None:
+            yield part
+
+
+class StreamingJSONResponse(IncrementalStreamingResponse):
+    """A StreamingHttpResponse for stream_json_array()"""
+
+    def __init__(self, items, serialize, size=None, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(stream_json_array(items, serialize, size), **kwargs)
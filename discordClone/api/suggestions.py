@@ -0,0 +1,279 @@
+"""
+Friend suggestions ("people you may know").
+
+Candidates are friends of friends and members of the servers a user is in,
+ranked by MUTUAL_FRIEND_WEIGHT per mutual friend plus SHARED_SERVER_WEIGHT
+per shared server. Servers with more than FRIEND_SUGGESTION_MAX_SERVER_SIZE
+members are left out; sharing a huge public server says little and would
+make everyone a candidate of everyone. Existing friends, blocked users (in
+either direction), users with a pending request and inactive users are
+never suggested; inactive users are left out of the graph as it is loaded,
+so they don't count as mutual friends either.
+
+Ranking is done by the refresh_friend_suggestions job, which stores the top
+FRIEND_SUGGESTIONS_PER_USER per user in FriendSuggestion, so reading them is
+one range scan of (user, -score). The job is incremental: the signal
+receivers below queue the users whose suggestions a change affects, and the
+job only recomputes those. A new or removed friendship affects both users
+and all of their friends, but only the two users are queued, flagged with
+``include_friends``; the job queues their friends when it gets to them, so
+accepting a request stays two writes however many friends either side has.
+Joining or leaving a server only queues the member themselves, so co-members
+pick up the change on their next refresh or the next full run (``--all``).
+"""
+import heapq
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from friends.models import BlockedUser, FriendRequest, Friends, FriendSuggestion, FriendSuggestionRefresh
+from servers.models import ServerMember, Servers
+from users.models import Users
+
+from .friendships import friend_ids
+from .streaming import chunked
+
+MUTUAL_FRIEND_WEIGHT = 2
+SHARED_SERVER_WEIGHT = 1
+
+# Ids per IN (...) list when loading the graph around a batch
+LOOKUP_CHUNK_SIZE = 500
+
+SUGGESTION_COLUMNS = [
+    'user', 'suggested_user', 'score', 'mutual_friend_count', 'shared_server_count', 'computed_at',
+]
+
+
+def suggestions_per_user():
+    return getattr(settings, 'FRIEND_SUGGESTIONS_PER_USER', 20)
+
+
+def max_server_size():
+    return getattr(settings, 'FRIEND_SUGGESTION_MAX_SERVER_SIZE', 1000)
+
+
+def _friends_of(user_ids):
+    """{user_id: set of active friend ids} for ``user_ids``, reading both halves of the pair index"""
+    friends = {user_id: set() for user_id in user_ids}
+    for chunk in chunked(user_ids, LOOKUP_CHUNK_SIZE):
+        for user_id, friend_id in Friends.objects.filter(
+            users_id__in=chunk, status=True, user_friend_id__is_active=True
+        ).values_list('users_id', 'user_friend_id'):
+            friends[user_id].add(friend_id)
+        for friend_id, user_id in Friends.objects.filter(
+            user_friend_id__in=chunk, status=True, users_id__is_active=True
+        ).values_list('users_id', 'user_friend_id'):
+            friends[user_id].add(friend_id)
+    return friends
+
+
+def _servers_of(user_ids):
+    """({user_id: server ids}, {server_id: active member ids}) for the small enough servers of ``user_ids``"""
+    servers = defaultdict(set)
+    for chunk in chunked(user_ids, LOOKUP_CHUNK_SIZE):
+        for user_id, server_id in ServerMember.objects.filter(user__in=chunk).values_list('user_id', 'server_id'):
+            servers[user_id].add(server_id)
+
+    small = set()
+    for chunk in chunked(set().union(*servers.values()), LOOKUP_CHUNK_SIZE):
+        small.update(
+            Servers.objects.filter(pk__in=chunk).with_member_count()
+            .filter(num_members__lte=max_server_size()).values_list('pk', flat=True)
+        )
+    for server_ids in servers.values():
+        server_ids &= small
+
+    members = defaultdict(list)
+    for chunk in chunked(set().union(*servers.values()), LOOKUP_CHUNK_SIZE):
+        for server_id, user_id in ServerMember.objects.filter(
+            server__in=chunk, user__is_active=True
+        ).values_list('server_id', 'user_id'):
+            members[server_id].append(user_id)
+    return servers, members
+
+
+def _excluded_pairs(user_ids):
+    """{user_id: ids never to suggest to them}: blocks either way and pending requests either way"""
+    excluded = defaultdict(set)
+    for chunk in chunked(user_ids, LOOKUP_CHUNK_SIZE):
+        for user_id, other_id in BlockedUser.objects.filter(
+            Q(user__in=chunk) | Q(blocked_user__in=chunk)
+        ).values_list('user_id', 'blocked_user_id'):
+            excluded[user_id].add(other_id)
+            excluded[other_id].add(user_id)
+        for user_id, other_id in FriendRequest.objects.filter(
+            Q(sender__in=chunk) | Q(receiver__in=chunk), status='pending'
+        ).values_list('sender_id', 'receiver_id'):
+            excluded[user_id].add(other_id)
+            excluded[other_id].add(user_id)
+    return excluded
+
+
+def compute_suggestions(user_ids, limit=None):
+    """
+    Rank suggestions for ``user_ids``. Returns {user_id: [(suggested_user_id,
+    score, mutual_friend_count, shared_server_count), ...]}, best first.
+    """
+    user_ids = list(user_ids)
+    limit = limit or suggestions_per_user()
+
+    friends = _friends_of(user_ids)
+    friends.update(_friends_of(list(set().union(*friends.values()) - friends.keys())))
+    servers, members = _servers_of(user_ids)
+    excluded = _excluded_pairs(user_ids)
+
+    ranked = {}
+    for user_id in user_ids:
+        mutual = Counter()
+        for friend_id in friends[user_id]:
+            mutual.update(friends[friend_id])
+        shared = Counter()
+        for server_id in servers.get(user_id, ()):
+            shared.update(members[server_id])
+
+        skip = friends[user_id] | excluded.get(user_id, set()) | {user_id}
+        scored = [
+            (MUTUAL_FRIEND_WEIGHT * mutual[candidate] + SHARED_SERVER_WEIGHT * shared[candidate],
+             candidate, mutual[candidate], shared[candidate])
+            for candidate in mutual.keys() | shared.keys() if candidate not in skip
+        ]
+        # Highest score first, lowest user id first among equals
+        best = heapq.nsmallest(limit, scored, key=lambda entry: (-entry[0], entry[1]))
+        ranked[user_id] = [(candidate, score, m, s) for score, candidate, m, s in best]
+    return ranked
+
+
+def refresh_suggestions(user_ids):
+    """Recompute and store the suggestions of ``user_ids``; returns the number of rows written"""
+    ranked = compute_suggestions(user_ids)
+    computed_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    rows = [
+        (user_id, candidate, score, mutual, shared, computed_at)
+        for user_id, entries in ranked.items()
+        for candidate, score, mutual, shared in entries
+    ]
+    # Plain executemany: building model instances for bulk_create dominated the job
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(FriendSuggestion._meta.get_field(name).column) for name in SUGGESTION_COLUMNS)
+    sql = (f'INSERT INTO {qn(FriendSuggestion._meta.db_table)} ({columns}) '
+           f'VALUES ({", ".join(["%s"] * len(SUGGESTION_COLUMNS))})')
+    with transaction.atomic():
+        FriendSuggestion.objects.filter(user_id__in=list(ranked)).delete()
+        if rows:
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, rows)
+    return len(rows)
+
+
+def refresh_stale(batch_size=500):
+    """
+    Recompute the suggestions of every queued user, a batch at a time.
+    Users queued with ``include_friends`` have their friends queued first,
+    as of the start of the run, so they are picked up by a later batch.
+    Users queued again while the job runs stay queued for the next run.
+    Returns ``(users, rows)``.
+    """
+    started = timezone.now()
+    users = rows = 0
+    while True:
+        batch = dict(
+            FriendSuggestionRefresh.objects
+            .filter(queued_at__lte=started)
+            .order_by('user_id')
+            .values_list('user_id', 'include_friends')[:batch_size]
+        )
+        if not batch:
+            return users, rows
+        user_ids = list(batch)
+        expand = [user_id for user_id, include_friends in batch.items() if include_friends]
+        if expand:
+            queue_refresh(set().union(*_friends_of(expand).values()) - batch.keys(), queued_at=started)
+        rows += refresh_suggestions(
+            Users.objects.filter(user_id__in=user_ids, is_active=True).values_list('user_id', flat=True)
+        )
+        FriendSuggestionRefresh.objects.filter(user_id__in=user_ids, queued_at__lte=started).delete()
+        users += len(user_ids)
+
+
+def refresh_all(batch_size=500):
+    """Recompute the suggestions of every active user. Returns ``(users, rows)``."""
+    started = timezone.now()
+    users = rows = last_id = 0
+    active = Users.objects.filter(is_active=True).order_by('user_id').values_list('user_id', flat=True)
+    while user_ids := list(active.filter(user_id__gt=last_id)[:batch_size]):
+        rows += refresh_suggestions(user_ids)
+        users += len(user_ids)
+        last_id = user_ids[-1]
+    FriendSuggestionRefresh.objects.filter(queued_at__lte=started).delete()
+    return users, rows
+
+
+def suggestions_for(user, limit=None):
+    """A user's stored suggestions, best first, minus anyone who became a friend since"""
+    suggestions = (
+        FriendSuggestion.objects
+        .filter(user=user)
+        .select_related('suggested_user')
+        .order_by('-score', 'suggested_user_id')[:limit or suggestions_per_user()]
+    )
+    friends = set(friend_ids(user.pk))
+    return [suggestion for suggestion in suggestions if suggestion.suggested_user_id not in friends]
+
+
+def queue_refresh(user_ids, include_friends=False, queued_at=None):
+    """
+    Mark users' suggestions out of date. With ``include_friends`` their
+    friends' suggestions are too; the job queues those when it runs. The
+    flag is only ever set here, never cleared by a plain requeue.
+    """
+    queued_at = queued_at or timezone.now()
+    FriendSuggestionRefresh.objects.bulk_create(
+        [FriendSuggestionRefresh(user_id=user_id, queued_at=queued_at, include_friends=include_friends)
+         for user_id in set(user_ids)],
+        update_conflicts=True, unique_fields=['user_id'],
+        update_fields=['queued_at', 'include_friends'] if include_friends else ['queued_at'],
+    )
+
+
+def drop_suggestions(user_id, other_user_id):
+    """Stop suggesting two users to each other right away"""
+    FriendSuggestion.objects.filter(
+        Q(user_id=user_id, suggested_user_id=other_user_id) | Q(user_id=other_user_id, suggested_user_id=user_id)
+    ).delete()
+
+
+# Signals to queue users whose suggestions a change affects
+@receiver(post_save, sender=Friends)
+@receiver(post_delete, sender=Friends)
+def friendship_changed(sender, instance=None, **kwargs):
+    user_ids = [instance.users_id_id, instance.user_friend_id_id]
+    drop_suggestions(*user_ids)
+    queue_refresh(user_ids, include_friends=True)
+
+
+@receiver(post_save, sender=ServerMember)
+@receiver(post_delete, sender=ServerMember)
+def membership_changed(sender, instance=None, created=False, signal=None, **kwargs):
+    if created or signal is post_delete:
+        queue_refresh([instance.user_id])
+
+
+@receiver(post_save, sender=BlockedUser)
+@receiver(post_delete, sender=BlockedUser)
+def block_changed(sender, instance=None, **kwargs):
+    drop_suggestions(instance.user_id, instance.blocked_user_id)
+    queue_refresh([instance.user_id, instance.blocked_user_id])
+
+
+@receiver(post_save, sender=FriendRequest)
+def friend_request_changed(sender, instance=None, created=False, **kwargs):
+    if created:
+        drop_suggestions(instance.sender_id, instance.receiver_id)
+    else:
+        # A rejected request makes the pair suggestible again
+        queue_refresh([instance.sender_id, instance.receiver_id])
@@ -1,3 +1,1672 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import threading
+from datetime import timedelta
+import importlib.util
+import unittest
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from users.models import Users
+from servers.models import Servers, ServerInvite, ServerMember, ServerRole
+from channels.models import Channels, DirectMessageChannel, ReadState
+from user_messages.models import ArchivedMessage, MessageReactionCount, UserMessages
+from notifications.models import Notifications
+from friends.models import BlockedUser, FriendRequest, Friends, FriendSuggestionRefresh
+
+from . import authentication, blocks, dm_channels, friendships, membership, read_states, suggestions, views
+from .authentication import CachedTokenAuthentication
+from .archive import archive_before
+from .fast_serializers import FriendValuesSerializer, MessageValuesSerializer, ServerMemberValuesSerializer
+from .renderers import MessagePackParser, MessagePackRenderer, ORJSONParser, ORJSONRenderer
+from .serializers import (
+    DirectMessageChannelSerializer, FriendSerializer, MessageSerializer, NotificationSerializer, ServerMemberSerializer
+)
+from .transfer import ServerImporter, TransferError, export_jsonl, import_server
+from .outbox import LocalQueue, write_notifications
+from .reactions import recount_reactions, toggle_reaction
+from .streaming import IncrementalStreamingResponse, StreamingJSONResponse, iterate
+from .realtime import (
+    CLOSE_UNAUTHORIZED, GATEWAY_PATH, channel_topic, gateway_application, gateway_topic, get_broker,
+    user_topic,
+)
+
+
+class ClientMixin:
+    """For tests acting as several users"""
+
+    def client_for(self, user):
+        """An APIClient authenticated as ``user``"""
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+
+class MessageListQueryCountTests(TestCase):
+    """The message list must not issue queries per message or per reaction"""
+
+    def setUp(self):
+        self.users = [
+            Users.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='password123')
+            for i in range(3)
+        ]
+        self.server = Servers.objects.create(name='Test Server', owner_id=self.users[0], invite_code='testcode')
+        for user in self.users:
+            ServerMember.objects.create(server=self.server, user=user)
+        self.channel = Channels.objects.create(discord_server_id=self.server, name='general')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def create_messages(self, count):
+        for i in range(count):
+            message = UserMessages.objects.create(
+                message_channel_id=self.channel,
+                user_channel_id=self.users[i % len(self.users)],
+                content=f'Message {i}'
+            )
+            for user in self.users:
+                toggle_reaction(message, user, '👍')
+
+    def count_list_queries(self, limit):
+        url = f'/api/messages/{self.channel.channel_id}/?limit={limit}'
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), limit)
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_independent_of_page_size(self):
+        self.create_messages(30)
+        # Warm the membership cache so both requests do the same lookups
+        self.count_list_queries(1)
+        self.assertEqual(self.count_list_queries(2), self.count_list_queries(30))
+
+    def test_reactions_are_summarized_per_emoji(self):
+        self.create_messages(1)
+        response = self.client.get(f'/api/messages/{self.channel.channel_id}/')
+        summary, = response.data[0]['reactions']
+        self.assertEqual(summary['emoji'], '👍')
+        self.assertEqual(summary['count'], len(self.users))
+        self.assertTrue(summary['me'])
+        self.assertEqual([user['username'] for user in summary['users']], [user.username for user in self.users])
+
+    def test_counters_follow_cascade_deletes(self):
+        self.create_messages(2)
+        first, second = UserMessages.objects.order_by('message_id')
+        self.users[2].delete()
+        self.assertEqual(
+            list(MessageReactionCount.objects.order_by('message_id').values_list('message_id', 'count')),
+            [(first.message_id, 2), (second.message_id, 2)]
+        )
+
+        toggle_reaction(first, self.users[1], '👍')
+        first.delete()
+        self.assertEqual(list(MessageReactionCount.objects.values_list('message_id', 'count')), [(second.message_id, 2)])
+
+        # Counters that drifted are rebuilt from the reaction rows
+        MessageReactionCount.objects.update(count=7)
+        self.assertEqual(recount_reactions(), 1)
+        self.assertEqual(list(MessageReactionCount.objects.values_list('message_id', 'count')), [(second.message_id, 2)])
+
+
+class MessageCursorPaginationTests(TestCase):
+    """Message history pages by (time_stamp, message_id) keyset in both directions"""
+
+    def setUp(self):
+        self.user = Users.objects.create_user(username='user', email='user@example.com', password='password123')
+        server = Servers.objects.create(name='Test Server', owner_id=self.user, invite_code='testcode')
+        ServerMember.objects.create(server=server, user=self.user)
+        self.channel = Channels.objects.create(discord_server_id=server, name='general')
+        # Pairs of messages share a timestamp, so the message_id tie-break decides their order
+        start = timezone.now() - timedelta(hours=1)
+        self.ids = [
+            UserMessages.objects.create(message_channel_id=self.channel, user_channel_id=self.user,
+                                        content=f'Message {i}', time_stamp=start + timedelta(minutes=i // 2)).message_id
+            for i in range(60)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def page(self, query='', status=200):
+        response = self.client.get(f'/api/messages/{self.channel.channel_id}/{query}')
+        self.assertEqual(response.status_code, status)
+        return [message['message_id'] for message in response.data] if status == 200 else response.data
+
+    def test_latest_page_is_capped_at_default_limit(self):
+        self.assertEqual(self.page(), self.ids[-50:])
+        self.assertEqual(self.page('?limit=500'), self.ids)
+        self.assertEqual(self.page('?limit=0'), self.ids[-1:])
+
+    def test_before_and_after_walk_across_ties(self):
+        # Message 31 shares its timestamp with message 30
+        self.assertEqual(self.page(f'?before={self.ids[31]}&limit=3'), self.ids[28:31])
+        self.assertEqual(self.page(f'?after={self.ids[30]}&limit=3'), self.ids[31:34])
+
+        # Walking backwards page by page visits every message once
+        seen, cursor = [], ''
+        while page := self.page(f'?limit=7{cursor}'):
+            seen = page + seen
+            cursor = f'&before={page[0]}'
+        self.assertEqual(seen, self.ids)
+
+    def test_boundaries(self):
+        self.assertEqual(self.page(f'?before={self.ids[0]}'), [])
+        self.assertEqual(self.page(f'?after={self.ids[-1]}'), [])
+        self.assertEqual(self.page(f'?around={self.ids[0]}&limit=4'), self.ids[:4])
+        self.assertEqual(self.page(f'?around={self.ids[30]}&limit=5'), self.ids[28:33])
+        self.assertEqual(self.page(f'?around={self.ids[-1]}&limit=4'), self.ids[-3:])
+
+    def test_invalid_cursors(self):
+        self.page('?before=abc', status=400)
+        self.page('?limit=abc', status=400)
+        self.page(f'?before={self.ids[0]}&after={self.ids[1]}', status=400)
+        self.page(f'?before={self.ids[-1] + 1000}', status=404)
+
+        # A message from another channel is not a valid anchor here
+        other = Channels.objects.create(discord_server_id=self.channel.discord_server_id, name='other')
+        stranger = UserMessages.objects.create(message_channel_id=other, user_channel_id=self.user, content='elsewhere')
+        self.page(f'?after={stranger.message_id}', status=404)
+
+
+class GatewayTests(TestCase):
+    """The WebSocket gateway authenticates, authorizes subscriptions and drops them when access is lost"""
+
+    def setUp(self):
+        self.user = Users.objects.create_user(username='user', email='user@example.com', password='password123')
+        owner = Users.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        self.token = Token.objects.get_or_create(user=self.user)[0].key
+        server = Servers.objects.create(name='Test Server', owner_id=owner, invite_code='testcode')
+        self.member = ServerMember.objects.create(server=server, user=self.user)
+        self.channel = Channels.objects.create(discord_server_id=server, name='general')
+        private = Servers.objects.create(name='Private', owner_id=owner, invite_code='private')
+        self.private_channel = Channels.objects.create(discord_server_id=private, name='secret')
+
+    async def connect(self, token):
+        self.incoming, self.outgoing = asyncio.Queue(), asyncio.Queue()
+        await self.incoming.put({'type': 'websocket.connect'})
+        scope = {'type': 'websocket', 'path': GATEWAY_PATH, 'query_string': f'token={token}'.encode()}
+        return asyncio.ensure_future(gateway_application(scope, self.incoming.get, self.outgoing.put))
+
+    async def request(self, data):
+        await self.incoming.put({'type': 'websocket.receive', 'text': json.dumps(data)})
+        return await self.next_event()
+
+    async def next_event(self):
+        message = await asyncio.wait_for(self.outgoing.get(), timeout=5)
+        return json.loads(message['text']) if message['type'] == 'websocket.send' else message
+
+    def post_message(self, content, user=None):
+        client = APIClient()
+        client.force_authenticate(user or self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(f'/api/messages/{self.channel.channel_id}/', {'content': content})
+        self.assertEqual(response.status_code, 201)
+
+    def remove_member(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member.delete()
+
+    async def test_invalid_token_is_refused(self):
+        connection = await self.connect('not-a-token')
+        self.assertEqual(await self.next_event(), {'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        await connection
+
+    async def test_subscriptions_follow_membership(self):
+        connection = await self.connect(self.token)
+        self.assertEqual(await self.next_event(), {'type': 'websocket.accept'})
+
+        response = await self.request({'op': 'subscribe', 'channel_id': self.private_channel.channel_id})
+        self.assertEqual(response['op'], 'error')
+        topic = channel_topic(self.channel.channel_id)
+        response = await self.request({'op': 'subscribe', 'channel_id': self.channel.channel_id})
+        self.assertEqual(response, {'op': 'subscribed', 'topic': topic})
+
+        await sync_to_async(self.post_message)('hello')
+        event = await self.next_event()
+        self.assertEqual((event['type'], event['topic'], event['data']['content']), ('message_create', topic, 'hello'))
+
+        # Leaving the server drops the subscription without a reconnect
+        await sync_to_async(self.remove_member)()
+        self.assertEqual(await self.next_event(), {'op': 'unsubscribed', 'topic': topic, 'reason': 'Access revoked'})
+        self.assertEqual(get_broker().subscriber_count(topic), 0)
+
+        await self.incoming.put({'type': 'websocket.disconnect'})
+        await connection
+        self.assertEqual(get_broker().subscriber_count(gateway_topic(self.user.user_id)), 0)
+
+    async def test_blocked_authors_are_not_forwarded(self):
+        other = await sync_to_async(self.add_member)('other')
+        connection = await self.connect(self.token)
+        self.assertEqual(await self.next_event(), {'type': 'websocket.accept'})
+        await self.request({'op': 'subscribe', 'channel_id': self.channel.channel_id})
+
+        # Blocking revalidates the open connection, which reloads its block list
+        await sync_to_async(self.block)(other)
+        await sync_to_async(self.post_message)('spam', other)
+        await sync_to_async(self.post_message)('hello')
+        event = await self.next_event()
+        self.assertEqual((event['type'], event['data']['content']), ('message_create', 'hello'))
+
+        await self.incoming.put({'type': 'websocket.disconnect'})
+        await connection
+
+    def add_member(self, username):
+        user = Users.objects.create_user(username=username, email=f'{username}@example.com', password='password123')
+        ServerMember.objects.create(server=self.member.server, user=user)
+        return user
+
+    def block(self, user):
+        with self.captureOnCommitCallbacks(execute=True):
+            BlockedUser.objects.create(user=self.user, blocked_user=user)
+
+
+class NotificationStreamTests(TestCase):
+    """Notifications stream as Server-Sent Events under ASGI, replaying what a resuming client missed"""
+
+    def setUp(self):
+        self.user = Users.objects.create_user(username='user', email='user@example.com', password='password123')
+        self.token = Token.objects.get_or_create(user=self.user)[0].key
+
+    def notify(self, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notifications.objects.create(user_id=self.user, notification_type='server_event',
+                                                content=content).notify_id
+
+    @staticmethod
+    async def next_event(stream):
+        return (await asyncio.wait_for(anext(stream), timeout=5)).decode()
+
+    def test_wsgi_is_refused(self):
+        response = self.client.get('/api/notifications/stream/', HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.assertEqual(response.status_code, 501)
+
+    async def test_requires_a_token(self):
+        response = await self.async_client.get('/api/notifications/stream/')
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get('/api/notifications/stream/', {'token': 'nope'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_resume_replays_missed_then_streams_live(self):
+        first = await sync_to_async(self.notify)('first')
+        second = await sync_to_async(self.notify)('second')
+
+        response = await self.async_client.get(
+            '/api/notifications/stream/', {'token': self.token}, headers={'Last-Event-ID': str(first)}
+        )
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'text/event-stream'))
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await self.next_event(stream), 'retry: 5000\n\n')
+        self.assertTrue((await self.next_event(stream)).startswith(f'id: {second}\nevent: notification\n'))
+
+        third = await sync_to_async(self.notify)('third')
+        event = await self.next_event(stream)
+        self.assertTrue(event.startswith(f'id: {third}\nevent: notification\n'))
+        self.assertEqual(json.loads(event.split('data: ', 1)[1])['content'], 'third')
+
+        # A client disconnect cancels the pending read, which ends the subscription
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertEqual(get_broker().subscriber_count(user_topic(self.user.user_id)), 0)
+
+        response = await self.async_client.get(
+            '/api/notifications/stream/', {'token': self.token}, headers={'Last-Event-ID': 'abc'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class ServerCountTests(TestCase):
+    """Server lists carry member/role/invite counts, from subqueries or the counter columns"""
+
+    def setUp(self):
+        self.owner, *self.users = [
+            Users.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='password123')
+            for i in range(5)
+        ]
+        self.server = Servers.objects.create(name='Test Server', owner_id=self.owner, invite_code='testcode')
+        for user in [self.owner, *self.users[:3]]:
+            ServerMember.objects.create(server=self.server, user=user)
+        ServerRole.objects.create(server=self.server, name='Mods')
+        ServerInvite.objects.create(server=self.server, code='invite1', created_by=self.owner)
+
+    def counts(self):
+        server = Servers.objects.with_counts().get(pk=self.server.pk)
+        return server.num_members, server.num_roles, server.num_invites
+
+    def server_updates(self, queries):
+        table = Servers._meta.db_table
+        return [query['sql'] for query in queries.captured_queries if query['sql'].startswith(f'UPDATE "{table}"')]
+
+    def test_counts_without_counter_columns(self):
+        self.assertEqual(self.counts(), (4, 1, 1))
+        with CaptureQueriesContext(connection) as queries:
+            ServerMember.objects.create(server=self.server, user=self.users[3])
+            ServerInvite.objects.filter(code='invite1').delete()
+        self.assertEqual(self.server_updates(queries), [])
+        self.assertEqual(self.counts(), (5, 1, 0))
+
+    def test_public_list_queries_do_not_grow_with_servers(self):
+        client = APIClient()
+        client.force_authenticate(self.users[3])
+
+        def list_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get('/api/servers/public/')
+            self.assertEqual(response.status_code, 200)
+            return len(response.data), len(queries.captured_queries)
+
+        one, queries = list_queries()
+        for i in range(3):
+            server = Servers.objects.create(name=f'Server {i}', owner_id=self.owner, invite_code=f'code{i}')
+            Channels.objects.create(discord_server_id=server, name='general')
+        self.assertEqual(list_queries(), (one + 3, queries))
+        self.assertEqual(
+            [(entry['member_count'], entry['roles_count'], entry['invites_count']) for entry in client.get('/api/servers/public/').data][0],
+            (4, 1, 1)
+        )
+
+    @override_settings(SERVER_COUNTER_COLUMNS=True)
+    def test_counter_columns(self):
+        # Rows created before the setting was on are picked up by a recount
+        self.assertEqual(Servers.objects.filter(pk=self.server.pk).recount(), 1)
+        self.assertEqual(self.counts(), (4, 1, 1))
+
+        ServerMember.objects.filter(user=self.users[0]).delete()
+        with CaptureQueriesContext(connection) as queries:
+            ServerInvite.objects.create(server=self.server, code='invite2', created_by=self.owner)
+        self.assertEqual(len(self.server_updates(queries)), 1)
+        self.assertEqual(self.counts(), (3, 1, 2))
+
+        # bulk_create skips the signals; deleting such rows can't push a counter below zero
+        Servers.objects.filter(pk=self.server.pk).update(member_count=0)
+        ServerMember.objects.get(user=self.users[1]).delete()
+        self.assertEqual(self.counts(), (0, 1, 2))
+        Servers.objects.filter(pk=self.server.pk).recount()
+        self.assertEqual(self.counts(), (2, 1, 2))
+
+        # Deleting the server doesn't update its counters row by row
+        ServerMember.objects.bulk_create([ServerMember(server=self.server, user=self.users[3])])
+        with CaptureQueriesContext(connection) as queries:
+            self.server.delete()
+        self.assertEqual(self.server_updates(queries), [])
+        self.assertFalse(ServerMember.objects.exists())
+
+
+class ServerListTests(TestCase):
+    """The user's server list is loaded in fixed queries, pages by server_id and answers 304 when unchanged"""
+
+    def setUp(self):
+        self.user = Users.objects.create_user(username='user', email='user@example.com', password='password123')
+        self.owner = Users.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        self.servers = []
+        for i in range(5):
+            server = Servers.objects.create(name=f'Server {i}', owner_id=self.owner, invite_code=f'code{i}')
+            ServerMember.objects.create(server=server, user=self.user)
+            Channels.objects.create(discord_server_id=server, name='general')
+            self.servers.append(server)
+        # Owned without a membership row
+        self.servers.append(Servers.objects.create(name='Owned', owner_id=self.user, invite_code='owned'))
+        Servers.objects.create(name='Elsewhere', owner_id=self.owner, invite_code='elsewhere')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, query='', **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/servers/{query}', headers=headers)
+        return response, len(queries.captured_queries)
+
+    def test_list_and_cursor(self):
+        response, queries = self.get('?limit=2')
+        self.assertEqual([s['server_id'] for s in response.data], [s.server_id for s in self.servers[:2]])
+        self.assertEqual(response.data[0]['channels'][0]['name'], 'general')
+        self.assertEqual(response.data[0]['member_count'], 1)
+
+        response, more_queries = self.get(f'?after={self.servers[1].server_id}')
+        self.assertEqual([s['server_id'] for s in response.data], [s.server_id for s in self.servers[2:]])
+        self.assertEqual(queries, more_queries)
+
+        self.assertEqual(self.get('?after=abc')[0].status_code, 400)
+
+    def test_not_modified(self):
+        response, queries = self.get()
+        etag = response['ETag']
+        response, not_modified_queries = self.get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual((not_modified_queries, queries), (1, 3))
+
+        # Renaming a channel, a new member and a new server each change the tag
+        channel = Channels.objects.get(discord_server_id=self.servers[0])
+        channel.name = 'renamed'
+        channel.save()
+        response, _ = self.get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['channels'][0]['name'], 'renamed')
+        etag = response['ETag']
+
+        ServerMember.objects.create(server=self.servers[0], user=self.owner)
+        response, _ = self.get(**{'If-None-Match': etag})
+        self.assertEqual((response.status_code, response.data[0]['member_count']), (200, 2))
+        etag = response['ETag']
+
+        self.assertEqual(self.get(**{'If-None-Match': etag})[0].status_code, 304)
+        ServerMember.objects.create(server=Servers.objects.get(name='Elsewhere'), user=self.user)
+        self.assertEqual(self.get(**{'If-None-Match': etag})[0].status_code, 200)
+
+
+class PermissionMaskTests(TestCase):
+    """ServerMember.permission_mask follows base roles, role assignments and role edits"""
+
+    def setUp(self):
+        owner, *self.users = [
+            Users.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='password123')
+            for i in range(4)
+        ]
+        self.server = Servers.objects.create(name='Test Server', owner_id=owner, invite_code='testcode')
+        self.owner = ServerMember.objects.create(server=self.server, user=owner, role='owner')
+        self.members = [ServerMember.objects.create(server=self.server, user=user) for user in self.users]
+        self.mods = ServerRole.objects.create(server=self.server, name='Mods', kick_members=True, manage_messages=True)
+
+    def can(self, member, permission):
+        member.refresh_from_db()
+        return member.has_permission(permission)
+
+    def test_base_roles(self):
+        admin = self.members[0]
+        admin.role = 'admin'
+        admin.save(update_fields=['role'])
+        self.assertTrue(self.can(admin, 'ban_members'))
+        self.assertFalse(self.can(admin, 'manage_server'))
+        self.assertTrue(self.can(self.owner, 'manage_server'))
+
+        # Owners and admins also hold permissions that have no bit
+        self.assertTrue(self.can(self.owner, 'view_audit_log'))
+        self.assertTrue(self.can(admin, 'view_audit_log'))
+        self.assertFalse(self.can(self.members[1], 'view_audit_log'))
+        self.assertTrue(self.can(self.members[1], 'create_invites'))
+
+        # Bulk role changes recompute the masks too
+        ServerMember.objects.filter(pk__in=[self.members[1].pk, self.members[2].pk]).update(role='moderator')
+        self.assertTrue(self.can(self.members[1], 'kick_members'))
+        self.assertFalse(self.can(self.members[2], 'ban_members'))
+
+    def test_custom_roles(self):
+        first, second, third = self.members
+        first.roles.add(self.mods)
+        self.mods.members.add(second)
+        self.assertTrue(self.can(first, 'kick_members'))
+        self.assertTrue(self.can(second, 'manage_messages'))
+        self.assertFalse(self.can(third, 'kick_members'))
+
+        # Editing the role updates everyone holding it
+        self.mods.kick_members = False
+        self.mods.ban_members = True
+        self.mods.save()
+        self.assertFalse(self.can(first, 'kick_members'))
+        self.assertTrue(self.can(second, 'ban_members'))
+
+        first.roles.remove(self.mods)
+        self.assertFalse(self.can(first, 'ban_members'))
+        self.assertTrue(self.can(first, 'create_invites'))
+
+        self.mods.members.add(third)
+        self.mods.members.clear()
+        self.assertFalse(self.can(second, 'ban_members'))
+        self.assertFalse(self.can(third, 'ban_members'))
+
+        self.mods.members.add(first)
+        self.mods.delete()
+        self.assertFalse(self.can(first, 'ban_members'))
+
+
+class MembershipCacheTests(TestCase):
+    """Memberships and channel servers are cached across requests and dropped when they change"""
+
+    def setUp(self):
+        self.owner, self.user = [
+            Users.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='password123')
+            for i in range(2)
+        ]
+        self.server = Servers.objects.create(name='Test Server', owner_id=self.owner, invite_code='testcode')
+        self.member = ServerMember.objects.create(server=self.server, user=self.user)
+        self.channel = Channels.objects.create(discord_server_id=self.server, name='general')
+        membership._memberships.clear()
+        membership._channel_servers.clear()
+
+    def resolve(self, user=None):
+        return membership.resolve_membership(SimpleNamespace(user=user or self.user), self.server.server_id)
+
+    def test_cached_until_membership_changes(self):
+        self.assertTrue(self.resolve().is_member)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.resolve().is_member)
+
+        # Owners without a member row still resolve
+        owner = self.resolve(self.owner)
+        self.assertEqual((owner.is_member, owner.role), (False, 'owner'))
+        self.assertTrue(owner.has_permission('manage_server'))
+
+        role = ServerRole.objects.create(server=self.server, name='Mods', kick_members=True)
+        self.assertFalse(self.resolve().has_permission('kick_members'))
+        self.member.roles.add(role)
+        self.assertTrue(self.resolve().has_permission('kick_members'))
+        role.kick_members = False
+        role.save()
+        self.assertFalse(self.resolve().has_permission('kick_members'))
+
+        # Kicked (or left)
+        self.member.delete()
+        self.assertIsNone(self.resolve())
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.resolve())
+        ServerMember.objects.create(server=self.server, user=self.user)
+        self.assertTrue(self.resolve().is_member)
+
+    def test_invalidated_again_on_commit(self):
+        self.resolve()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member.delete()
+            # A concurrent request re-caching the row before the commit
+            stale = membership.Membership(self.server.server_id, self.member.pk, 'member', 0)
+            membership._memberships.set(
+                (self.user.user_id, self.server.server_id, membership._generation(self.server.server_id)), stale
+            )
+        self.assertIsNone(self.resolve())
+
+    def test_generations_are_bounded(self):
+        server_id = self.server.server_id
+        stale = membership.Membership(server_id, None, 'stale', 0)
+        membership._memberships.set((self.user.user_id, server_id, membership._generation(server_id)), stale)
+        membership.invalidate_server(server_id)
+        with patch.object(membership, '_generation_limit', 2):
+            for other_id in range(10**6, 10**6 + 5):
+                membership.invalidate_server(other_id)
+            self.assertEqual(len(membership._generations), 2)
+            self.assertNotIn(server_id, membership._generations)
+            # The evicted server can't fall back to the generation the stale entry was cached under
+            self.assertEqual(self.resolve().role, 'member')
+
+    def test_channel_server(self):
+        channel_id = self.channel.channel_id
+        self.assertEqual(membership.resolve_channel_server(channel_id), self.server.server_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(membership.resolve_channel_server(channel_id), self.server.server_id)
+        self.channel.delete()
+        self.assertIsNone(membership.resolve_channel_server(channel_id))
+
+
+class TokenCacheTests(TestCase):
+    """Cached token lookups are dropped on logout and deactivation"""
+
+    def setUp(self):
+        self.user = Users.objects.create_user(username='user', email='user@example.com', password='password123')
+        self.token = Token.objects.get_or_create(user=self.user)[0].key
+        authentication._tokens.clear()
+        authentication._token_keys.clear()
+
+    def authenticate(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return CachedTokenAuthentication().authenticate_credentials(self.token)[0]
+
+    def assertRevoked(self):
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_cache_hit(self):
+        self.assertEqual(self.authenticate().pk, self.user.pk)
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        user.username = 'changed'
+        self.assertEqual(self.authenticate().username, 'user')
+
+    def test_logout(self):
+        self.authenticate()
+        client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/auth/logout/', headers={'Authorization': f'Token {self.token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertRevoked()
+
+    def test_deactivation(self):
+        self.authenticate()
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertRevoked()
+
+    def test_bulk_deactivation(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            Users.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertRevoked()
+
+    @override_settings(
+        TOKEN_CACHE_BACKEND='tokens',
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'tokens': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tokens'},
+        },
+    )
+    def test_shared_backend_replaces_local_cache(self):
+        self.assertEqual(self.authenticate().pk, self.user.pk)
+        with self.assertNumQueries(0):
+            self.authenticate()
+        self.assertEqual(len(authentication._tokens), 0)
+
+        # Another worker deactivates the user: the row changes and the shared entry is
+        # dropped there, while this process still holds an old in-process entry
+        authentication._tokens.set(self.token, self.user)
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {Users._meta.db_table} SET is_active = %s WHERE user_id = %s', [False, self.user.pk])
+        caches['tokens'].delete(f'auth-token:{self.token}')
+        self.assertRevoked()
+
+
+@override_settings(NOTIFICATION_WORKER_IN_PROCESS=False)
+class NotificationOutboxTests(TestCase):
+    """Queued notifications are coalesced and written in one batch"""
+
+    def setUp(self):
+        self.sender = Users.objects.create_user(username='sender', email='sender@example.com', password='password123')
+        self.receiver = Users.objects.create_user(username='receiver', email='receiver@example.com', password='password123')
+
+    def test_dm_burst_collapses_into_one_notification(self):
+        client = APIClient()
+        client.force_authenticate(self.sender)
+
+        outbox = LocalQueue()
+        with patch('api.outbox.get_queue', return_value=outbox):
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(3):
+                    response = client.post(f'/api/channels/@me/{self.receiver.user_id}/', {'content': f'Hi {i}'})
+                    self.assertEqual(response.status_code, 201)
+
+        write_notifications(outbox.get_batch(max_items=100, window=0))
+
+        notification = Notifications.objects.get(user_id=self.receiver)
+        self.assertEqual(notification.content, 'sender sent you 3 new messages')
+        self.assertEqual(notification.message.content, 'Hi 2')
+
+
+@override_settings(NOTIFICATION_WORKER_IN_PROCESS=False)
+class MentionTests(TestCase):
+    """Mentions are stored with the message and notified through the outbox"""
+
+    def setUp(self):
+        self.users = [
+            Users.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='password123')
+            for i in range(4)
+        ]
+        self.server = Servers.objects.create(name='Test Server', owner_id=self.users[0], invite_code='testcode')
+        for user in self.users:
+            ServerMember.objects.create(server=self.server, user=user)
+        self.channel = Channels.objects.create(discord_server_id=self.server, name='general')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def post_message(self, content):
+        outbox = LocalQueue()
+        with patch('api.outbox.get_queue', return_value=outbox):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(f'/api/messages/{self.channel.channel_id}/', {'content': content})
+        self.assertEqual(response.status_code, 201)
+        return response, outbox
+
+    def test_username_mentions_are_recorded(self):
+        response, outbox = self.post_message('hey @user1 and @user2, not @nobody')
+
+        self.assertEqual(sorted(response.data['mentions']), [self.users[1].user_id, self.users[2].user_id])
+        self.assertFalse(response.data['mention_everyone'])
+
+        write_notifications(outbox.get_batch(max_items=100, window=0))
+        notified = Notifications.objects.filter(notification_type='mention').values_list('user_id', flat=True)
+        self.assertEqual(sorted(notified), [self.users[1].user_id, self.users[2].user_id])
+
+    def test_everyone_is_fanned_out_by_the_worker(self):
+        response, outbox = self.post_message('@everyone @user1 meeting now')
+
+        self.assertTrue(response.data['mention_everyone'])
+        self.assertEqual(response.data['mentions'], [self.users[1].user_id])
+        self.assertFalse(Notifications.objects.exists())
+
+        write_notifications(outbox.get_batch(max_items=100, window=0), chunk_size=1)
+        notified = Notifications.objects.filter(notification_type='mention').values_list('user_id', flat=True)
+        self.assertEqual(sorted(notified), [user.user_id for user in self.users[1:]])
+
+    def test_trailing_punctuation_is_not_part_of_the_name(self):
+        mods = ServerRole.objects.create(server=self.server, name='mods')
+        ServerMember.objects.get(server=self.server, user=self.users[3]).roles.add(mods)
+        response, outbox = self.post_message('thanks @user1. cc @user2- and @mods, please')
+        self.assertEqual(sorted(response.data['mentions']), [self.users[1].user_id, self.users[2].user_id])
+        self.assertFalse(response.data['mention_everyone'])
+
+        write_notifications(outbox.get_batch(max_items=100, window=0))
+        notified = Notifications.objects.filter(notification_type='mention').values_list('user_id', flat=True)
+        self.assertEqual(sorted(notified), [user.user_id for user in self.users[1:]])
+
+        response, _ = self.post_message('meeting now, @everyone.')
+        self.assertTrue(response.data['mention_everyone'])
+
+    def test_names_ending_in_punctuation_still_match_as_written(self):
+        dotted = Users.objects.create_user(username='user1.', email='dotted@example.com', password='password123')
+        ServerMember.objects.create(server=self.server, user=dotted)
+        response, _ = self.post_message('hi @user1.')
+        self.assertEqual(response.data['mentions'], [dotted.user_id])
+
+    def test_members_who_blocked_the_author_are_not_notified(self):
+        for user in self.users[1:3]:
+            BlockedUser.objects.create(user=user, blocked_user=self.users[0])
+        response, outbox = self.post_message('@user1 @user3 and @everyone')
+        # The mention is still recorded on the message
+        self.assertEqual(sorted(response.data['mentions']), [self.users[1].user_id, self.users[3].user_id])
+
+        write_notifications(outbox.get_batch(max_items=100, window=0))
+        notified = Notifications.objects.filter(notification_type='mention').values_list('user_id', flat=True)
+        self.assertEqual(list(notified), [self.users[3].user_id])
+
+
+@override_settings(NOTIFICATION_WORKER_IN_PROCESS=False)
+class ReadStateTests(ClientMixin, TestCase):
+    """Unread and mention badges follow new messages and read markers"""
+
+    def setUp(self):
+        self.users = [
+            Users.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='password123')
+            for i in range(3)
+        ]
+        self.server = Servers.objects.create(name='Test Server', owner_id=self.users[0], invite_code='testcode')
+        for user in self.users:
+            ServerMember.objects.create(server=self.server, user=user)
+        self.channels = [
+            Channels.objects.create(discord_server_id=self.server, name=name) for name in ('general', 'random')
+        ]
+
+    def badge(self, user, channel):
+        with self.assertNumQueries(1):
+            response = self.client_for(user).get('/api/read-states/')
+        return next(b for b in response.data['channels'] if b['channel_id'] == channel.channel_id)
+
+    def test_badges_follow_messages_and_read_markers(self):
+        general = self.channels[0]
+        reader = self.client_for(self.users[1])
+        reader.post('/api/read-states/', {'channel_id': general.channel_id})
+
+        author = self.client_for(self.users[0])
+        for content in ['hello', 'hi @user1', 'anyone?']:
+            response = author.post(f'/api/messages/{general.channel_id}/', {'content': content})
+        last_id = response.data['message_id']
+
+        badge = self.badge(self.users[1], general)
+        self.assertTrue(badge['unread'])
+        self.assertEqual((badge['unread_count'], badge['mention_count']), (3, 1))
+
+        # The author has read their own messages; user2 never opened the channel
+        self.assertFalse(self.badge(self.users[0], general)['unread'])
+        badge = self.badge(self.users[2], general)
+        self.assertTrue(badge['unread'])
+        self.assertEqual((badge['unread_count'], badge['mention_count']), (3, 0))
+
+        response = reader.post('/api/read-states/', {'channel_id': general.channel_id, 'message_id': last_id - 1})
+        self.assertEqual((response.data['unread_count'], response.data['mention_count']), (1, 0))
+
+        reader.post('/api/read-states/', {'channel_id': general.channel_id})
+        badge = self.badge(self.users[1], general)
+        self.assertFalse(badge['unread'])
+        self.assertEqual((badge['unread_count'], badge['mention_count']), (0, 0))
+
+    def test_markers_are_clamped_to_the_newest_message(self):
+        general = self.channels[0]
+        reader = self.client_for(self.users[1])
+        response = reader.post('/api/read-states/', {'channel_id': general.channel_id, 'message_id': 2 ** 40})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['last_read_message_id'], 0)
+
+        author = self.client_for(self.users[0])
+        for content in ['one', 'two', 'three']:
+            response = author.post(f'/api/messages/{general.channel_id}/', {'content': content})
+        last_id = response.data['message_id']
+        self.assertTrue(self.badge(self.users[1], general)['unread'])
+
+        response = reader.post('/api/read-states/', {'channel_id': general.channel_id})
+        self.assertEqual((response.data['last_read_message_id'], response.data['unread_count']), (last_id, 0))
+        self.assertFalse(self.badge(self.users[1], general)['unread'])
+
+        response = reader.post('/api/read-states/', {'channel_id': general.channel_id, 'message_id': -1})
+        self.assertEqual(response.status_code, 400)
+
+    def test_owners_without_a_member_row_get_badges(self):
+        owner = self.users[0]
+        # Members who also own the server see each channel once
+        response = self.client_for(owner).get('/api/read-states/')
+        self.assertEqual(len(response.data['channels']), len(self.channels))
+        ServerMember.objects.filter(server=self.server, user=owner).delete()
+        self.client_for(self.users[1]).post(f'/api/messages/{self.channels[0].channel_id}/', {'content': 'hi'})
+        with self.assertNumQueries(1):
+            response = self.client_for(owner).get('/api/read-states/')
+        self.assertEqual(sorted(b['channel_id'] for b in response.data['channels']),
+                         sorted(channel.channel_id for channel in self.channels))
+        self.assertEqual(self.badge(owner, self.channels[0])['unread_count'], 1)
+
+    def test_new_messages_do_not_write_other_readers_states(self):
+        general = self.channels[0]
+        for user in self.users[1:]:
+            self.client_for(user).post('/api/read-states/', {'channel_id': general.channel_id})
+        before = {state.pk: state.updated_at for state in ReadState.objects.all()}
+
+        message = UserMessages.objects.create(
+            message_channel_id=general, user_channel_id=self.users[0], content='hello'
+        )
+        with self.assertNumQueries(3):
+            read_states.message_created(message)
+        for state in ReadState.objects.exclude(user=self.users[0]):
+            self.assertEqual(state.updated_at, before[state.pk])
+
+        UserMessages.objects.bulk_create([
+            UserMessages(message_channel_id=general, user_channel_id=self.users[0], content=str(i))
+            for i in range(read_states.UNREAD_COUNT_LIMIT + 5)
+        ])
+        Channels.objects.filter(pk=general.pk).update(last_message_id=UserMessages.objects.latest('message_id').pk)
+        self.assertEqual(self.badge(self.users[1], general)['unread_count'], read_states.UNREAD_COUNT_LIMIT)
+
+
+class MessageSearchTests(TestCase):
+    """Full-text search is scoped, highlighted and paged with a cursor"""
+
+    def setUp(self):
+        self.users = [
+            Users.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='password123')
+            for i in range(2)
+        ]
+        self.server = Servers.objects.create(name='Test Server', owner_id=self.users[0], invite_code='testcode')
+        ServerMember.objects.create(server=self.server, user=self.users[0])
+        self.channel = Channels.objects.create(discord_server_id=self.server, name='general')
+        for content in ['deploy <b>tonight</b>', 'deploy deploy again', 'lunch?', 'deploying now']:
+            UserMessages.objects.create(message_channel_id=self.channel, user_channel_id=self.users[0], content=content)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def search(self, **params):
+        response = self.client.get('/api/search/messages/', {'server_id': self.server.server_id, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_results_are_ranked_highlighted_and_paged(self):
+        first = self.search(q='deploy', limit=2)
+        self.assertEqual([m['content'] for m in first['results']], ['deploy deploy again', 'deploying now'])
+        self.assertEqual(first['results'][0]['snippet'], '<mark>deploy</mark> <mark>deploy</mark> again')
+
+        second = self.search(q='deploy', limit=2, cursor=first['next_cursor'])
+        self.assertEqual([m['content'] for m in second['results']], ['deploy <b>tonight</b>'])
+        self.assertEqual(second['results'][0]['snippet'], '<mark>deploy</mark> &lt;b&gt;tonight&lt;/b&gt;')
+        self.assertIsNone(second['next_cursor'])
+
+    def test_search_requires_membership(self):
+        self.client.force_authenticate(self.users[1])
+        response = self.client.get('/api/search/messages/', {'q': 'deploy', 'server_id': self.server.server_id})
+        self.assertEqual(response.status_code, 404)
+
+
+class UserBrowseTests(TestCase):
+    """Browsing pages by cursor and hides friends and blocked users"""
+
+    def setUp(self):
+        self.users = [
+            Users.objects.create_user(username=f'user{i:02d}', email=f'user{i}@example.com', password='password123')
+            for i in range(25)
+        ]
+        Friends.objects.create(users_id=self.users[0], user_friend_id=self.users[1])
+        BlockedUser.objects.create(user=self.users[0], blocked_user=self.users[2])
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def test_pages_cover_every_browsable_user_once(self):
+        seen, after = [], None
+        while True:
+            response = self.client.get('/api/users/browse/', {'limit': 10, **({'after': after} if after else {})})
+            seen += [user['username'] for user in response.data['users']]
+            after = response.data['pagination']['next_cursor']
+            if after is None:
+                break
+
+        self.assertEqual(seen, [user.username for user in self.users[3:]])
+        self.assertEqual(response.data['pagination']['total_count'], 22)
+
+    def test_search_matches_username_prefix(self):
+        response = self.client.get('/api/users/browse/', {'search': 'USER1'})
+        self.assertEqual([user['username'] for user in response.data['users']], [f'user{i}' for i in range(10, 20)])
+
+
+@override_settings(MESSAGE_ARCHIVE_ENABLED=True)
+class MessageArchiveTests(TestCase):
+    """Archived months move to the cold tier and history reads span both tiers"""
+
+    def setUp(self):
+        self.user = Users.objects.create_user(username='archivist', email='archivist@example.com', password='password123')
+        self.server = Servers.objects.create(name='Archive Server', owner_id=self.user, invite_code='archivecode')
+        ServerMember.objects.create(server=self.server, user=self.user)
+        self.channel = Channels.objects.create(discord_server_id=self.server, name='general')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        now = timezone.now()
+        self.messages = [
+            UserMessages.objects.create(
+                message_channel_id=self.channel,
+                user_channel_id=self.user,
+                content=f'Message {i}',
+                time_stamp=now - timedelta(days=120 - i * 10),
+            )
+            for i in range(12)
+        ]
+        self.messages[0].mentions.add(self.user)
+        toggle_reaction(self.messages[0], self.user, '👍')
+        self.pinned = self.messages[1]
+        UserMessages.objects.filter(pk=self.pinned.pk).update(is_pinned=True)
+        self.cutoff = now - timedelta(days=45)
+
+    def url(self, query=''):
+        return f'/api/messages/{self.channel.channel_id}/{query}'
+
+    def test_archiving_moves_old_unpinned_messages(self):
+        moved = sum(count for _, count in archive_before(self.cutoff))
+        archived = set(ArchivedMessage.objects.values_list('message_id', flat=True))
+        self.assertEqual(moved, len(archived))
+        self.assertTrue(archived)
+        self.assertNotIn(self.pinned.message_id, archived)
+        self.assertFalse(UserMessages.objects.filter(message_id__in=archived).exists())
+
+    def test_history_spans_both_tiers(self):
+        before = self.client.get(self.url('?limit=100')).data
+        archive_before(self.cutoff)
+
+        after = self.client.get(self.url('?limit=100')).data
+        # Archived reactions only keep their counts
+        self.assertEqual(after[0].pop('reactions'), [{'emoji': '👍', 'count': 1, 'me': False, 'users': []}])
+        before[0].pop('reactions')
+        self.assertEqual(after, before)
+        self.assertEqual(after[0]['mentions'], [self.user.user_id])
+
+        # Paging backwards with a hot anchor continues into the archive
+        newest_hot = UserMessages.objects.filter(is_pinned=False).order_by('time_stamp').first()
+        page = self.client.get(self.url(f'?before={newest_hot.message_id}&limit=3')).data
+        expected = [message['message_id'] for message in before if message['time_stamp'] < page[-1]['time_stamp']]
+        self.assertEqual([message['message_id'] for message in page][:-1], expected[-2:])
+        self.assertEqual(len(page), 3)
+
+        # ...and an archived message works as an anchor too
+        around = self.client.get(self.url(f'?around={self.messages[0].message_id}&limit=4')).data
+        self.assertEqual([message['message_id'] for message in around],
+                         [message['message_id'] for message in before[:4]])
+
+
+    def test_direct_messages_span_both_tiers(self):
+        friend = Users.objects.create_user(username='pen-pal', email='pen-pal@example.com', password='password123')
+        dm_channel = DirectMessageChannel.objects.create(user1=self.user, user2=friend)
+        now = timezone.now()
+        for i in range(5):
+            UserMessages.objects.create(dm_channel=dm_channel, user_channel_id=friend, content=f'DM {i}',
+                                        time_stamp=now - timedelta(days=100 - i * 20))
+        url = f'/api/channels/@me/{friend.user_id}/'
+        before = json.loads(b''.join(self.client.get(url).streaming_content))
+        archive_before(self.cutoff)
+        self.assertTrue(ArchivedMessage.objects.filter(dm_channel=dm_channel).exists())
+        after = json.loads(b''.join(self.client.get(url).streaming_content))
+        self.assertEqual(after, before)
+        self.assertEqual([message['content'] for message in after], [f'DM {i}' for i in range(5)])
+
+class ServerTransferTests(TestCase):
+    """Servers survive an export/import round trip, streamed in small chunks"""
+
+    def setUp(self):
+        self.owner = Users.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        self.member = Users.objects.create_user(username='member', email='member@example.com', password='password123')
+        self.server = Servers.objects.create(name='Exported', owner_id=self.owner, invite_code='exportcode')
+        ServerMember.objects.create(server=self.server, user=self.owner, role='owner')
+        ServerMember.objects.create(server=self.server, user=self.member, nickname='Mem')
+        self.channel = Channels.objects.create(discord_server_id=self.server, name='general')
+        for i in range(7):
+            message = UserMessages.objects.create(
+                message_channel_id=self.channel,
+                user_channel_id=self.owner if i % 2 else self.member,
+                content=f'Message {i} ✨',
+            )
+            toggle_reaction(message, self.owner, '👍')
+            toggle_reaction(message, self.member, '👍')
+
+    def export(self, compress=False):
+        return b''.join(export_jsonl(self.server, compress=compress, chunk_size=3))
+
+    def test_round_trip(self):
+        data = gzip.decompress(self.export(compress=True))
+        # Identical apart from the header's export time
+        self.assertEqual(data.splitlines()[1:], self.export().splitlines()[1:])
+
+        server, counts = import_server(io.BytesIO(data), chunk_size=3)
+        self.assertEqual(counts['members'], 2)
+        self.assertEqual(counts['messages'], 7)
+        self.assertEqual(counts['reactions'], 14)
+        self.assertEqual(counts['users_created'], 0)
+        server.refresh_from_db()
+        self.assertEqual(server.member_count, 2)
+
+        channel = Channels.objects.get(discord_server_id=server)
+        messages = UserMessages.objects.filter(message_channel_id=channel).order_by('message_id')
+        self.assertEqual(
+            [(m.content, m.user_channel_id_id) for m in messages],
+            [(m.content, m.user_channel_id_id) for m in UserMessages.objects.filter(
+                message_channel_id=self.channel).order_by('message_id')],
+        )
+        self.assertEqual(channel.last_message_id, messages.last().message_id)
+        self.assertEqual(
+            set(MessageReactionCount.objects.filter(message__in=messages).values_list('count', flat=True)), {2}
+        )
+
+    def test_unknown_users_become_placeholders(self):
+        lines = [
+            json.dumps({'type': 'export', 'version': 1}),
+            json.dumps({'type': 'server', 'name': 'Migrated', 'owner': 'newcomer'}),
+            json.dumps({'type': 'channel', 'id': 1, 'name': 'lobby'}),
+            json.dumps({'type': 'message', 'id': 1, 'channel': 1, 'author': 'newcomer', 'content': 'hi'}),
+        ]
+        server, counts = import_server(lines)
+        self.assertEqual(counts['users_created'], 1)
+        newcomer = Users.objects.get(username='newcomer')
+        self.assertFalse(newcomer.is_active)
+        self.assertFalse(newcomer.has_usable_password())
+        self.assertEqual(server.owner_id, newcomer)
+
+    def test_malformed_import_is_rolled_back(self):
+        lines = [
+            json.dumps({'type': 'server', 'name': 'Broken', 'owner': 'owner'}),
+            json.dumps({'type': 'message', 'id': 1, 'channel': 99, 'author': 'owner', 'content': 'lost'}),
+        ]
+        with self.assertRaises(TransferError):
+            import_server(lines)
+        self.assertFalse(Servers.objects.filter(name='Broken').exists())
+
+    def test_wrongly_typed_fields_are_transfer_errors(self):
+        server = {'type': 'server', 'name': 'Typed', 'owner': 'owner'}
+        channel = {'type': 'channel', 'id': 1, 'name': 'lobby'}
+        for records in (
+            [{**server, 'created_at': 5}],
+            [server, {**channel, 'id': [1]}],
+            [server, channel, {'type': 'message', 'id': 1, 'channel': [1], 'author': 'owner'}],
+            [server, {'type': ['member'], 'user': 'member'}],
+        ):
+            with self.assertRaises(TransferError):
+                import_server([json.dumps(record) for record in records])
+        self.assertFalse(Servers.objects.filter(name='Typed').exists())
+
+        self.owner.is_staff = True
+        self.owner.save()
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        export = io.BytesIO(json.dumps({**server, 'created_at': 5}).encode())
+        export.name = 'server.jsonl'
+        response = client.post('/api/admin/servers/import/', {'file': export}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+    def test_member_count_excludes_ignored_rows(self):
+        importer = ServerImporter()
+        importer.add_server({'name': 'Counted', 'owner': 'owner'})
+        importer.add_member({'user': 'member'})
+        # Already a member, so the owner's row is skipped by the bulk insert
+        ServerMember.objects.create(server=importer.server, user=self.owner, role='owner')
+        importer.finish()
+        self.assertEqual(importer.counts['members'], 1)
+        self.assertEqual(ServerMember.objects.filter(server=importer.server).count(), 2)
+
+    def test_admin_api(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        url = f'/api/admin/servers/{self.server.server_id}/export/'
+        self.assertEqual(client.get(url).status_code, 403)
+
+        self.owner.is_staff = True
+        self.owner.save()
+        response = client.get(url + '?compress=gzip')
+        self.assertEqual(response.status_code, 200)
+        export = io.BytesIO(b''.join(response.streaming_content))
+        export.name = 'server.jsonl.gz'
+        response = client.post('/api/admin/servers/import/', {'file': export}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['messages'], 7)
+
+
+@override_settings(STREAMING_CHUNK_SIZE=10)
+class StreamingListTests(TestCase):
+    """Large lists are streamed chunk by chunk with the same JSON as before"""
+
+    def setUp(self):
+        self.users = [
+            Users.objects.create_user(username=f'streamer{i}', email=f'streamer{i}@example.com', password='password123')
+            for i in range(25)
+        ]
+        self.server = Servers.objects.create(name='Stream Server', owner_id=self.users[0], invite_code='streamcode')
+        for user in self.users:
+            ServerMember.objects.create(server=self.server, user=user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def get_json(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_members_match_serializer(self):
+        url = f'/api/servers/{self.server.server_id}/members/'
+        with CaptureQueriesContext(connection) as ctx:
+            members = self.get_json(url)
+        expected = ServerMemberSerializer(ServerMember.objects.filter(server=self.server).order_by('id'), many=True).data
+        self.assertEqual(members, json.loads(JSONRenderer().render(expected)))
+        # Membership check, then one query for the members and one for their roles per chunk of 10
+        self.assertLessEqual(len(ctx.captured_queries), 2 + 2 * 3)
+
+    def test_empty_notifications(self):
+        self.assertEqual(self.get_json('/api/notifications/'), [])
+
+    def test_notifications_newest_first(self):
+        for i in range(12):
+            Notifications.objects.create(user_id=self.users[0], notification_type='message', title=f'N{i}', content='x')
+        notifications = self.get_json('/api/notifications/')
+        self.assertEqual([n['title'] for n in notifications], [f'N{i}' for i in reversed(range(12))])
+        expected = NotificationSerializer(Notifications.objects.get(title='N11')).data
+        self.assertEqual(notifications[0], json.loads(JSONRenderer().render(expected)))
+
+    def test_chunks_split_rows_with_equal_sort_keys(self):
+        now = timezone.now()
+        Notifications.objects.bulk_create([
+            Notifications(user_id=self.users[0], notification_type='message', title=f'N{i}', content='x', time_stamp=now)
+            for i in range(25)
+        ])
+        with CaptureQueriesContext(connection) as ctx:
+            notifications = self.get_json('/api/notifications/')
+        # Ties on time_stamp are broken by notify_id, across chunk boundaries
+        self.assertEqual([n['title'] for n in notifications], [f'N{i}' for i in reversed(range(25))])
+        # One LIMIT query per chunk of 10
+        self.assertEqual(len(ctx.captured_queries), 3)
+
+    def test_iterate_follows_the_queryset_ordering(self):
+        members = ServerMember.objects.filter(server=self.server)
+        expected = list(members.order_by('-user_id').values_list('id', flat=True))
+        self.assertEqual(len(expected), 25)
+        rows = iterate(members.order_by('-user_id').values('id', 'user_id'), size=4)
+        self.assertEqual([row['id'] for row in rows], expected)
+        messages = [UserMessages(user_channel_id=self.users[0], content=str(i)) for i in range(7)]
+        UserMessages.objects.bulk_create(messages)
+        # Model instances, in the model's default ordering (time_stamp, then the primary key)
+        self.assertEqual([message.content for message in iterate(UserMessages.objects.all(), size=3)],
+                         [str(i) for i in range(7)])
+
+    def test_streamed_lists_refuse_other_formats(self):
+        url = f'/api/servers/{self.server.server_id}/members/'
+        # Negotiates like MessagePackRenderer without needing msgpack installed
+        binary = type('BinaryRenderer', (ORJSONRenderer,), {
+            'media_type': MessagePackRenderer.media_type, 'format': MessagePackRenderer.format
+        })
+        renderers = [ORJSONRenderer, binary]
+        with patch.object(views.ServerMembersView, 'renderer_classes', renderers):
+            response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+            self.assertEqual(response.status_code, 406)
+            # Clients that also accept JSON get it
+            response = self.client.get(url, HTTP_ACCEPT='application/msgpack, application/json')
+            self.assertEqual(len(json.loads(b''.join(response.streaming_content))), 25)
+
+    async def test_asgi_pulls_one_part_at_a_time(self):
+        pulled = []
+
+        def parts():
+            for i in range(3):
+                pulled.append(threading.get_ident())
+                yield str(i).encode()
+
+        # ASGIHandler.send_response consumes responses through aiter()
+        content = aiter(IncrementalStreamingResponse(parts()))
+        self.assertEqual(await anext(content), b'0')
+        self.assertEqual(len(pulled), 1)
+        self.assertEqual([part async for part in content], [b'1', b'2'])
+        # Every part came from the same worker thread, never the event loop's
+        self.assertEqual(len(set(pulled)), 1)
+        self.assertNotIn(threading.get_ident(), pulled)
+
+    async def test_asgi_body_matches_wsgi(self):
+        def response():
+            members = ServerMember.objects.filter(server=self.server).order_by('id')
+            return StreamingJSONResponse(members, lambda chunk: ServerMemberSerializer(chunk, many=True).data, size=10)
+
+        wsgi_body = await sync_to_async(lambda: b''.join(response()))()
+        asgi_body = b''.join([part async for part in aiter(await sync_to_async(response)())])
+        self.assertEqual(asgi_body, wsgi_body)
+        self.assertEqual(len(json.loads(asgi_body)), 25)
+
+
+class RendererTests(TestCase):
+    """The fast renderers produce the same payloads as DRF's JSON renderer"""
+
+    def setUp(self):
+        self.user = Users.objects.create_user(username='render', email='render@example.com', password='password123')
+        server = Servers.objects.create(name='Render Server', owner_id=self.user, invite_code='rendercode')
+        channel = Channels.objects.create(discord_server_id=server, name='general')
+        message = UserMessages.objects.create(message_channel_id=channel, user_channel_id=self.user,
+                                              content='héllo \u2028 <world> 🎉')
+        message.mentions.add(self.user)
+        toggle_reaction(message, self.user, '🎉')
+        self.data = MessageSerializer(UserMessages.objects.with_related(), many=True).data
+
+    def test_json_matches_stock_renderer(self):
+        extra = {'when': timezone.now(), 'amount': Decimal('1.50'), 'keys': {1: 'one'}}
+        for data in (self.data, extra):
+            self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            ORJSONRenderer().render(self.data, 'application/json; indent=4'),
+            JSONRenderer().render(self.data, 'application/json; indent=4'),
+        )
+
+    def test_json_float_and_fallback_cases(self):
+        # Same value, different spelling of the exponent
+        self.assertEqual(ORJSONRenderer().render({'x': 1e16}), b'{"x":1e16}')
+        self.assertEqual(JSONRenderer().render({'x': 1e16}), b'{"x":1e+16}')
+        # NaN and infinities become null instead of an error
+        self.assertEqual(ORJSONRenderer().render([float('nan'), float('inf')]), b'[null,null]')
+        with self.assertRaises(ValueError):
+            JSONRenderer().render([float('nan')])
+        # orjson can't encode integers wider than 64 bits; JSONRenderer renders those
+        data = {'big': 2 ** 70, 'when': timezone.now()}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_json_round_trip(self):
+        body = ORJSONRenderer().render(self.data)
+        self.assertEqual(ORJSONParser().parse(io.BytesIO(body)), json.loads(body))
+
+    def test_api_uses_fast_renderer(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/profile/')
+        self.assertIsInstance(response.accepted_renderer, ORJSONRenderer)
+
+    @unittest.skipUnless(importlib.util.find_spec('msgpack'), 'msgpack is not installed')
+    def test_msgpack_round_trip(self):
+        body = MessagePackRenderer().render(self.data)
+        self.assertEqual(MessagePackParser().parse(io.BytesIO(body)), json.loads(JSONRenderer().render(self.data)))
+
+
+class ValuesSerializerParityTests(TestCase):
+    """The values fast paths render byte-for-byte what the ModelSerializers render"""
+
+    def setUp(self):
+        self.users = [
+            Users.objects.create_user(username=f'parity{i}', email=f'parity{i}@example.com', password='password123',
+                                      display_name=f'Parity {i}' if i % 2 else None)
+            for i in range(4)
+        ]
+        self.server = Servers.objects.create(name='Parity Server', owner_id=self.users[0], invite_code='paritycode')
+        roles = [
+            ServerRole.objects.create(server=self.server, name=f'role{i}', position=i, manage_messages=bool(i % 2))
+            for i in range(3)
+        ]
+        for i, user in enumerate(self.users):
+            member = ServerMember.objects.create(server=self.server, user=user, nickname=f'nick{i}' if i else None,
+                                                 role='owner' if i == 0 else 'member')
+            member.roles.set(roles[:i])
+        channel = Channels.objects.create(discord_server_id=self.server, name='general')
+        dm_channel = DirectMessageChannel.objects.create(user1=self.users[0], user2=self.users[1])
+        for i in range(6):
+            message = UserMessages.objects.create(
+                message_channel_id=None if i == 5 else channel,
+                dm_channel=dm_channel if i == 5 else None,
+                user_channel_id=self.users[i % 4],
+                content=f'Message {i} ✨',
+                attachment_url='https://example.com/a.png' if i == 2 else None,
+                is_edited=i == 3,
+                edited_at=timezone.now() if i == 3 else None,
+            )
+            message.mentions.add(*self.users[:i % 3])
+            for user in self.users[:i]:
+                toggle_reaction(message, user, '👍' if user.user_id % 2 else '🎉')
+            if i < 3:
+                Friends.objects.create(users_id=self.users[0], user_friend_id=self.users[i + 1])
+        self.request = type('Request', (), {'user': self.users[1]})()
+
+    def assertRendersSame(self, expected, actual):
+        self.assertEqual(JSONRenderer().render(actual), JSONRenderer().render(expected))
+
+    def test_messages(self):
+        messages = UserMessages.objects.order_by('message_id')
+        context = {'request': self.request}
+        self.assertRendersSame(
+            MessageSerializer(messages.with_related(), many=True, context=context).data,
+            MessageValuesSerializer(context).serialize(messages),
+        )
+        ids = list(messages.values_list('message_id', flat=True))[::-1]
+        self.assertEqual([m['message_id'] for m in MessageValuesSerializer(context).serialize_ids(ids)], ids)
+
+    def test_server_members(self):
+        members = ServerMember.objects.filter(server=self.server).order_by('id')
+        self.assertRendersSame(
+            ServerMemberSerializer(members.select_related('user').prefetch_related('roles'), many=True).data,
+            ServerMemberValuesSerializer().serialize(members),
+        )
+
+    def test_friends(self):
+        friends = Friends.objects.filter(users_id=self.users[0]).order_by('friends_id')
+        self.assertRendersSame(FriendSerializer(friends, many=True).data, FriendValuesSerializer().serialize(friends))
+
+    def test_friends_of_either_side(self):
+        # users[1] is the higher id of one pair and the lower id of another
+        Friends.objects.create(users_id=self.users[1], user_friend_id=self.users[3])
+        for user in self.users[:2]:
+            expected = list(Friends.objects.filter(users_id=user).select_related('user_friend_id'))
+            for row in Friends.objects.filter(user_friend_id=user).select_related('users_id'):
+                row.user_friend_id = row.users_id
+                expected.append(row)
+            expected.sort(key=lambda row: row.friends_id)
+            self.assertRendersSame(
+                FriendSerializer(expected, many=True).data,
+                FriendValuesSerializer().serialize_friends_of(user.user_id),
+            )
+
+
+class DMInboxTests(ClientMixin, TestCase):
+    """The DM channel list is served from the per-user inbox"""
+
+    def setUp(self):
+        self.users = [
+            Users.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='password123')
+            for i in range(3)
+        ]
+
+    def inbox(self, user):
+        with self.assertNumQueries(1):
+            response = self.client_for(user).get('/api/channels/@me/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_inbox_follows_messages_reads_and_profiles(self):
+        first, second, third = self.users
+        for content in ['hello', 'are you there?']:
+            self.client_for(first).post(f'/api/channels/@me/{second.user_id}/', {'content': content})
+        self.client_for(third).post(f'/api/channels/@me/{first.user_id}/', {'content': 'hi ' * 100})
+
+        entries = self.inbox(first)
+        self.assertEqual([entry['peer']['username'] for entry in entries], ['user2', 'user1'])
+        self.assertEqual(entries[0]['unread_count'], 1)
+        self.assertEqual(len(entries[0]['last_message']['preview']), 200)
+        self.assertEqual((entries[1]['unread_count'], entries[1]['last_message']['preview']), (0, 'are you there?'))
+
+        # Same channel fields as DirectMessageChannelSerializer
+        dm_channel = DirectMessageChannel.objects.get(pk=entries[1]['dm_channel_id'])
+        expected = DirectMessageChannelSerializer(dm_channel).data
+        self.assertEqual({key: entries[1][key] for key in expected}, expected)
+
+        [entry] = self.inbox(second)
+        self.assertEqual((entry['peer']['user_id'], entry['unread_count']), (first.user_id, 2))
+        self.assertEqual(entry['last_message']['author_id'], first.user_id)
+        # Both lists count from the same read marker
+        [badge] = self.client_for(second).get('/api/read-states/').data['dm_channels']
+        self.assertEqual(badge['unread_count'], entry['unread_count'])
+
+        self.client_for(second).post('/api/read-states/', {'dm_channel_id': entry['dm_channel_id']})
+        self.assertEqual(self.inbox(second)[0]['unread_count'], 0)
+
+        first.display_name = 'First'
+        first.save()
+        self.assertEqual(self.inbox(second)[0]['peer']['display_name'], 'First')
+        self.assertEqual(self.inbox(second)[0]['user1_details']['display_name'], 'First')
+
+
+class DMChannelPairTests(ClientMixin, TestCase):
+    """Every path finds the same DM channel, stored as (lower id, higher id)"""
+
+    def setUp(self):
+        self.low = Users.objects.create_user(username='low', email='low@example.com', password='password123')
+        self.high = Users.objects.create_user(username='high', email='high@example.com', password='password123')
+        Friends.objects.create(users_id=self.low, user_friend_id=self.high)
+        # Ids are reused between tests, so don't trust pairs cached by earlier ones
+        dm_channels._pairs.clear()
+
+    def test_pair_is_canonical_and_cached(self):
+        response = self.client_for(self.high).post('/api/channels/@me/', {'user_id': self.low.user_id})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['user1'], response.data['user2']), (self.low.user_id, self.high.user_id))
+        dm_channel_id = response.data['dm_channel_id']
+
+        response = self.client_for(self.low).post('/api/channels/@me/', {'user_id': self.high.user_id})
+        self.assertEqual((response.status_code, response.data['dm_channel_id']), (200, dm_channel_id))
+        response = self.client_for(self.low).post(f'/api/channels/@me/{self.high.user_id}/', {'content': 'hi'})
+        self.assertEqual(response.data['dm_channel'], dm_channel_id)
+        self.assertEqual(DirectMessageChannel.objects.count(), 1)
+
+        # The pair is cached, so reading the conversation doesn't look the channel up again
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_for(self.high).get(f'/api/channels/@me/{self.low.user_id}/')
+            messages = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([message['content'] for message in messages], ['hi'])
+        self.assertFalse(any('directmessagechannel' in query['sql'] for query in queries.captured_queries))
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DirectMessageChannel.objects.create(user1=self.high, user2=self.low)
+
+        DirectMessageChannel.objects.get(pk=dm_channel_id).delete()
+        self.assertIsNone(dm_channels.find_dm_channel_id(self.low.user_id, self.high.user_id))
+
+
+class FriendGraphTests(ClientMixin, TestCase):
+    """A friendship is one row; friend checks and lists come from the adjacency cache"""
+
+    def setUp(self):
+        self.users = [
+            Users.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='password123')
+            for i in range(4)
+        ]
+        friendships._adjacency.clear()
+
+    def befriend(self, sender, receiver):
+        response = self.client_for(sender).post('/api/friend-requests/', {'sender': sender.user_id, 'receiver': receiver.user_id})
+        self.assertEqual(response.status_code, 201)
+        response = self.client_for(receiver).post(f'/api/friend-requests/{response.data["request_id"]}/accept/')
+        self.assertEqual(response.status_code, 200)
+
+    def friend_list(self, user):
+        return {friend['user_friend_id']: friend['username'] for friend in self.client_for(user).get('/api/friends/').data}
+
+    def test_friendships(self):
+        first, second, third, fourth = self.users
+        self.befriend(first, second)
+        self.befriend(third, first)
+        self.befriend(second, third)
+        self.assertEqual(Friends.objects.count(), 3)
+        self.assertFalse(Friends.objects.filter(users_id__gt=F('user_friend_id')).exists())
+
+        # Both sides see the friendship
+        self.assertEqual(self.friend_list(first), {second.user_id: 'user1', third.user_id: 'user2'})
+        self.assertEqual(self.friend_list(third), {first.user_id: 'user0', second.user_id: 'user1'})
+
+        friendships.friend_ids(second.user_id)
+        friendships.friend_ids(third.user_id)
+        with self.assertNumQueries(0):
+            self.assertTrue(friendships.are_friends(third.user_id, second.user_id))
+            self.assertFalse(friendships.are_friends(third.user_id, fourth.user_id))
+        # Only the user and block lookups; the friend lists come from the cache
+        with self.assertNumQueries(2):
+            response = self.client_for(second).get(f'/api/friends/{third.user_id}/mutual/')
+        self.assertEqual((response.data['count'], response.data['mutual_friend_ids']), (1, [first.user_id]))
+
+        response = self.client_for(third).post('/api/friend-requests/', {'sender': third.user_id, 'receiver': first.user_id})
+        self.assertEqual(response.status_code, 400)
+        browsable = [user['user_id'] for user in self.client_for(third).get('/api/users/browse/').data['users']]
+        self.assertEqual(browsable, [fourth.user_id])
+
+        # Blocking ends the friendship and drops the cached lists
+        self.client_for(second).post('/api/blocked-users/', {'blocked_user': first.user_id})
+        self.assertFalse(friendships.are_friends(first.user_id, second.user_id))
+        self.assertEqual(self.friend_list(first), {third.user_id: 'user2'})
+
+    def test_mutual_friends_hidden_by_blocks_and_missing_users(self):
+        first, second, third, _ = self.users
+        self.befriend(first, third)
+        self.befriend(second, third)
+        url = f'/api/friends/{second.user_id}/mutual/'
+        self.assertEqual(self.client_for(first).get(url).data['mutual_friend_ids'], [third.user_id])
+
+        # A block either way hides the mutual friends from both sides
+        BlockedUser.objects.create(user=second, blocked_user=first)
+        self.assertEqual(self.client_for(first).get(url).data['count'], 0)
+        response = self.client_for(second).get(f'/api/friends/{first.user_id}/mutual/')
+        self.assertEqual(response.data['mutual_friend_ids'], [])
+
+        response = self.client_for(first).get('/api/friends/999999/mutual/')
+        self.assertEqual(response.status_code, 404)
+        third.is_active = False
+        third.save()
+        response = self.client_for(first).get(f'/api/friends/{third.user_id}/mutual/')
+        self.assertEqual(response.status_code, 404)
+
+
+class FriendSuggestionTests(TestCase):
+    """Suggestions are ranked by mutual friends and shared servers and refreshed incrementally"""
+
+    def setUp(self):
+        self.users = [
+            Users.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='password123')
+            for i in range(6)
+        ]
+        friendships._adjacency.clear()
+        for a, b in [(0, 1), (0, 2), (1, 3), (2, 3), (1, 4)]:
+            friendships.add_friendship(self.users[a], self.users[b])
+        server = Servers.objects.create(name='Test Server', owner_id=self.users[0], invite_code='testcode')
+        for user in (self.users[0], self.users[5]):
+            ServerMember.objects.create(server=server, user=user)
+        suggestions.refresh_stale()
+
+    def suggested(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        friendships.friend_ids(user.user_id)
+        with self.assertNumQueries(1):
+            response = client.get('/api/friends/suggestions/')
+        return [(entry['username'], entry['mutual_friend_count'], entry['shared_server_count'], entry['score'])
+                for entry in response.data]
+
+    def test_ranking_and_incremental_refresh(self):
+        first = self.users[0]
+        self.assertEqual(self.suggested(first), [('user3', 2, 0, 4), ('user4', 1, 0, 2), ('user5', 0, 1, 1)])
+        self.assertFalse(FriendSuggestionRefresh.objects.exists())
+
+        # A new friendship queues both users, and the job expands that to their friends
+        friendships.add_friendship(self.users[1], self.users[5])
+        queued = dict(FriendSuggestionRefresh.objects.values_list('user_id', 'include_friends'))
+        self.assertEqual(queued, {self.users[1].user_id: True, self.users[5].user_id: True})
+        # A plain requeue (joining a server) keeps the flag
+        suggestions.queue_refresh([self.users[5].user_id])
+        self.assertTrue(FriendSuggestionRefresh.objects.get(user_id=self.users[5].user_id).include_friends)
+        with patch.object(suggestions, 'refresh_suggestions', wraps=suggestions.refresh_suggestions) as refresh:
+            self.assertEqual(suggestions.refresh_stale(batch_size=2)[0], 5)
+        refreshed = {user_id for call in refresh.call_args_list for user_id in call.args[0]}
+        self.assertEqual(refreshed, {self.users[i].user_id for i in (0, 1, 3, 4, 5)})
+        self.assertFalse(FriendSuggestionRefresh.objects.exists())
+        self.assertEqual(self.suggested(first), [('user3', 2, 0, 4), ('user5', 1, 1, 3), ('user4', 1, 0, 2)])
+
+        # Requests and blocks take effect before the next refresh
+        BlockedUser.objects.create(user=first, blocked_user=self.users[5])
+        FriendRequest.objects.create(sender=self.users[4], receiver=first)
+        self.assertEqual(self.suggested(first), [('user3', 2, 0, 4)])
+
+        self.assertEqual(suggestions.refresh_all()[0], 6)
+        self.assertEqual(self.suggested(first), [('user3', 2, 0, 4)])
+
+    def test_inactive_users_are_left_out(self):
+        first, second, _, third, *_ = self.users
+        Users.objects.filter(pk=second.pk).update(is_active=False)
+        # Filtered as the graph is loaded, without reading every inactive id
+        with self.assertNumQueries(9):
+            ranked = suggestions.compute_suggestions([first.user_id])
+        # user3 and user4 were only reachable through user1
+        self.assertEqual([entry[:3] for entry in ranked[first.user_id]],
+                         [(third.user_id, 2, 1), (self.users[5].user_id, 1, 0)])
+
+
+class BlockListTests(ClientMixin, TestCase):
+    """Blocks are checked against cached per-user lists and hide the blocked user's messages"""
+
+    def setUp(self):
+        self.users = [
+            Users.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='password123')
+            for i in range(3)
+        ]
+        server = Servers.objects.create(name='Test Server', owner_id=self.users[0], invite_code='testcode')
+        for user in self.users:
+            ServerMember.objects.create(server=server, user=user)
+        self.channel = Channels.objects.create(discord_server_id=server, name='general')
+        for user in self.users:
+            UserMessages.objects.create(message_channel_id=self.channel, user_channel_id=user, content=user.username)
+        blocks._block_lists.clear()
+
+    def test_blocks(self):
+        first, second, third = self.users
+        response = self.client_for(first).post('/api/blocked-users/', {'blocked_user': second.user_id})
+        self.assertEqual(response.status_code, 201)
+        block_id = response.data['block_id']
+
+        blocks.blocked_ids(first.user_id)
+        blocks.blocked_ids(second.user_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(list(blocks.blocked_ids(first.user_id)), [second.user_id])
+            self.assertEqual(list(blocks.blocked_ids(second.user_id)), [])
+        self.assertTrue(blocks.block_exists(first.user_id, second.user_id))
+        self.assertTrue(blocks.block_exists(second.user_id, first.user_id))
+        self.assertFalse(blocks.block_exists(first.user_id, third.user_id))
+
+        # Either side is refused
+        response = self.client_for(second).post(f'/api/channels/@me/{first.user_id}/', {'content': 'hi'})
+        self.assertEqual(response.status_code, 403)
+        response = self.client_for(second).post('/api/friend-requests/', {'sender': second.user_id, 'receiver': first.user_id})
+        self.assertEqual(response.status_code, 400)
+
+        # Only the blocker stops seeing the other's messages
+        history = self.client_for(first).get(f'/api/messages/{self.channel.channel_id}/')
+        self.assertEqual(sorted(message['content'] for message in history.data), ['user0', 'user2'])
+        history = self.client_for(second).get(f'/api/messages/{self.channel.channel_id}/')
+        self.assertEqual(len(history.data), 3)
+
+        # Unblocking drops the cached lists
+        response = self.client_for(first).delete(f'/api/blocked-users/{block_id}/')
+        self.assertEqual(response.status_code, 204)
+        with self.assertNumQueries(1):
+            self.assertEqual(list(blocks.blocked_ids(first.user_id)), [])
+        response = self.client_for(second).post(f'/api/channels/@me/{first.user_id}/', {'content': 'hi'})
+        self.assertEqual(response.status_code, 201)
+
+    def test_writes_check_the_database(self):
+        first, second, _ = self.users
+        self.assertEqual(list(blocks.blocked_ids(first.user_id)), [])
+        # A block made by another process: this one's cached list is not invalidated
+        BlockedUser.objects.bulk_create([BlockedUser(user=first, blocked_user=second)])
+        self.assertEqual(list(blocks.blocked_ids(first.user_id)), [])
+
+        response = self.client_for(second).post(f'/api/channels/@me/{first.user_id}/', {'content': 'hi'})
+        self.assertEqual(response.status_code, 403)
+        response = self.client_for(second).post('/api/channels/@me/', {'user_id': first.user_id})
+        self.assertEqual((response.status_code, response.data['error']), (403, 'You cannot message this user'))
+        response = self.client_for(second).post('/api/friend-requests/', {'sender': second.user_id, 'receiver': first.user_id})
+        self.assertEqual(response.status_code, 400)
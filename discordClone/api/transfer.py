@@ -0,0 +1,405 @@
+"""
+Server export and import as JSON Lines.
+
+An export is one JSON object per line: a header, then the server, its
+members, its channels and every message with its reactions embedded::
+
+    {"type": "export", "version": 1, "exported_at": "..."}
+    {"type": "server", "name": "...", "owner": "alice", ...}
+    {"type": "member", "user": "bob", "role": "member", ...}
+    {"type": "channel", "id": 12, "name": "general", ...}
+    {"type": "message", "id": 345, "channel": 12, "author": "bob", "content": "...",
+     "reactions": [{"user": "alice", "emoji": "👍", "created_at": "..."}], ...}
+
+Users are referenced by username. Channel and message ids are those of the
+source and are only used to link records together. Embedding reactions in
+their message keeps both sides streaming: exports read messages a chunk at
+a time with keyset pagination, and imports write them in chunks with
+``bulk_create``, so memory use does not grow with the size of the server.
+
+Exports can be gzip-compressed on the fly, and imports accept either.
+"""
+import gzip
+import json
+import uuid
+import zlib
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from channels.models import Channels
+from servers.models import BASE_ROLE_PERMISSIONS, ServerMember, Servers
+from user_messages.models import MessageReaction, MessageReactionCount, UserMessages
+from users.models import Users
+
+from .archive import archive_enabled, archived_history, parse_archived_datetime, unpack
+from .streaming import chunked, iterate
+
+FORMAT_VERSION = 1
+CHUNK_SIZE = 2000
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class TransferError(ValueError):
+    """The import stream is malformed"""
+
+
+def _timestamp(value):
+    return value.isoformat() if value else None
+
+
+def _parse_timestamp(value, default=None):
+    if not value:
+        return default
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise TransferError(f'Invalid timestamp: {value}')
+    return parsed
+
+
+# Export
+
+def _message_record(message, reactions):
+    return {
+        'type': 'message',
+        'id': message.message_id,
+        'channel': message.message_channel_id_id,
+        'author': message.user_channel_id.username,
+        'content': message.content,
+        'attachment_url': message.attachment_url,
+        'attachment_type': message.attachment_type,
+        'is_edited': message.is_edited,
+        'edited_at': _timestamp(message.edited_at),
+        'is_pinned': message.is_pinned,
+        'mention_everyone': message.mention_everyone,
+        'time_stamp': _timestamp(message.time_stamp),
+        'reactions': reactions,
+    }
+
+
+def _archived_record(message):
+    payload = unpack(message.payload)
+    return {
+        'type': 'message',
+        'id': message.message_id,
+        'channel': message.message_channel_id_id,
+        'author': message.user_channel_id.username,
+        'content': payload['content'],
+        'attachment_url': payload['attachment_url'],
+        'attachment_type': payload['attachment_type'],
+        'is_edited': payload['is_edited'],
+        'edited_at': _timestamp(parse_archived_datetime(payload['edited_at'])),
+        'is_pinned': payload['is_pinned'],
+        'mention_everyone': payload['mention_everyone'],
+        'time_stamp': _timestamp(message.time_stamp),
+        # Archived messages only keep reaction counts, not who reacted
+        'reactions': [],
+    }
+
+
+def _channel_messages(channel, chunk_size):
+    messages = iterate(
+        UserMessages.objects
+        .filter(message_channel_id=channel)
+        .select_related('user_channel_id')
+        .order_by('message_id'),
+        chunk_size,
+    )
+    for chunk in chunked(messages, chunk_size):
+        reactions = {}
+        for message_id, username, emoji, created_at in (
+            MessageReaction.objects
+            .filter(message_id__in=[message.message_id for message in chunk])
+            .order_by('reaction_id')
+            .values_list('message_id', 'user__username', 'emoji', 'created_at')
+        ):
+            reactions.setdefault(message_id, []).append(
+                {'user': username, 'emoji': emoji, 'created_at': _timestamp(created_at)}
+            )
+        for message in chunk:
+            yield _message_record(message, reactions.get(message.message_id, []))
+
+    if archive_enabled():
+        archived = archived_history(channel_id=channel.channel_id).order_by('message_id')
+        for message in iterate(archived, chunk_size):
+            yield _archived_record(message)
+
+
+def export_records(server, chunk_size=CHUNK_SIZE):
+    """Yield the export records of ``server`` as dicts"""
+    yield {'type': 'export', 'version': FORMAT_VERSION, 'exported_at': _timestamp(timezone.now())}
+    yield {
+        'type': 'server',
+        'name': server.name,
+        'description': server.description,
+        'icon': server.icon,
+        'is_public': server.is_public,
+        'owner': server.owner_id.username,
+        'created_at': _timestamp(server.created_at),
+    }
+
+    members = iterate(
+        ServerMember.objects
+        .filter(server=server)
+        .order_by('id')
+        .values('id', 'user__username', 'nickname', 'role', 'joined_at'),
+        chunk_size,
+    )
+    for member in members:
+        yield {'type': 'member', 'user': member['user__username'], 'nickname': member['nickname'],
+               'role': member['role'], 'joined_at': _timestamp(member['joined_at'])}
+
+    channels = list(Channels.objects.filter(discord_server_id=server).order_by('channel_id'))
+    for channel in channels:
+        yield {'type': 'channel', 'id': channel.channel_id, 'name': channel.name,
+               'channel_type': channel.channel_type, 'created_at': _timestamp(channel.created_at)}
+    for channel in channels:
+        yield from _channel_messages(channel, chunk_size)
+
+
+def export_jsonl(server, compress=False, chunk_size=CHUNK_SIZE):
+    """
+    Yield the export of ``server`` as JSONL, in chunks of bytes suitable for
+    a StreamingHttpResponse or a file, gzip-compressed if ``compress``.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    for records in chunked(export_records(server, chunk_size), chunk_size):
+        data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode()
+        if compressor is None:
+            yield data
+        elif compressed := compressor.compress(data):
+            yield compressed
+    if compressor is not None:
+        yield compressor.flush()
+
+
+# Import
+
+def open_stream(fileobj):
+    """Wrap a seekable binary file so plain and gzip-compressed imports read the same"""
+    magic = fileobj.read(2)
+    fileobj.seek(0)
+    if magic == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=fileobj)
+    return fileobj
+
+
+def _records(lines):
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise TransferError(f'Line {number}: not valid JSON')
+        if not isinstance(record, dict) or not isinstance(record.get('type'), str):
+            raise TransferError(f'Line {number}: records must be objects with a type')
+        yield number, record
+
+
+class ServerImporter:
+    """
+    Writes an export stream into a new server. Members and messages are
+    buffered and written ``chunk_size`` at a time; only the channel and user
+    id maps are kept for the whole import.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.server = None
+        self.users = {}
+        self.channels = {}
+        self.members = []
+        self.member_usernames = set()
+        self.messages = []
+        self.counts = {'members': 0, 'channels': 0, 'messages': 0, 'reactions': 0, 'users_created': 0}
+
+    def resolve_users(self, usernames):
+        """Map usernames to user ids, creating inactive placeholder accounts for unknown ones"""
+        missing = set(usernames) - self.users.keys()
+        if not missing:
+            return
+        self.users.update(Users.objects.filter(username__in=missing).values_list('username', 'user_id'))
+        missing -= self.users.keys()
+        if missing:
+            password = make_password(None)
+            Users.objects.bulk_create([
+                Users(username=username, email=f'{uuid.uuid4().hex}@imported.invalid',
+                      password=password, is_active=False)
+                for username in missing
+            ])
+            self.users.update(Users.objects.filter(username__in=missing).values_list('username', 'user_id'))
+            self.counts['users_created'] += len(missing)
+
+    def add_server(self, record):
+        if self.server is not None:
+            raise TransferError('An import may only contain one server')
+        self.resolve_users([record['owner']])
+        self.server = Servers.objects.create(
+            name=record['name'],
+            description=record.get('description'),
+            icon=record.get('icon'),
+            is_public=record.get('is_public', True),
+            owner_id_id=self.users[record['owner']],
+            created_at=_parse_timestamp(record.get('created_at'), timezone.now()),
+        )
+        self.add_member({'user': record['owner'], 'role': 'owner'})
+
+    def add_member(self, record):
+        if record['user'] in self.member_usernames:
+            return
+        self.member_usernames.add(record['user'])
+        self.members.append(record)
+        if len(self.members) >= self.chunk_size:
+            self.flush_members()
+
+    def flush_members(self):
+        if not self.members:
+            return
+        self.resolve_users([record['user'] for record in self.members])
+        # bulk_create returns every object, inserted or ignored, so count the rows
+        members = ServerMember.objects.filter(server=self.server)
+        before = members.count()
+        ServerMember.objects.bulk_create([
+            ServerMember(
+                server=self.server,
+                user_id=self.users[record['user']],
+                nickname=record.get('nickname'),
+                role=record.get('role', 'member'),
+                permission_mask=BASE_ROLE_PERMISSIONS.get(record.get('role', 'member'), 0),
+                joined_at=_parse_timestamp(record.get('joined_at'), timezone.now()),
+            )
+            for record in self.members
+        ], ignore_conflicts=True)
+        self.counts['members'] += members.count() - before
+        self.members = []
+
+    def add_channel(self, record):
+        channel = Channels.objects.create(
+            discord_server_id=self.server,
+            name=record['name'],
+            channel_type=record.get('channel_type', 'text'),
+            created_at=_parse_timestamp(record.get('created_at'), timezone.now()),
+        )
+        self.channels[record['id']] = channel.channel_id
+        self.counts['channels'] += 1
+
+    def add_message(self, record):
+        if record.get('channel') not in self.channels:
+            raise TransferError(f'Message {record.get("id")} is in an unknown channel')
+        self.messages.append(record)
+        if len(self.messages) >= self.chunk_size:
+            self.flush_messages()
+
+    def flush_messages(self):
+        if not self.messages:
+            return
+        self.resolve_users(
+            {record['author'] for record in self.messages} |
+            {reaction['user'] for record in self.messages for reaction in record.get('reactions', [])}
+        )
+        now = timezone.now()
+        messages = UserMessages.objects.bulk_create([
+            UserMessages(
+                message_channel_id_id=self.channels[record['channel']],
+                user_channel_id_id=self.users[record['author']],
+                content=record.get('content', ''),
+                attachment_url=record.get('attachment_url'),
+                attachment_type=record.get('attachment_type'),
+                is_edited=record.get('is_edited', False),
+                edited_at=_parse_timestamp(record.get('edited_at')),
+                is_pinned=record.get('is_pinned', False),
+                mention_everyone=record.get('mention_everyone', False),
+                time_stamp=_parse_timestamp(record.get('time_stamp'), now),
+            )
+            for record in self.messages
+        ])
+
+        reactions = []
+        counts = {}
+        for message, record in zip(messages, self.messages):
+            seen = set()
+            for reaction in record.get('reactions', []):
+                key = (self.users[reaction['user']], reaction['emoji'])
+                if key in seen:
+                    continue
+                seen.add(key)
+                created_at = _parse_timestamp(reaction.get('created_at'), message.time_stamp)
+                reactions.append(MessageReaction(message=message, user_id=key[0], emoji=key[1],
+                                                 created_at=created_at))
+                count = counts.setdefault((message.message_id, key[1]), [0, created_at])
+                count[0] += 1
+                count[1] = min(count[1], created_at)
+        MessageReaction.objects.bulk_create(reactions)
+        MessageReactionCount.objects.bulk_create([
+            MessageReactionCount(message_id=message_id, emoji=emoji, count=count, created_at=created_at)
+            for (message_id, emoji), (count, created_at) in counts.items()
+        ])
+
+        self.counts['messages'] += len(messages)
+        self.counts['reactions'] += len(reactions)
+        self.messages = []
+
+    def finish(self):
+        if self.server is None:
+            raise TransferError('The import contains no server')
+        self.flush_members()
+        self.flush_messages()
+        # Bulk inserts skip the signals maintaining these
+        Servers.objects.filter(pk=self.server.pk).recount()
+        newest = (
+            UserMessages.objects
+            .filter(message_channel_id=OuterRef('pk'))
+            .order_by('-message_id')
+            .values('message_id')[:1]
+        )
+        Channels.objects.filter(discord_server_id=self.server).update(last_message_id=Subquery(newest))
+        return self.server
+
+
+def import_server(lines, chunk_size=CHUNK_SIZE):
+    """
+    Import an export stream (an iterable of JSONL lines) as a new server.
+    Returns ``(server, counts)``. The import runs in one transaction, so a
+    malformed stream leaves nothing behind.
+    """
+    importer = ServerImporter(chunk_size)
+    handlers = {
+        'server': importer.add_server,
+        'member': importer.add_member,
+        'channel': importer.add_channel,
+        'message': importer.add_message,
+    }
+    with transaction.atomic():
+        for number, record in _records(lines):
+            record_type = record['type']
+            if record_type == 'export':
+                if record.get('version') != FORMAT_VERSION:
+                    raise TransferError(f'Unsupported export version: {record.get("version")}')
+                continue
+            if record_type not in handlers:
+                raise TransferError(f'Line {number}: unknown record type {record_type}')
+            if record_type != 'server' and importer.server is None:
+                raise TransferError(f'Line {number}: {record_type} record before the server record')
+            try:
+                handlers[record_type](record)
+            except TransferError:
+                raise
+            except KeyError as error:
+                raise TransferError(f'Line {number}: missing field {error}')
+            except (TypeError, ValueError) as error:
+                raise TransferError(f'Line {number}: invalid record ({error})')
+        try:
+            server = importer.finish()
+        except TransferError:
+            raise
+        except KeyError as error:
+            raise TransferError(f'Missing field {error}')
+        except (TypeError, ValueError) as error:
+            raise TransferError(f'Invalid record ({error})')
+    return server, importer.counts
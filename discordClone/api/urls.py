@@ -27,17 +27,26 @@ from .views import (
     ChannelViewSet,
     DirectMessageChannelsView,
     DirectMessageUserView,
+    ReadStateView,
 
     # Message views
     MessageViewSet,
+    MessageSearchView,
 
     # Friend views
     FriendRequestViewSet,
     FriendListView,
+    MutualFriendsView,
+    FriendSuggestionsView,
     BlockedUserViewSet,
 
+    # Admin views
+    ServerExportView,
+    ServerImportView,
+
     # Notification views
-    NotificationViewSet
+    NotificationViewSet,
+    notification_stream
 )
 
 # Create routers for ViewSets
@@ -49,6 +58,9 @@ router.register(r'blocked-users', BlockedUserViewSet, basename='blocked-user')
 router.register(r'notifications', NotificationViewSet, basename='notification')
 
 urlpatterns = [
+    # Notification stream (must come before the notification router routes)
+    path('notifications/stream/', notification_stream, name='notification-stream'),
+
     # Include router URLs
     path('', include(router.urls)),
 
@@ -79,11 +91,23 @@ urlpatterns = [
     path('servers/<int:server_id>/invites/', ServerInvitesView.as_view(), name='server-invites'),
     path('invites/<int:invite_id>/', ServerInviteDetailView.as_view(), name='server-invite-detail'),
 
+    # Server export/import (staff only)
+    path('admin/servers/<int:pk>/export/', ServerExportView.as_view(), name='server-export'),
+    path('admin/servers/import/', ServerImportView.as_view(), name='server-import'),
+
     # Direct Message endpoints
     path('channels/@me/', DirectMessageChannelsView.as_view(), name='direct-messages'),
     path('channels/@me/<int:user_id>/', DirectMessageUserView.as_view(), name='direct-message-user'),
 
+    # Search
+    path('search/messages/', MessageSearchView.as_view(), name='message-search'),
+
+    # Read state
+    path('read-states/', ReadStateView.as_view(), name='read-states'),
+
     # Friend endpoints
     path('friends/', FriendListView.as_view(), name='friend-list'),
+    path('friends/<int:user_id>/mutual/', MutualFriendsView.as_view(), name='mutual-friends'),
+    path('friends/suggestions/', FriendSuggestionsView.as_view(), name='friend-suggestions'),
     path('users/browse/', UserBrowseView.as_view(), name='user-browse'),
 ]
@@ -0,0 +1,82 @@
+"""
+User discovery for the browse view.
+
+Matching is index-backed on every backend: on PostgreSQL users are matched
+anywhere in their username or display name through pg_trgm GIN indexes;
+elsewhere (and for one or two character queries) by prefix, which a NOCASE
+index serves on SQLite. Friends and blocked users are excluded with
+NOT EXISTS anti-joins, pages are keyed on user_id, and totals are estimated
+and cached instead of counted on every request.
+"""
+from django.conf import settings
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q
+
+from friends.models import BlockedUser, Friends
+from users.models import Users
+
+from .cache import MISSING, LRUCache
+
+# Totals above this are reported as estimates
+BROWSE_COUNT_LIMIT = 1000
+# Trigrams need at least three characters to narrow the search
+TRIGRAM_MIN_LENGTH = 3
+
+_totals = LRUCache(
+    maxsize=getattr(settings, 'USER_BROWSE_TOTALS_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'USER_BROWSE_TOTALS_TTL', 60),
+)
+
+
+def match_users(queryset, search):
+    """Filter ``queryset`` to users whose username or display name matches ``search``"""
+    if connection.vendor == 'postgresql' and len(search) >= TRIGRAM_MIN_LENGTH:
+        return queryset.filter(Q(username__icontains=search) | Q(display_name__icontains=search))
+    return queryset.filter(Q(username__istartswith=search) | Q(display_name__istartswith=search))
+
+
+def browsable_users(user, search=None):
+    """Users ``user`` can discover: everyone but themselves, their friends and users they blocked"""
+    users = (
+        Users.objects
+        .exclude(user_id=user.user_id)
+        # A friendship is one row with the lower id first, so check both sides
+        .filter(~Exists(Friends.objects.filter(users_id=user, user_friend_id=OuterRef('pk'), status=True)))
+        .filter(~Exists(Friends.objects.filter(user_friend_id=user, users_id=OuterRef('pk'), status=True)))
+        .filter(~Exists(BlockedUser.objects.filter(user=user, blocked_user=OuterRef('pk'))))
+    )
+    if search:
+        users = match_users(users, search)
+    return users
+
+
+def _estimated_user_count():
+    """Planner row estimate for the users table (PostgreSQL only)"""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [Users._meta.db_table])
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] > 0 else None
+
+
+def browse_total(user, users, search=None):
+    """
+    Return ``(total, is_estimate)`` for a browse listing, cached per user
+    and search for USER_BROWSE_TOTALS_TTL seconds.
+
+    Unfiltered listings of a large users table on PostgreSQL use the
+    planner's row estimate; otherwise at most BROWSE_COUNT_LIMIT + 1 rows
+    are counted.
+    """
+    key = (user.user_id, search or '')
+    total = _totals.get(key)
+    if total is not MISSING:
+        return total
+
+    estimate = _estimated_user_count() if not search and connection.vendor == 'postgresql' else None
+    if estimate is not None and estimate > BROWSE_COUNT_LIMIT:
+        total = (estimate, True)
+    else:
+        count = users.order_by()[:BROWSE_COUNT_LIMIT + 1].count()
+        total = (min(count, BROWSE_COUNT_LIMIT), count > BROWSE_COUNT_LIMIT)
+    _totals.set(key, total)
+    return total
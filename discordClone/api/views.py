@@ -1,3 +1,7 @@
+import asyncio
+import hashlib
+import heapq
+import json
 import logging
 import uuid
 from datetime import timedelta
@@ -5,12 +9,16 @@ from rest_framework import status, viewsets, serializers
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.decorators import action
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from asgiref.sync import sync_to_async
 from django.utils import timezone
-from django.db.models import Q
-from django.db import utils as db_utils
+from django.db.models import Exists, OuterRef, Q
+from django.utils.http import parse_etags, quote_etag
+from django.db import transaction, utils as db_utils
 
 from .serializers import (
     # User serializers
@@ -29,27 +37,49 @@ from .serializers import (
     # Channel serializers
     ChannelSerializer,
     DirectMessageChannelSerializer,
+    DMInboxSerializer,
 
     # Message serializers
     MessageSerializer,
+    ArchivedMessageSerializer,
     MessageCreateSerializer,
     MessageReactionSerializer,
 
     # Friend serializers
-    FriendSerializer,
     FriendRequestSerializer,
     BlockedUserSerializer,
+    FriendSuggestionSerializer,
 
     # Notification serializers
     NotificationSerializer
 )
 
 from .models import UserProfile
+from .archive import archive_enabled, archived_history
+from .blocks import block_exists, blocked_ids
+from .dm_channels import find_dm_channel_id, get_or_create_dm_channel
+from . import inbox
+from .friendships import add_friendship, are_friends, mutual_friend_ids, remove_friendship
+from .fast_serializers import FriendValuesSerializer, MessageValuesSerializer, ServerMemberValuesSerializer
+from .membership import resolve_channel_server, resolve_membership
+from .mentions import process_mentions
+from .outbox import enqueue_notification
+from .pagination import (
+    MessageCursorPagination, MessageSearchPagination, ServerCursorPagination, UserCursorPagination
+)
+from .reactions import toggle_reaction
+from .read_states import badges, mark_read, message_created
+from .realtime import Subscription, authenticate_token, get_broker, publish_message_event, user_topic
+from .streaming import IncrementalStreamingResponse, StreamingJSONResponse, iterate, require_json
+from .suggestions import suggestions_for
+from .search import SORTS as SEARCH_SORTS, InvalidCursor, SearchUnavailable, search_messages
+from .transfer import TransferError, export_jsonl, import_server, open_stream
+from .user_search import browsable_users, browse_total
 from users.models import Users
 from servers.models import Servers, ServerMember, ServerRole, ServerInvite
 from channels.models import Channels, DirectMessageChannel
-from user_messages.models import UserMessages, MessageReaction
-from friends.models import Friends, FriendRequest, BlockedUser
+from user_messages.models import UserMessages, ArchivedMessage
+from friends.models import FriendRequest, BlockedUser
 from notifications.models import Notifications
 
 logger = logging.getLogger(__name__)
@@ -187,23 +217,41 @@ class UserProfileView(APIView):
         except UserProfile.DoesNotExist:
             return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
 
+def compute_etag(data):
+    """Return a quoted ETag for serialized response data"""
+    encoded = json.dumps(data, sort_keys=True, default=str).encode()
+    return quote_etag(hashlib.md5(encoded).hexdigest())
+
 # Server Views
 class ServerListCreateView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        # Get servers where the user is the owner
-        owned_servers = Servers.objects.filter(owner_id=request.user)
-
-        # Get servers where the user is a member
-        member_server_ids = ServerMember.objects.filter(user=request.user).values_list('server_id', flat=True)
-        member_servers = Servers.objects.filter(server_id__in=member_server_ids).exclude(owner_id=request.user)
-
-        # Combine the two querysets
-        all_servers = list(owned_servers) + list(member_servers)
+        """
+        Get the servers the user owns or is a member of, ordered by server_id.
+        Supports ``after``/``limit`` cursor pagination and If-None-Match.
+        """
+        # One query for owned and joined servers together
+        is_member = ServerMember.objects.filter(server=OuterRef('pk'), user=request.user)
+        servers = Servers.objects.filter(Q(owner_id=request.user) | Exists(is_member)).with_count_annotations()
+
+        # Version the page from its narrow columns first, so reconnecting
+        # clients whose page hasn't changed cost one query and no serialization.
+        # Channel changes bump the server's updated_at.
+        paginator = ServerCursorPagination()
+        versions = paginator.paginate_queryset(
+            servers.values_list('server_id', 'updated_at', 'invite_code', 'owner_id__username',
+                                'num_members', 'num_roles', 'num_invites'),
+            request, view=self
+        )
+        etag = compute_etag(versions)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
 
-        serializer = ServerSerializer(all_servers, many=True)
-        return Response(serializer.data)
+        page = Servers.objects.filter(pk__in=[version[0] for version in versions]).with_counts().order_by('server_id')
+        response = paginator.get_paginated_response(ServerSerializer(page, many=True).data)
+        response['ETag'] = etag
+        return response
 
     def post(self, request):
         serializer = ServerCreateSerializer(data=request.data)
@@ -231,7 +279,7 @@ class PublicServerListView(APIView):
     def get(self, request):
         # Get all public servers
         # Filter for servers that are marked as public
-        servers = Servers.objects.filter(is_public=True)
+        servers = Servers.objects.filter(is_public=True).with_counts()
 
         # Exclude servers the user is already a member of
         user_server_ids = ServerMember.objects.filter(user=request.user).values_list('server_id', flat=True)
@@ -274,7 +322,7 @@ class ServerDetailView(APIView):
 
     def get_object(self, pk):
         try:
-            return Servers.objects.get(pk=pk)
+            return Servers.objects.with_counts().get(pk=pk)
         except Servers.DoesNotExist:
             return None
 
@@ -323,6 +371,12 @@ class ServerDetailView(APIView):
         server.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+def membership_denied(server_id):
+    """Return the error response for a user who isn't a member of server_id"""
+    if not Servers.objects.filter(pk=server_id).exists():
+        return Response({'error': 'Server not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({'error': 'You are not a member of this server'}, status=status.HTTP_403_FORBIDDEN)
+
 # Server Members View
 class ServerMembersView(APIView):
     permission_classes = [IsAuthenticated]
@@ -331,63 +385,51 @@ class ServerMembersView(APIView):
         """
         Get all members of a server
         """
-        try:
-            # Check if server exists
-            server = Servers.objects.get(pk=server_id)
-
-            # Check if user is a member of the server
-            if not ServerMember.objects.filter(server=server, user=request.user).exists():
-                return Response({'error': 'You are not a member of this server'}, status=status.HTTP_403_FORBIDDEN)
-
-            # Get all members
-            members = ServerMember.objects.filter(server=server)
-            serializer = ServerMemberSerializer(members, many=True)
-            return Response(serializer.data)
+        # Check if user is a member of the server
+        membership = resolve_membership(request, server_id)
+        if not (membership and membership.is_member):
+            return membership_denied(server_id)
 
-        except Servers.DoesNotExist:
-            return Response({'error': 'Server not found'}, status=status.HTTP_404_NOT_FOUND)
+        # Stream all members, a chunk at a time
+        require_json(request)
+        serializer = ServerMemberValuesSerializer()
+        members = serializer.values(ServerMember.objects.filter(server_id=server_id).order_by('id'))
+        return StreamingJSONResponse(members, serializer.to_representation)
 
     def post(self, request, server_id):
         """
         Add a user to a server (invite)
         """
-        try:
-            # Check if server exists
-            server = Servers.objects.get(pk=server_id)
-
-            # Check if user is an admin or owner
-            user_member = ServerMember.objects.get(server=server, user=request.user)
-            if not user_member.has_permission('create_invites'):
-                return Response({'error': 'You do not have permission to invite users'}, status=status.HTTP_403_FORBIDDEN)
-
-            # Get the user to invite
-            user_id = request.data.get('user_id')
-            if not user_id:
-                return Response({'error': 'User ID is required'}, status=status.HTTP_400_BAD_REQUEST)
-
-            try:
-                user_to_invite = Users.objects.get(pk=user_id)
-            except Users.DoesNotExist:
-                return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+        # Check if user is an admin or owner
+        membership = resolve_membership(request, server_id)
+        if not (membership and membership.is_member):
+            return membership_denied(server_id)
+        if not membership.has_permission('create_invites'):
+            return Response({'error': 'You do not have permission to invite users'}, status=status.HTTP_403_FORBIDDEN)
+
+        # Get the user to invite
+        user_id = request.data.get('user_id')
+        if not user_id:
+            return Response({'error': 'User ID is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Check if user is already a member
-            if ServerMember.objects.filter(server=server, user=user_to_invite).exists():
-                return Response({'error': 'User is already a member of this server'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            user_to_invite = Users.objects.get(pk=user_id)
+        except Users.DoesNotExist:
+            return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
 
-            # Add user to server
-            member = ServerMember.objects.create(
-                server=server,
-                user=user_to_invite,
-                role='member'
-            )
+        # Check if user is already a member
+        if ServerMember.objects.filter(server_id=server_id, user=user_to_invite).exists():
+            return Response({'error': 'User is already a member of this server'}, status=status.HTTP_400_BAD_REQUEST)
 
-            serializer = ServerMemberSerializer(member)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        # Add user to server
+        member = ServerMember.objects.create(
+            server_id=server_id,
+            user=user_to_invite,
+            role='member'
+        )
 
-        except Servers.DoesNotExist:
-            return Response({'error': 'Server not found'}, status=status.HTTP_404_NOT_FOUND)
-        except ServerMember.DoesNotExist:
-            return Response({'error': 'You are not a member of this server'}, status=status.HTTP_403_FORBIDDEN)
+        serializer = ServerMemberSerializer(member)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 # Server Member Detail View
 class ServerMemberDetailView(APIView):
@@ -503,48 +545,34 @@ class ServerRolesView(APIView):
         """
         Get all roles for a server
         """
-        try:
-            # Check if server exists
-            server = Servers.objects.get(pk=server_id)
-
-            # Check if user is a member of the server
-            if not ServerMember.objects.filter(server=server, user=request.user).exists():
-                return Response({'error': 'You are not a member of this server'}, status=status.HTTP_403_FORBIDDEN)
-
-            # Get all roles
-            roles = ServerRole.objects.filter(server=server)
-            serializer = ServerRoleSerializer(roles, many=True)
-            return Response(serializer.data)
+        # Check if user is a member of the server
+        membership = resolve_membership(request, server_id)
+        if not (membership and membership.is_member):
+            return membership_denied(server_id)
 
-        except Servers.DoesNotExist:
-            return Response({'error': 'Server not found'}, status=status.HTTP_404_NOT_FOUND)
+        # Get all roles
+        roles = ServerRole.objects.filter(server_id=server_id)
+        serializer = ServerRoleSerializer(roles, many=True)
+        return Response(serializer.data)
 
     def post(self, request, server_id):
         """
         Create a new role for a server
         """
-        try:
-            # Check if server exists
-            server = Servers.objects.get(pk=server_id)
-
-            # Check if user has permission to manage roles
-            try:
-                user_member = ServerMember.objects.get(server=server, user=request.user)
-                if not user_member.has_permission('manage_roles'):
-                    return Response({'error': 'You do not have permission to manage roles'}, status=status.HTTP_403_FORBIDDEN)
-            except ServerMember.DoesNotExist:
-                return Response({'error': 'You are not a member of this server'}, status=status.HTTP_403_FORBIDDEN)
-
-            # Create the role
-            serializer = ServerRoleSerializer(data=request.data)
-            if serializer.is_valid():
-                serializer.validated_data['server'] = server
-                role = serializer.save()
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-        except Servers.DoesNotExist:
-            return Response({'error': 'Server not found'}, status=status.HTTP_404_NOT_FOUND)
+        # Check if user has permission to manage roles
+        membership = resolve_membership(request, server_id)
+        if not (membership and membership.is_member):
+            return membership_denied(server_id)
+        if not membership.has_permission('manage_roles'):
+            return Response({'error': 'You do not have permission to manage roles'}, status=status.HTTP_403_FORBIDDEN)
+
+        # Create the role
+        serializer = ServerRoleSerializer(data=request.data)
+        if serializer.is_valid():
+            serializer.validated_data['server'] = Servers.objects.get(pk=server_id)
+            role = serializer.save()
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 # Server Role Detail View
 class ServerRoleDetailView(APIView):
@@ -647,68 +675,52 @@ class ServerInvitesView(APIView):
         """
         Get all invites for a server
         """
-        try:
-            # Check if server exists
-            server = Servers.objects.get(pk=server_id)
-
-            # Check if user has permission to view invites
-            try:
-                user_member = ServerMember.objects.get(server=server, user=request.user)
-                if not user_member.has_permission('create_invites'):
-                    return Response({'error': 'You do not have permission to view invites'}, status=status.HTTP_403_FORBIDDEN)
-            except ServerMember.DoesNotExist:
-                return Response({'error': 'You are not a member of this server'}, status=status.HTTP_403_FORBIDDEN)
-
-            # Get all invites
-            invites = ServerInvite.objects.filter(server=server)
-            serializer = ServerInviteSerializer(invites, many=True)
-            return Response(serializer.data)
-
-        except Servers.DoesNotExist:
-            return Response({'error': 'Server not found'}, status=status.HTTP_404_NOT_FOUND)
+        # Check if user has permission to view invites
+        membership = resolve_membership(request, server_id)
+        if not (membership and membership.is_member):
+            return membership_denied(server_id)
+        if not membership.has_permission('create_invites'):
+            return Response({'error': 'You do not have permission to view invites'}, status=status.HTTP_403_FORBIDDEN)
+
+        # Get all invites
+        invites = ServerInvite.objects.filter(server_id=server_id).select_related('server', 'created_by')
+        serializer = ServerInviteSerializer(invites, many=True)
+        return Response(serializer.data)
 
     def post(self, request, server_id):
         """
         Create a new invite for a server
         """
-        try:
-            # Check if server exists
-            server = Servers.objects.get(pk=server_id)
-
-            # Check if user has permission to create invites
-            try:
-                user_member = ServerMember.objects.get(server=server, user=request.user)
-                if not user_member.has_permission('create_invites'):
-                    return Response({'error': 'You do not have permission to create invites'}, status=status.HTTP_403_FORBIDDEN)
-            except ServerMember.DoesNotExist:
-                return Response({'error': 'You are not a member of this server'}, status=status.HTTP_403_FORBIDDEN)
-
-            # Create the invite
-            max_uses = request.data.get('max_uses', 0)
-            expires_in = request.data.get('expires_in', 0)  # in hours, 0 = never expires
-
-            # Generate a unique invite code
-            code = str(uuid.uuid4())[:8]
-
-            # Calculate expiration date
-            expires_at = None
-            if expires_in > 0:
-                expires_at = timezone.now() + timedelta(hours=expires_in)
-
-            # Create the invite
-            invite = ServerInvite.objects.create(
-                server=server,
-                code=code,
-                created_by=request.user,
-                max_uses=max_uses,
-                expires_at=expires_at
-            )
-
-            serializer = ServerInviteSerializer(invite)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        # Check if user has permission to create invites
+        membership = resolve_membership(request, server_id)
+        if not (membership and membership.is_member):
+            return membership_denied(server_id)
+        if not membership.has_permission('create_invites'):
+            return Response({'error': 'You do not have permission to create invites'}, status=status.HTTP_403_FORBIDDEN)
+
+        # Create the invite
+        max_uses = request.data.get('max_uses', 0)
+        expires_in = request.data.get('expires_in', 0)  # in hours, 0 = never expires
+
+        # Generate a unique invite code
+        code = str(uuid.uuid4())[:8]
+
+        # Calculate expiration date
+        expires_at = None
+        if expires_in > 0:
+            expires_at = timezone.now() + timedelta(hours=expires_in)
+
+        # Create the invite
+        invite = ServerInvite.objects.create(
+            server=Servers.objects.get(pk=server_id),
+            code=code,
+            created_by=request.user,
+            max_uses=max_uses,
+            expires_at=expires_at
+        )
 
-        except Servers.DoesNotExist:
-            return Response({'error': 'Server not found'}, status=status.HTTP_404_NOT_FOUND)
+        serializer = ServerInviteSerializer(invite)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 # Server Invite Detail View
 class ServerInviteDetailView(APIView):
@@ -815,16 +827,12 @@ class ChannelViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         server_id = self.kwargs.get('server_id')
         if server_id:
-            server = get_object_or_404(Servers, server_id=server_id)
-
-            # Check if user is a member of the server
-            is_member = ServerMember.objects.filter(server=server, user=self.request.user).exists()
-            is_owner = server.owner_id == self.request.user
-
-            if not (is_member or is_owner):
+            # Check if user is a member or the owner of the server
+            if not resolve_membership(self.request, server_id):
+                get_object_or_404(Servers, server_id=server_id)
                 return Channels.objects.none()
 
-            return Channels.objects.filter(discord_server_id=server)
+            return Channels.objects.filter(discord_server_id=server_id)
         return Channels.objects.none()
 
     def perform_create(self, serializer):
@@ -846,13 +854,8 @@ class DirectMessageChannelsView(APIView):
         Get all direct message channels for the current user.
         This is a special endpoint to handle the @me route in the frontend.
         """
-        # Get all DM channels where the current user is either user1 or user2
-        dm_channels = DirectMessageChannel.objects.filter(
-            Q(user1=request.user) | Q(user2=request.user)
-        ).order_by('-last_message_at')
-
-        # Serialize the channels
-        serializer = DirectMessageChannelSerializer(dm_channels, many=True)
+        # One row per conversation in the user's inbox, newest first
+        serializer = DMInboxSerializer(inbox.inbox(request.user), many=True, context={'request': request})
         return Response(serializer.data)
 
     def post(self, request):
@@ -868,34 +871,19 @@ class DirectMessageChannelsView(APIView):
         except Users.DoesNotExist:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        # Check if users are friends
-        are_friends = Friends.objects.filter(
-            (Q(users_id=request.user) & Q(user_friend_id=other_user)) |
-            (Q(users_id=other_user) & Q(user_friend_id=request.user))
-        ).exists()
+        if block_exists(request.user.user_id, other_user.user_id):
+            return Response({"error": "You cannot message this user"}, status=status.HTTP_403_FORBIDDEN)
 
-        if not are_friends:
+        # Check if users are friends
+        if not are_friends(request.user.user_id, other_user.user_id):
             return Response({"error": "You can only message users who are your friends"},
                            status=status.HTTP_403_FORBIDDEN)
 
-        # Check if a DM channel already exists between these users
-        existing_channel = DirectMessageChannel.objects.filter(
-            (Q(user1=request.user) & Q(user2=other_user)) |
-            (Q(user1=other_user) & Q(user2=request.user))
-        ).first()
-
-        if existing_channel:
-            serializer = DirectMessageChannelSerializer(existing_channel)
-            return Response(serializer.data)
-
-        # Create a new DM channel
-        dm_channel = DirectMessageChannel.objects.create(
-            user1=request.user,
-            user2=other_user
-        )
+        # Return the DM channel between these users, creating it if needed
+        dm_channel, created = get_or_create_dm_channel(request.user, other_user)
 
         serializer = DirectMessageChannelSerializer(dm_channel)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
 # Direct Message with Specific User View
 class DirectMessageUserView(APIView):
@@ -905,25 +893,29 @@ class DirectMessageUserView(APIView):
         """
         Get direct messages between the current user and the specified user.
         """
-        try:
-            other_user = Users.objects.get(user_id=user_id)
-        except Users.DoesNotExist:
-            return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
-
         # Find the DM channel between these users
-        dm_channel = DirectMessageChannel.objects.filter(
-            (Q(user1=request.user) & Q(user2=other_user)) |
-            (Q(user1=other_user) & Q(user2=request.user))
-        ).first()
+        dm_channel_id = find_dm_channel_id(request.user.user_id, user_id)
 
-        if not dm_channel:
+        if dm_channel_id is None:
+            if not Users.objects.filter(user_id=user_id).exists():
+                return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
             return Response({"error": "No direct message channel exists with this user"},
                            status=status.HTTP_404_NOT_FOUND)
 
-        # Get messages in this channel
-        messages = UserMessages.objects.filter(dm_channel=dm_channel).order_by('time_stamp')
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        # Stream the messages in this channel, merged with its archived history
+        require_json(request)
+        context = {'request': request}
+        messages = UserMessages.objects.filter(dm_channel_id=dm_channel_id).order_by('time_stamp', 'message_id')
+        if not archive_enabled():
+            serializer = MessageValuesSerializer(context)
+            return StreamingJSONResponse(serializer.values(messages), serializer.to_representation)
+
+        archived = archived_history(dm_channel_id=dm_channel_id).order_by('time_stamp', 'message_id')
+        messages = heapq.merge(
+            iterate(archived), iterate(messages.only('message_id', 'time_stamp')),
+            key=lambda message: (message.time_stamp, message.message_id),
+        )
+        return StreamingJSONResponse(messages, lambda chunk: serialize_messages(chunk, context))
 
     def post(self, request, user_id):
         """
@@ -934,79 +926,257 @@ class DirectMessageUserView(APIView):
         except Users.DoesNotExist:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
 
+        if block_exists(request.user.user_id, other_user.user_id):
+            return Response({"error": "You cannot message this user"}, status=status.HTTP_403_FORBIDDEN)
+
         # Find or create the DM channel between these users
-        dm_channel, created = DirectMessageChannel.objects.get_or_create(
-            user1=request.user if request.user.user_id < other_user.user_id else other_user,
-            user2=other_user if request.user.user_id < other_user.user_id else request.user,
-            defaults={'last_message_at': timezone.now()}
-        )
+        dm_channel, created = get_or_create_dm_channel(request.user, other_user, last_message_at=timezone.now())
 
         # Create the message
         content = request.data.get('content')
         if not content:
             return Response({"error": "Message content is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        message = UserMessages.objects.create(
-            dm_channel=dm_channel,
-            user_channel_id=request.user,
-            content=content,
-            attachment_url=request.data.get('attachment_url'),
-            attachment_type=request.data.get('attachment_type')
-        )
+        with transaction.atomic():
+            message = UserMessages.objects.create(
+                dm_channel=dm_channel,
+                user_channel_id=request.user,
+                content=content,
+                attachment_url=request.data.get('attachment_url'),
+                attachment_type=request.data.get('attachment_type')
+            )
 
-        # Update the last_message_at timestamp
-        dm_channel.last_message_at = timezone.now()
-        dm_channel.save()
+            # Update the last_message_at timestamp
+            dm_channel.last_message_at = timezone.now()
+            dm_channel.save()
+            message_created(message)
+            inbox.message_sent(message, dm_channel.last_message_at)
 
-        # Create notification for the other user
-        Notifications.objects.create(
-            user_id=other_user,
+        # Queue a notification for the other user; a burst from the same
+        # sender is collapsed into one notification by the outbox worker
+        enqueue_notification(
+            user_id=other_user.user_id,
             notification_type='message',
-            message=message,
+            message_id=message.message_id,
             title='New Direct Message',
-            content=f'{request.user.username} sent you a message'
+            content=f'{request.user.username} sent you a message',
+            group=f'dm:{other_user.user_id}:{request.user.user_id}',
+            group_title='New Direct Messages',
+            group_content=f'{request.user.username} sent you {{count}} new messages'
         )
 
         serializer = MessageSerializer(message)
+        publish_message_event('message_create', message, serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+# Search Views
+class MessageSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+    pagination_class = MessageSearchPagination
+
+    def get(self, request):
+        """
+        Full-text search of messages in a server, channel or DM channel.
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"error": "Search query is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        sort = request.query_params.get('sort', 'relevance')
+        if sort not in SEARCH_SORTS:
+            return Response({"error": f"sort must be one of {', '.join(SEARCH_SORTS)}"},
+                           status=status.HTTP_400_BAD_REQUEST)
+
+        scopes = {name: request.query_params[name] for name in ('server_id', 'channel_id', 'dm_channel_id')
+                  if name in request.query_params}
+        if len(scopes) != 1:
+            return Response({"error": "Exactly one of server_id, channel_id or dm_channel_id is required"},
+                           status=status.HTTP_400_BAD_REQUEST)
+        name, value = scopes.popitem()
+        try:
+            scope = {name: int(value)}
+        except ValueError:
+            return Response({"error": f"Invalid {name}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if name == 'dm_channel_id':
+            visible = DirectMessageChannel.objects.filter(
+                Q(user1=request.user) | Q(user2=request.user), dm_channel_id=scope[name]
+            ).exists()
+        else:
+            server_id = scope[name] if name == 'server_id' else resolve_channel_server(scope[name])
+            visible = server_id is not None and resolve_membership(request, server_id) is not None
+        if not visible:
+            return Response({"error": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            hits, next_cursor = search_messages(
+                query,
+                limit=self.pagination_class().get_limit(request),
+                sort=sort,
+                cursor=request.query_params.get('cursor'),
+                **scope
+            )
+        except InvalidCursor:
+            return Response({"error": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+        except SearchUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+        serialized = {
+            message['message_id']: message
+            for message in MessageValuesSerializer({'request': request}).serialize_ids(
+                [hit['message_id'] for hit in hits]
+            )
+        }
+        blocked = set(blocked_ids(request.user.user_id))
+        results = [
+            {**serialized[hit['message_id']], 'rank': hit['rank'], 'snippet': hit['snippet']}
+            for hit in hits
+            if hit['message_id'] in serialized and serialized[hit['message_id']]['author']['user_id'] not in blocked
+        ]
+        return Response({'results': results, 'next_cursor': next_cursor})
+
+# Read State Views
+class ReadStateView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Get read markers and unread/mention badges for all of the user's
+        channels and DM channels.
+        """
+        return Response(badges(request.user))
+
+    def post(self, request):
+        """
+        Mark a channel or DM channel as read up to a message (by default its
+        newest message).
+        """
+        channel_id = request.data.get('channel_id')
+        dm_channel_id = request.data.get('dm_channel_id')
+        message_id = request.data.get('message_id')
+
+        try:
+            channel_id = int(channel_id) if channel_id is not None else None
+            dm_channel_id = int(dm_channel_id) if dm_channel_id is not None else None
+            message_id = int(message_id) if message_id is not None else None
+        except (TypeError, ValueError):
+            return Response({"error": "Invalid id"}, status=status.HTTP_400_BAD_REQUEST)
+        if message_id is not None and message_id < 0:
+            return Response({"error": "message_id must not be negative"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if channel_id is not None:
+            server_id = resolve_channel_server(channel_id)
+            if server_id is None or not resolve_membership(request, server_id):
+                return Response({"error": "Channel not found"}, status=status.HTTP_404_NOT_FOUND)
+            channel = Channels.objects.only('last_message_id').get(channel_id=channel_id)
+        elif dm_channel_id is not None:
+            channel = DirectMessageChannel.objects.filter(
+                Q(user1=request.user) | Q(user2=request.user),
+                dm_channel_id=dm_channel_id
+            ).only('last_message_id').first()
+            if channel is None:
+                return Response({"error": "Direct message channel not found"}, status=status.HTTP_404_NOT_FOUND)
+        else:
+            return Response({"error": "channel_id or dm_channel_id is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Markers never move backwards, so one past the newest message could never be cleared
+        newest = channel.last_message_id or 0
+        message_id = newest if message_id is None else min(message_id, newest)
+
+        state = mark_read(request.user, message_id, channel_id=channel_id, dm_channel_id=dm_channel_id)
+        return Response({
+            'last_read_message_id': state.last_read_message_id,
+            'unread_count': state.unread_count,
+            'mention_count': state.mention_count,
+        })
+
 # Message Views
+def serialize_messages(messages, context):
+    """
+    Serialize a page of messages, keeping its order. Hot messages only need
+    their message_id loaded; they are serialized by the values fast path.
+    Archived ones may be mixed in.
+    """
+    hot_ids = [message.message_id for message in messages if not isinstance(message, ArchivedMessage)]
+    hot = MessageValuesSerializer(context).serialize_ids(hot_ids)
+    if len(hot_ids) == len(messages):
+        return hot
+    archived = [message for message in messages if isinstance(message, ArchivedMessage)]
+    data = {
+        item['message_id']: item
+        for item in [*hot, *ArchivedMessageSerializer(archived, many=True, context=context).data]
+    }
+    return [data[message.message_id] for message in messages]
+
+
 class MessageViewSet(viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = MessageCursorPagination
+
+    def get_channel_server_id(self):
+        server_id = resolve_channel_server(self.kwargs.get('channel_id'))
+        if server_id is None:
+            raise Http404('Channel not found')
+        return server_id
 
     def get_queryset(self):
         channel_id = self.kwargs.get('channel_id')
         if channel_id:
-            channel = get_object_or_404(Channels, channel_id=channel_id)
+            server_id = self.get_channel_server_id()
 
             # Check if user has access to this channel
-            server = channel.discord_server_id
-            is_member = ServerMember.objects.filter(server=server, user=self.request.user).exists()
-            is_owner = server.owner_id == self.request.user
-
-            if not (is_member or is_owner):
+            if not resolve_membership(self.request, server_id):
                 return UserMessages.objects.none()
 
-            return UserMessages.objects.filter(message_channel_id=channel).order_by('time_stamp')
+            return UserMessages.objects.filter(message_channel_id=channel_id).with_related().order_by('time_stamp')
         return UserMessages.objects.none()
 
+    def get_archive_queryset(self):
+        """The channel's archived history, which MessageCursorPagination merges into each page"""
+        if not archive_enabled():
+            return None
+        channel_id = self.kwargs.get('channel_id')
+        if not channel_id or not resolve_membership(self.request, self.get_channel_server_id()):
+            return ArchivedMessage.objects.none()
+        return self.hide_blocked_authors(archived_history(channel_id=channel_id))
+
+    def hide_blocked_authors(self, queryset):
+        """Leave out messages by users the requester blocked, using their cached block list"""
+        blocked = blocked_ids(self.request.user.user_id)
+        return queryset.exclude(user_channel_id__in=list(blocked)) if blocked else queryset
+
+    def list(self, request, *args, **kwargs):
+        # Page over the keyset columns only; serialize_messages loads the rest
+        queryset = self.hide_blocked_authors(self.get_queryset())
+        queryset = queryset.select_related(None).prefetch_related(None).only('message_id', 'time_stamp')
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(serialize_messages(page, self.get_serializer_context()))
+
     def perform_create(self, serializer):
         channel_id = self.kwargs.get('channel_id')
-        channel = get_object_or_404(Channels, channel_id=channel_id)
+        server_id = self.get_channel_server_id()
 
         # Check if user has access to this channel
-        server = channel.discord_server_id
-        is_member = ServerMember.objects.filter(server=server, user=self.request.user).exists()
-        is_owner = server.owner_id == self.request.user
-
-        if not (is_member or is_owner):
+        if not resolve_membership(self.request, server_id):
             raise PermissionError("You don't have access to this channel")
 
-        serializer.save(
-            message_channel_id=channel,
+        message = serializer.save(
+            message_channel_id_id=int(channel_id),
             user_channel_id=self.request.user
         )
+        mentioned_user_ids = process_mentions(message, server_id)
+        message_created(message, mentioned_user_ids)
+        publish_message_event('message_create', message, serializer.data)
+
+    def perform_update(self, serializer):
+        message = serializer.save()
+        publish_message_event('message_update', message, serializer.data)
+
+    def perform_destroy(self, instance):
+        event_data = {'message_id': instance.message_id}
+        publish_message_event('message_delete', instance, event_data)
+        instance.delete()
 
     @action(detail=True, methods=['post'])
     def react(self, request, pk=None, channel_id=None):
@@ -1016,16 +1186,16 @@ class MessageViewSet(viewsets.ModelViewSet):
         if not emoji:
             return Response({'error': 'Emoji is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Check if reaction already exists
-        reaction, created = MessageReaction.objects.get_or_create(
-            message=message,
-            user=request.user,
-            emoji=emoji
-        )
+        # Add the reaction, or remove it if it already exists (toggle behavior)
+        reaction, created = toggle_reaction(message, request.user, emoji)
+
+        publish_message_event('reaction_add' if created else 'reaction_remove', message, {
+            'message_id': message.message_id,
+            'user_id': request.user.user_id,
+            'emoji': emoji
+        })
 
         if not created:
-            # If reaction already exists, remove it (toggle behavior)
-            reaction.delete()
             return Response({'message': 'Reaction removed'})
 
         serializer = MessageReactionSerializer(reaction)
@@ -1050,10 +1220,7 @@ class FriendRequestViewSet(viewsets.ModelViewSet):
             raise serializers.ValidationError("You cannot send a friend request to yourself")
 
         # Check if they are already friends
-        if Friends.objects.filter(
-            (Q(users_id=self.request.user) & Q(user_friend_id=receiver)) |
-            (Q(users_id=receiver) & Q(user_friend_id=self.request.user))
-        ).exists():
+        if are_friends(self.request.user.user_id, receiver.user_id):
             raise serializers.ValidationError("You are already friends with this user")
 
         # Check if there's already a pending request
@@ -1065,19 +1232,16 @@ class FriendRequestViewSet(viewsets.ModelViewSet):
             raise serializers.ValidationError("A friend request already exists between you and this user")
 
         # Check if user is blocked
-        if BlockedUser.objects.filter(
-            (Q(user=self.request.user) & Q(blocked_user=receiver)) |
-            (Q(user=receiver) & Q(blocked_user=self.request.user))
-        ).exists():
+        if block_exists(self.request.user.user_id, receiver.user_id):
             raise serializers.ValidationError("You cannot send a friend request to a blocked user")
 
         serializer.save(sender=self.request.user, receiver=receiver, status='pending')
 
-        # Create notification for the receiver
-        Notifications.objects.create(
-            user_id=receiver,
+        # Queue notification for the receiver
+        enqueue_notification(
+            user_id=receiver.user_id,
             notification_type='friend_request',
-            friend_request=serializer.instance,
+            friend_request_id=serializer.instance.pk,
             title='New Friend Request',
             content=f'{self.request.user.username} sent you a friend request'
         )
@@ -1099,14 +1263,13 @@ class FriendRequestViewSet(viewsets.ModelViewSet):
         friend_request.save()
 
         # Create friend relationship
-        Friends.objects.create(users_id=friend_request.receiver, user_friend_id=friend_request.sender)
-        Friends.objects.create(users_id=friend_request.sender, user_friend_id=friend_request.receiver)
+        add_friendship(friend_request.receiver, friend_request.sender)
 
-        # Create notification for the sender
-        Notifications.objects.create(
-            user_id=friend_request.sender,
+        # Queue notification for the sender
+        enqueue_notification(
+            user_id=friend_request.sender.user_id,
             notification_type='friend_request',
-            friend_request=friend_request,
+            friend_request_id=friend_request.pk,
             title='Friend Request Accepted',
             content=f'{request.user.username} accepted your friend request'
         )
@@ -1135,67 +1298,73 @@ class FriendListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        friends = Friends.objects.filter(users_id=request.user, status=True)
-        serializer = FriendSerializer(friends, many=True)
-        return Response(serializer.data)
+        return Response(FriendValuesSerializer().serialize_friends_of(request.user.user_id))
 
 
-# User Browse View
-class UserBrowseView(APIView):
+class MutualFriendsView(APIView):
     permission_classes = [IsAuthenticated]
 
-    def get(self, request):
+    def get(self, request, user_id):
         """
-        Get a list of all users for browsing and adding friends.
-        Excludes the current user and users who are already friends.
+        Get the ids of the friends the current user has in common with
+        another user, or none if either of them blocked the other.
         """
-        # Get current user's friends
-        friends = Friends.objects.filter(users_id=request.user, status=True).values_list('user_friend_id', flat=True)
-
-        # Get all users except current user and friends
-        users = Users.objects.exclude(user_id=request.user.user_id).exclude(user_id__in=friends)
-
-        # Get blocked users
-        blocked_users = BlockedUser.objects.filter(user=request.user).values_list('blocked_user', flat=True)
-        users = users.exclude(user_id__in=blocked_users)
-
-        # Check if there's a search query
-        search_query = request.query_params.get('search', None)
-        if search_query:
-            users = users.filter(
-                Q(username__icontains=search_query) |
-                Q(display_name__icontains=search_query)
-            )
+        if not Users.objects.filter(user_id=user_id, is_active=True).exists():
+            return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+        if block_exists(request.user.user_id, user_id):
+            mutual_ids = []
+        else:
+            mutual_ids = mutual_friend_ids(request.user.user_id, user_id)
+        return Response({'user_id': user_id, 'count': len(mutual_ids), 'mutual_friend_ids': mutual_ids})
+
+
+class FriendSuggestionsView(APIView):
+    permission_classes = [IsAuthenticated]
 
-        # Pagination
-        page = request.query_params.get('page', 1)
+    def get(self, request):
+        """
+        Get "people you may know" for the current user, ranked by mutual
+        friends and shared servers. Suggestions are precomputed by the
+        refresh_friend_suggestions job.
+        """
         try:
-            page = int(page)
+            limit = min(int(request.query_params.get('limit', 20)), 50)
         except ValueError:
-            page = 1
+            return Response({"error": "Invalid limit"}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = FriendSuggestionSerializer(suggestions_for(request.user, max(limit, 1)), many=True)
+        return Response(serializer.data)
+
 
-        page_size = 20
-        start = (page - 1) * page_size
-        end = start + page_size
+# User Browse View
+class UserBrowseView(APIView):
+    permission_classes = [IsAuthenticated]
+    pagination_class = UserCursorPagination
 
-        # Get total count for pagination
-        total_count = users.count()
-        total_pages = (total_count + page_size - 1) // page_size
+    def get(self, request):
+        """
+        Get a list of all users for browsing and adding friends.
+        Excludes the current user, their friends and users they blocked.
+        Pages are keyed on user_id: pass the response's next_cursor as ``after``.
+        """
+        search_query = request.query_params.get('search', '').strip() or None
+        users = browsable_users(request.user, search_query)
 
-        # Slice the queryset for pagination
-        users = users[start:end]
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(users, request, view=self)
+        page_size = paginator.get_limit(request)
 
-        # Serialize the users
-        serializer = UserSerializer(users, many=True)
+        # Totals are estimated/cached; counting every match on each page is what made deep pages slow
+        total_count, is_estimate = browse_total(request.user, users, search_query)
 
-        # Return the paginated response
+        serializer = UserSerializer(page, many=True)
         return Response({
             'users': serializer.data,
             'pagination': {
                 'total_count': total_count,
-                'total_pages': total_pages,
-                'current_page': page,
-                'page_size': page_size
+                'total_is_estimate': is_estimate,
+                'total_pages': (total_count + page_size - 1) // page_size,
+                'page_size': page_size,
+                'next_cursor': page[-1].user_id if len(page) == page_size else None
             }
         })
 
@@ -1214,11 +1383,8 @@ class BlockedUserViewSet(viewsets.ModelViewSet):
         if blocked_user == self.request.user:
             raise serializers.ValidationError("You cannot block yourself")
 
-        # Remove any friend relationships
-        Friends.objects.filter(
-            (Q(users_id=self.request.user) & Q(user_friend_id=blocked_user)) |
-            (Q(users_id=blocked_user) & Q(user_friend_id=self.request.user))
-        ).delete()
+        # Remove any friend relationship
+        remove_friendship(self.request.user.user_id, blocked_user.user_id)
 
         # Cancel any pending friend requests
         FriendRequest.objects.filter(
@@ -1229,6 +1395,41 @@ class BlockedUserViewSet(viewsets.ModelViewSet):
 
         serializer.save(user=self.request.user, blocked_user=blocked_user)
 
+# Server Export/Import Views (staff only)
+class ServerExportView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, pk):
+        """
+        Stream a server's members, channels, messages and reactions as JSONL,
+        gzip-compressed with ?compress=gzip.
+        """
+        server = get_object_or_404(Servers.objects.select_related('owner_id'), pk=pk)
+        compress = request.query_params.get('compress') == 'gzip'
+        filename = f'server-{server.server_id}.jsonl' + ('.gz' if compress else '')
+        response = IncrementalStreamingResponse(
+            export_jsonl(server, compress=compress),
+            content_type='application/gzip' if compress else 'application/x-ndjson',
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+class ServerImportView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        """
+        Import a server from an uploaded JSONL export (plain or gzip-compressed).
+        """
+        export = request.FILES.get('file')
+        if export is None:
+            return Response({"error": "Upload the export as 'file'"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            server, counts = import_server(open_stream(export))
+        except TransferError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"server_id": server.server_id, **counts}, status=status.HTTP_201_CREATED)
+
 # Notification Views
 class NotificationViewSet(viewsets.ModelViewSet):
     serializer_class = NotificationSerializer
@@ -1237,6 +1438,11 @@ class NotificationViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Notifications.objects.filter(user_id=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        require_json(request)
+        notifications = self.filter_queryset(self.get_queryset()).order_by('-time_stamp', '-notify_id')
+        return StreamingJSONResponse(notifications, lambda chunk: self.get_serializer(chunk, many=True).data)
+
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         notification = self.get_object()
@@ -1248,3 +1454,89 @@ class NotificationViewSet(viewsets.ModelViewSet):
     def mark_all_read(self, request):
         Notifications.objects.filter(user_id=request.user, is_read=False).update(is_read=True)
         return Response({'message': 'All notifications marked as read'})
+
+# Notification Stream (Server-Sent Events)
+NOTIFICATION_STREAM_HEARTBEAT = 25  # seconds between keep-alive comments
+NOTIFICATION_STREAM_BACKLOG = 100  # most notifications replayed on resume
+
+def format_sse(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+@sync_to_async
+def get_missed_notifications(user, last_id):
+    notifications = Notifications.objects.filter(
+        user_id=user, notify_id__gt=last_id
+    ).order_by('notify_id')[:NOTIFICATION_STREAM_BACKLOG]
+    return NotificationSerializer(notifications, many=True).data
+
+async def notification_events(user, last_id):
+    broker = get_broker()
+    subscription = Subscription()
+    # Subscribe before reading the backlog so nothing created in between is lost
+    broker.subscribe(user_topic(user.user_id), subscription)
+    try:
+        yield 'retry: 5000\n\n'
+
+        if last_id is not None:
+            for data in await get_missed_notifications(user, last_id):
+                last_id = data['notify_id']
+                yield format_sse('notification', data, last_id)
+
+        while True:
+            try:
+                payload = await asyncio.wait_for(subscription.get(), timeout=NOTIFICATION_STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+
+            if subscription.overflowed:
+                return
+
+            data = json.loads(payload)['data']
+            if last_id is not None and data['notify_id'] <= last_id:
+                # Already sent as part of the backlog
+                continue
+            last_id = data['notify_id']
+            yield format_sse('notification', data, last_id)
+    finally:
+        broker.unsubscribe_all(subscription)
+
+async def notification_stream(request):
+    """
+    Stream the current user's new notifications as Server-Sent Events.
+
+    Authenticate with an ``Authorization: Token <key>`` header or a ``token``
+    query parameter (browsers' EventSource can't set headers). Reconnecting
+    clients send ``Last-Event-ID`` and first receive what they missed.
+
+    Only served under ASGI: a WSGI handler drains async iterators into a list
+    before sending anything, so an endless stream would never send a byte and
+    would hold its worker thread forever.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {'error': 'The notification stream requires an ASGI server, e.g. uvicorn discordClone.asgi:application'},
+            status=501
+        )
+
+    auth_header = request.headers.get('Authorization', '')
+    token_key = auth_header[6:].strip() if auth_header.startswith('Token ') else request.GET.get('token')
+    user = await authenticate_token(token_key) if token_key else None
+    if user is None:
+        return JsonResponse({'error': 'Authentication credentials were not provided'}, status=401)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid Last-Event-ID'}, status=400)
+
+    response = StreamingHttpResponse(notification_events(user, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.7 on 2026-10-17 06:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_last_message_ids(apps, schema_editor):
+    Channels = apps.get_model('channels', 'Channels')
+    DirectMessageChannel = apps.get_model('channels', 'DirectMessageChannel')
+    UserMessages = apps.get_model('user_messages', 'UserMessages')
+
+    latest = UserMessages.objects.order_by('-message_id').values('message_id')
+    Channels.objects.update(
+        last_message_id=models.Subquery(latest.filter(message_channel_id=models.OuterRef('pk'))[:1])
+    )
+    DirectMessageChannel.objects.update(
+        last_message_id=models.Subquery(latest.filter(dm_channel=models.OuterRef('pk'))[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channels', '0003_directmessagechannel'),
+        ('user_messages', '0006_usermessages_mention_everyone'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channels',
+            name='last_message_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='directmessagechannel',
+            name='last_message_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.IntegerField(default=0)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('mention_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('channel', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='channels.channels')),
+                ('dm_channel', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='channels.directmessagechannel')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('channel__isnull', False)), fields=('user', 'channel'), name='readstate_user_channel_uniq'), models.UniqueConstraint(condition=models.Q(('dm_channel__isnull', False)), fields=('user', 'dm_channel'), name='readstate_user_dm_channel_uniq'), models.CheckConstraint(condition=models.Q(models.Q(('channel__isnull', False), ('dm_channel__isnull', True)), models.Q(('channel__isnull', True), ('dm_channel__isnull', False)), _connector='OR'), name='readstate_one_target')],
+            },
+        ),
+        migrations.RunPython(backfill_last_message_ids, migrations.RunPython.noop),
+    ]
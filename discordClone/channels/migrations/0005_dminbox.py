@@ -0,0 +1,78 @@
+# Generated by Django 5.1.7 on 2026-10-17 06:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+PREVIEW_LENGTH = 200
+
+
+def backfill_inbox(apps, schema_editor):
+    DirectMessageChannel = apps.get_model('channels', 'DirectMessageChannel')
+    DMInbox = apps.get_model('channels', 'DMInbox')
+    ReadState = apps.get_model('channels', 'ReadState')
+    UserMessages = apps.get_model('user_messages', 'UserMessages')
+
+    unread = {
+        (state.user_id, state.dm_channel_id): state.unread_count
+        for state in ReadState.objects.filter(dm_channel__isnull=False)
+    }
+    entries = []
+    for dm_channel in DirectMessageChannel.objects.select_related('user1', 'user2').iterator():
+        last_message = None
+        if dm_channel.last_message_id:
+            last_message = UserMessages.objects.filter(message_id=dm_channel.last_message_id).first()
+        for user, peer in ((dm_channel.user1, dm_channel.user2), (dm_channel.user2, dm_channel.user1)):
+            entries.append(DMInbox(
+                user=user,
+                dm_channel=dm_channel,
+                peer=peer,
+                peer_username=peer.username,
+                peer_email=peer.email,
+                peer_display_name=peer.display_name,
+                peer_avatar=peer.avatar,
+                peer_created_at=peer.created_at,
+                last_message_id=last_message.message_id if last_message else None,
+                last_message_author_id=last_message.user_channel_id_id if last_message else None,
+                last_message_preview=(last_message.content or '')[:PREVIEW_LENGTH] if last_message else '',
+                last_message_at=dm_channel.last_message_at,
+                unread_count=unread.get((user.pk, dm_channel.pk), 0),
+            ))
+    DMInbox.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channels', '0004_read_states'),
+        ('user_messages', '0006_usermessages_mention_everyone'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DMInbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('peer_username', models.CharField(max_length=100)),
+                ('peer_email', models.EmailField(max_length=100)),
+                ('peer_display_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('peer_avatar', models.URLField(blank=True, null=True)),
+                ('peer_created_at', models.DateTimeField()),
+                ('last_message_id', models.IntegerField(blank=True, null=True)),
+                ('last_message_author_id', models.IntegerField(blank=True, null=True)),
+                ('last_message_preview', models.CharField(blank=True, default='', max_length=200)),
+                ('last_message_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('dm_channel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='channels.directmessagechannel')),
+                ('peer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dm_inbox', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-last_message_at', '-dm_channel'], name='dminbox_user_recent_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'dm_channel'), name='dminbox_user_dm_channel_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.1.7 on 2026-10-17 06:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def merge_channels(apps, keep, duplicate):
+    """Move the messages, read states and inbox state of ``duplicate`` into ``keep``"""
+    DMInbox = apps.get_model('channels', 'DMInbox')
+    ReadState = apps.get_model('channels', 'ReadState')
+    UserMessages = apps.get_model('user_messages', 'UserMessages')
+    ArchivedMessage = apps.get_model('user_messages', 'ArchivedMessage')
+
+    UserMessages.objects.filter(dm_channel=duplicate).update(dm_channel=keep)
+    ArchivedMessage.objects.filter(dm_channel=duplicate).update(dm_channel=keep)
+
+    for state in ReadState.objects.filter(dm_channel=duplicate):
+        existing = ReadState.objects.filter(user_id=state.user_id, dm_channel=keep).first()
+        if existing is None:
+            state.dm_channel = keep
+            state.save()
+            continue
+        # Keep the earlier marker so nothing unread is skipped
+        existing.last_read_message_id = min(existing.last_read_message_id, state.last_read_message_id)
+        existing.unread_count += state.unread_count
+        existing.mention_count += state.mention_count
+        existing.save()
+
+    for entry in DMInbox.objects.filter(dm_channel=duplicate):
+        existing = DMInbox.objects.filter(user_id=entry.user_id, dm_channel=keep).first()
+        if existing is None:
+            entry.dm_channel = keep
+            entry.save()
+            continue
+        if entry.last_message_at > existing.last_message_at:
+            existing.last_message_id = entry.last_message_id
+            existing.last_message_author_id = entry.last_message_author_id
+            existing.last_message_preview = entry.last_message_preview
+            existing.last_message_at = entry.last_message_at
+        existing.unread_count += entry.unread_count
+        existing.save()
+
+    keep.created_at = min(keep.created_at, duplicate.created_at)
+    keep.last_message_at = max(keep.last_message_at, duplicate.last_message_at)
+    keep.last_message_id = max(filter(None, [keep.last_message_id, duplicate.last_message_id]), default=None)
+    keep.save()
+    duplicate.delete()
+
+
+def order_pairs(apps, schema_editor):
+    """
+    Store every DM channel as (lower user id, higher user id), merging a
+    channel into its counterpart when both orders exist.
+    """
+    DirectMessageChannel = apps.get_model('channels', 'DirectMessageChannel')
+
+    for dm_channel in DirectMessageChannel.objects.filter(user1__gt=models.F('user2')).order_by('pk'):
+        counterpart = DirectMessageChannel.objects.filter(user1=dm_channel.user2_id, user2=dm_channel.user1_id).first()
+        if counterpart is not None:
+            merge_channels(apps, counterpart, dm_channel)
+        else:
+            DirectMessageChannel.objects.filter(pk=dm_channel.pk).update(
+                user1=dm_channel.user2_id, user2=dm_channel.user1_id
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channels', '0005_dminbox'),
+        ('user_messages', '0008_archivedmessage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(order_pairs, migrations.RunPython.noop),
+    ]
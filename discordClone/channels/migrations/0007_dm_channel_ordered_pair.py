@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-17 06:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channels', '0006_order_dm_channel_pairs'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='directmessagechannel',
+            constraint=models.CheckConstraint(condition=models.Q(('user1__lte', models.F('user2'))), name='dm_channel_ordered_pair'),
+        ),
+    ]
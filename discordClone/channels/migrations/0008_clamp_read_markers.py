@@ -0,0 +1,33 @@
+from django.db import migrations
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def clamp_read_markers(apps, schema_editor):
+    """Pull read markers set past their channel's newest message back to it"""
+    ReadState = apps.get_model('channels', 'ReadState')
+    Channels = apps.get_model('channels', 'Channels')
+    DirectMessageChannel = apps.get_model('channels', 'DirectMessageChannel')
+
+    for field, model in (('channel', Channels), ('dm_channel', DirectMessageChannel)):
+        newest = model.objects.filter(pk=OuterRef(field)).values('last_message_id')
+        ahead = (
+            ReadState.objects
+            .filter(**{f'{field}__isnull': False})
+            .annotate(newest=Coalesce(Subquery(newest), Value(0)))
+            .filter(last_read_message_id__gt=F('newest'))
+            .values_list('pk', 'newest')
+        )
+        for pk, last_message_id in list(ahead):
+            ReadState.objects.filter(pk=pk).update(last_read_message_id=last_message_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channels', '0007_dm_channel_ordered_pair'),
+    ]
+
+    operations = [
+        migrations.RunPython(clamp_read_markers, migrations.RunPython.noop),
+    ]
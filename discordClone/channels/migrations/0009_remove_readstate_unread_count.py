@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-17 07:49
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channels', '0008_clamp_read_markers'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='readstate',
+            name='unread_count',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-17 08:01
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channels', '0009_remove_readstate_unread_count'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='dminbox',
+            name='unread_count',
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from servers.models import Servers
 from users.models import Users
@@ -10,6 +12,8 @@ class Channels(models.Model):
     name = models.CharField(max_length=100)
     channel_type = models.CharField(max_length=60, default='text')
     created_at = models.DateTimeField(default=timezone.now)
+    # message_id of the newest message, compared against read markers
+    last_message_id = models.IntegerField(blank=True, null=True)
 
     def __str__(self):
         return f"#{self.name} ({self.discord_server_id.name})"
@@ -24,6 +28,7 @@ class DirectMessageChannel(models.Model):
     user2 = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='dm_channels_as_user2')
     created_at = models.DateTimeField(default=timezone.now)
     last_message_at = models.DateTimeField(default=timezone.now)
+    last_message_id = models.IntegerField(blank=True, null=True)
 
     def __str__(self):
         return f"DM: {self.user1.username} and {self.user2.username}"
@@ -32,9 +37,85 @@ class DirectMessageChannel(models.Model):
         verbose_name = 'Direct Message Channel'
         verbose_name_plural = 'Direct Message Channels'
         unique_together = [['user1', 'user2']]
+        constraints = [
+            # One channel per pair of users, stored as (lower id, higher id)
+            models.CheckConstraint(condition=models.Q(user1__lte=models.F('user2')), name='dm_channel_ordered_pair'),
+        ]
+
+    @staticmethod
+    def ordered_pair(user_id, other_user_id):
+        """The (user1_id, user2_id) of the channel between two users"""
+        return (user_id, other_user_id) if user_id <= other_user_id else (other_user_id, user_id)
 
     def get_other_user(self, user):
         """Get the other user in the conversation"""
         if user.user_id == self.user1.user_id:
             return self.user2
         return self.user1
+
+class DMInbox(models.Model):
+    """
+    One row per participant of a DM channel: the peer's profile and the
+    newest message, copied here so a user's conversation list is read with
+    one index range scan. Kept up to date by api.inbox.
+    """
+    user = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='dm_inbox')
+    dm_channel = models.ForeignKey(DirectMessageChannel, on_delete=models.CASCADE, related_name='inbox_entries')
+    peer = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='+')
+    # Cached from the peer's Users row
+    peer_username = models.CharField(max_length=100)
+    peer_email = models.EmailField(max_length=100)
+    peer_display_name = models.CharField(max_length=100, blank=True, null=True)
+    peer_avatar = models.URLField(blank=True, null=True)
+    peer_created_at = models.DateTimeField()
+    # Preview of the newest message
+    last_message_id = models.IntegerField(blank=True, null=True)
+    last_message_author_id = models.IntegerField(blank=True, null=True)
+    last_message_preview = models.CharField(max_length=200, blank=True, default='')
+    last_message_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.user_id}'s DM with {self.peer_username}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'dm_channel'], name='dminbox_user_dm_channel_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_message_at', '-dm_channel'], name='dminbox_user_recent_idx'),
+        ]
+
+class ReadState(models.Model):
+    """A user's read marker and mention badge for a text channel or DM channel"""
+    user = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='read_states')
+    channel = models.ForeignKey(Channels, on_delete=models.CASCADE, related_name='read_states', null=True, blank=True)
+    dm_channel = models.ForeignKey(DirectMessageChannel, on_delete=models.CASCADE, related_name='read_states', null=True, blank=True)
+    last_read_message_id = models.IntegerField(default=0)
+    # Maintained incrementally as mentions arrive and reset when the user reads
+    mention_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        target = f"#{self.channel_id}" if self.channel_id else f"DM {self.dm_channel_id}"
+        return f"{self.user_id} read {target} up to {self.last_read_message_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'channel'], condition=models.Q(channel__isnull=False),
+                                    name='readstate_user_channel_uniq'),
+            models.UniqueConstraint(fields=['user', 'dm_channel'], condition=models.Q(dm_channel__isnull=False),
+                                    name='readstate_user_dm_channel_uniq'),
+            models.CheckConstraint(
+                condition=models.Q(channel__isnull=False, dm_channel__isnull=True) |
+                          models.Q(channel__isnull=True, dm_channel__isnull=False),
+                name='readstate_one_target'
+            ),
+        ]
+
+# Signals to bump the server's updated_at, which versions the server list, when its channels change
+@receiver(post_save, sender=Channels)
+@receiver(post_delete, sender=Channels)
+def channel_changed(sender, instance=None, origin=None, **kwargs):
+    if isinstance(origin, Servers) or getattr(origin, 'model', None) is Servers:
+        return
+    Servers.objects.filter(pk=instance.discord_server_id_id).update(updated_at=timezone.now())
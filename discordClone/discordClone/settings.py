@@ -1,3 +1,4 @@
+import importlib.util
 import os
 from pathlib import Path
 # import environ
@@ -80,6 +81,10 @@ DATABASES = {
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
         'CONN_MAX_AGE': 60,  # 1 minute
+        # Supabase's transaction-mode pooler (port 6543) may hand each
+        # statement a different server connection, so a server-side cursor
+        # opened by QuerySet.iterator() can be gone by the next fetch
+        'DISABLE_SERVER_SIDE_CURSORS': True,
         'OPTIONS': {
             'connect_timeout': 5,
             'sslmode': 'require',
@@ -126,14 +131,105 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # orjson-backed JSON (falls back to the stock renderer without orjson)
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# Clients can opt into MessagePack with `Accept: application/msgpack` (and send
+# it with `Content-Type: application/msgpack`) when the msgpack package is
+# installed.
+if importlib.util.find_spec('msgpack') is not None:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('api.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].append('api.renderers.MessagePackParser')
+
+# Token authentication cache. Resolved tokens are kept for TOKEN_CACHE_TTL
+# seconds, in-process by default. In-process entries are only invalidated in
+# the process that logs out or deactivates the user, so when running several
+# workers set TOKEN_CACHE_BACKEND to a shared CACHES alias (e.g. Redis), which
+# then replaces the in-process cache.
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 60
+TOKEN_CACHE_BACKEND = None
+
+# Read reaction counts from the denormalized MessageReactionCount table.
+# Set to False to aggregate MessageReaction rows on every read instead.
+REACTION_COUNTERS_ENABLED = True
+
+# Read server member/role/invite counts from the denormalized counter columns
+# on Servers instead of counting rows. Useful for very large servers. The
+# columns are only maintained while this is on, so run
+# `manage.py recount_server_counters` after turning it on.
+SERVER_COUNTER_COLUMNS = False
+
+# In-process cache of (user, server) memberships used by server-scoped views.
+# Entries are invalidated by signals and expire after the TTL (in seconds) so
+# changes made by other worker processes are picked up. Other processes keep
+# serving a kicked member or an old role until then, so keep the TTL short.
+MEMBERSHIP_CACHE_SIZE = 10000
+MEMBERSHIP_CACHE_TTL = 30
+
+# In-process cache of (user1, user2) -> direct message channel id. Entries are
+# dropped when a channel is deleted and expire after the TTL (in seconds).
+DM_CHANNEL_CACHE_SIZE = 10000
+DM_CHANNEL_CACHE_TTL = 300
+
+# In-process cache of each user's friend ids. Entries are dropped when a
+# friendship is created or removed and expire after the TTL (in seconds).
+FRIEND_CACHE_SIZE = 10000
+FRIEND_CACHE_TTL = 60
+
+# Friend suggestions kept per user by refresh_friend_suggestions. Servers
+# larger than FRIEND_SUGGESTION_MAX_SERVER_SIZE don't count as shared servers.
+FRIEND_SUGGESTIONS_PER_USER = 20
+FRIEND_SUGGESTION_MAX_SERVER_SIZE = 1000
+
+# In-process cache of the ids each user blocked. Entries are dropped when a
+# block is created or removed and expire after the TTL.
+BLOCK_CACHE_SIZE = 10000
+BLOCK_CACHE_TTL = 60
+
+# How long (in seconds) the user browse view caches its per-user totals
+USER_BROWSE_TOTALS_CACHE_SIZE = 10000
+USER_BROWSE_TOTALS_TTL = 60
+
+# Real-time gateway broker. Leave unset to fan events out in-process, or point
+# it at Redis (or a Redis-compatible server) when running several workers.
+REALTIME_BROKER_URL = os.getenv('REALTIME_BROKER_URL')
+
+# Notification outbox. Notifications are queued by requests and written in
+# batches by a worker, which coalesces events from the same burst (e.g. DMs
+# from one sender within NOTIFICATION_COALESCE_WINDOW seconds). Without a
+# queue URL an in-process queue and worker thread are used; with a Redis URL,
+# run `manage.py run_notification_worker` and set
+# NOTIFICATION_WORKER_IN_PROCESS to False.
+NOTIFICATION_QUEUE_URL = os.getenv('NOTIFICATION_QUEUE_URL')
+NOTIFICATION_WORKER_IN_PROCESS = True
+NOTIFICATION_BATCH_SIZE = 500
+NOTIFICATION_COALESCE_WINDOW = 1.0
+
+# Rows serialized per chunk by the streaming list endpoints (server members,
+# direct messages, notifications). Bounds worker memory for large lists.
+STREAMING_CHUNK_SIZE = 500
+
+# Hot/cold message storage. With the archive enabled, message history reads
+# also cover ArchivedMessage, and `manage.py archive_messages` moves whole
+# months older than --keep-months there (monthly partitions on PostgreSQL).
+MESSAGE_ARCHIVE_ENABLED = False
+
 # Specify the custom user model for authentication
 AUTH_USER_MODEL = 'users.Users'
 
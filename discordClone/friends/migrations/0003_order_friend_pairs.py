@@ -0,0 +1,40 @@
+# Generated by Django 5.1.7 on 2026-10-17 07:05
+
+from django.db import migrations, models
+
+
+def order_pairs(apps, schema_editor):
+    """
+    Keep one row per friendship, with the lower user id in users_id. The
+    mirrored row written for the other user is dropped, or swapped around
+    if it is the only one.
+    """
+    Friends = apps.get_model('friends', 'Friends')
+
+    for friendship in Friends.objects.filter(users_id__gt=models.F('user_friend_id')).order_by('pk'):
+        counterpart = Friends.objects.filter(
+            users_id=friendship.user_friend_id_id, user_friend_id=friendship.users_id_id
+        ).first()
+        if counterpart is None:
+            Friends.objects.filter(pk=friendship.pk).update(
+                users_id=friendship.user_friend_id_id, user_friend_id=friendship.users_id_id
+            )
+            continue
+        counterpart.created_at = min(counterpart.created_at, friendship.created_at)
+        counterpart.status = counterpart.status or friendship.status
+        counterpart.save()
+        friendship.delete()
+
+    # Nobody can be their own friend
+    Friends.objects.filter(users_id=models.F('user_friend_id')).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('friends', '0002_alter_friends_options_friends_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(order_pairs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-17 07:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('friends', '0003_order_friend_pairs'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='friends',
+            constraint=models.CheckConstraint(condition=models.Q(('users_id__lt', models.F('user_friend_id'))), name='friends_ordered_pair'),
+        ),
+    ]
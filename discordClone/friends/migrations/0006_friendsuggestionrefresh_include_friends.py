@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('friends', '0005_friend_suggestions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='friendsuggestionrefresh',
+            name='include_friends',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -27,6 +27,7 @@ class FriendRequest(models.Model):
         return f"{self.sender.username} -> {self.receiver.username} ({self.status})"
 
 class Friends(models.Model):
+    """One row per friendship, with the lower user id in users_id"""
     friends_id = models.AutoField(primary_key=True)
     users_id = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='friend_requests')
     user_friend_id = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='friends')
@@ -37,10 +38,18 @@ class Friends(models.Model):
         unique_together = ('users_id', 'user_friend_id')
         verbose_name = 'Friend'
         verbose_name_plural = 'Friends'
+        constraints = [
+            models.CheckConstraint(condition=models.Q(users_id__lt=models.F('user_friend_id')), name='friends_ordered_pair'),
+        ]
 
     def __str__(self):
         return f"{self.users_id.username} and {self.user_friend_id.username}"
 
+    @staticmethod
+    def ordered_pair(user_id, other_user_id):
+        """The (users_id, user_friend_id) of the friendship between two users"""
+        return (user_id, other_user_id) if user_id < other_user_id else (other_user_id, user_id)
+
 class BlockedUser(models.Model):
     block_id = models.AutoField(primary_key=True)
     user = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='blocked_users')
@@ -53,4 +62,40 @@ class BlockedUser(models.Model):
         verbose_name_plural = 'Blocked Users'
 
     def __str__(self):
-        return f"{self.user.username} blocked {self.blocked_user.username}"
\ No newline at end of file
+        return f"{self.user.username} blocked {self.blocked_user.username}"
+
+class FriendSuggestion(models.Model):
+    """
+    A precomputed "people you may know" entry, written by the
+    refresh_friend_suggestions job; only the top suggestions per user are kept.
+    """
+    user = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='friend_suggestions')
+    suggested_user = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='+')
+    score = models.PositiveIntegerField()
+    mutual_friend_count = models.PositiveIntegerField(default=0)
+    shared_server_count = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'suggested_user'], name='friend_suggestion_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-score', 'suggested_user'], name='friend_suggestion_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} may know {self.suggested_user_id} ({self.score})"
+
+
+class FriendSuggestionRefresh(models.Model):
+    """A user whose suggestions are out of date, queued for the next refresh"""
+    # Not a foreign key: users are queued from signals sent while they are
+    # being deleted, and the job skips ids that no longer exist
+    user_id = models.IntegerField(primary_key=True)
+    queued_at = models.DateTimeField(default=timezone.now)
+    # Their friends are affected too (a friendship changed); the job queues them
+    include_friends = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"Refresh suggestions for {self.user_id}"
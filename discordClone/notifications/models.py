@@ -40,3 +40,8 @@ class Notifications(models.Model):
         verbose_name = 'Notification'
         verbose_name_plural = 'Notifications'
         ordering = ['-time_stamp']
+        indexes = [
+            models.Index(fields=['user_id', '-time_stamp'], name='notify_user_recent_idx'),
+            # Used to resume the notification stream after a given notify_id
+            models.Index(fields=['user_id', 'notify_id'], name='notify_user_resume_idx'),
+        ]
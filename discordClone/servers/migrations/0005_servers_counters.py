@@ -0,0 +1,53 @@
+# Generated manually
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Servers = apps.get_model('servers', 'Servers')
+
+    def count_of(model_name):
+        model = apps.get_model('servers', model_name)
+        counts = (
+            model.objects
+            .filter(server=OuterRef('pk'))
+            .order_by()
+            .values('server')
+            .annotate(total=Count('*'))
+            .values('total')
+        )
+        return Coalesce(Subquery(counts), Value(0))
+
+    Servers.objects.update(
+        member_count=count_of('ServerMember'),
+        roles_count=count_of('ServerRole'),
+        invites_count=count_of('ServerInvite'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('servers', '0004_alter_servers_is_public'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servers',
+            name='invites_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='servers',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='servers',
+            name='roles_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated manually
+
+from django.db import migrations, models
+
+PERMISSIONS = [
+    'manage_channels',
+    'manage_server',
+    'manage_roles',
+    'manage_messages',
+    'kick_members',
+    'ban_members',
+    'create_invites',
+]
+PERMISSION_BITS = {name: 1 << index for index, name in enumerate(PERMISSIONS)}
+ALL_PERMISSIONS = sum(PERMISSION_BITS.values())
+BASE_ROLE_PERMISSIONS = {
+    'owner': ALL_PERMISSIONS,
+    'admin': ALL_PERMISSIONS & ~PERMISSION_BITS['manage_server'],
+    'moderator': PERMISSION_BITS['manage_messages'] | PERMISSION_BITS['kick_members'] | PERMISSION_BITS['create_invites'],
+    'member': PERMISSION_BITS['create_invites'],
+}
+
+
+def compile_permission_masks(apps, schema_editor):
+    ServerRole = apps.get_model('servers', 'ServerRole')
+    ServerMember = apps.get_model('servers', 'ServerMember')
+
+    roles = list(ServerRole.objects.all())
+    for role in roles:
+        role.permissions = sum(bit for name, bit in PERMISSION_BITS.items() if getattr(role, name))
+    ServerRole.objects.bulk_update(roles, ['permissions'], batch_size=1000)
+    role_masks = {role.pk: role.permissions for role in roles}
+
+    members = {}
+    for member in ServerMember.objects.only('pk', 'role').iterator(chunk_size=2000):
+        member.permission_mask = BASE_ROLE_PERMISSIONS.get(member.role, 0)
+        members[member.pk] = member
+    for member_id, role_id in ServerMember.roles.through.objects.values_list('servermember_id', 'serverrole_id'):
+        members[member_id].permission_mask |= role_masks.get(role_id, 0)
+    ServerMember.objects.bulk_update(members.values(), ['permission_mask'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('servers', '0005_servers_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serverrole',
+            name='permissions',
+            field=models.IntegerField(default=64),
+        ),
+        migrations.AddField(
+            model_name='servermember',
+            name='permission_mask',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(compile_permission_masks, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,95 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
 from django.utils import timezone
 from users.models import Users
 
+
+def _count_subquery(model):
+    """Correlated COUNT(*) of ``model`` rows belonging to the outer server"""
+    counts = (
+        model.objects
+        .filter(server=OuterRef('pk'))
+        .order_by()
+        .values('server')
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts), Value(0))
+
+def use_counter_columns():
+    return getattr(settings, 'SERVER_COUNTER_COLUMNS', False)
+
+class ServersQuerySet(models.QuerySet):
+    def _counts(self, *names):
+        if use_counter_columns():
+            return {f'num_{name}': F(COUNTER_COLUMNS[name]) for name in names}
+        return {f'num_{name}': _count_subquery(COUNTED_MODELS[name]) for name in names}
+
+    def with_count_annotations(self):
+        """Annotate num_members, num_roles and num_invites"""
+        return self.annotate(**self._counts('members', 'roles', 'invites'))
+
+    def with_counts(self):
+        """
+        Annotate num_members, num_roles and num_invites and load the owner and
+        channels, so a list of servers serializes in a fixed number of queries.
+        """
+        return self.with_count_annotations().select_related('owner_id').prefetch_related('channels_set')
+
+    def with_member_count(self):
+        """Annotate num_members only"""
+        return self.annotate(**self._counts('members'))
+
+    def recount(self):
+        """Rewrite the counter columns of these servers from the rows they count"""
+        return self.update(**{
+            column: _count_subquery(COUNTED_MODELS[name]) for name, column in COUNTER_COLUMNS.items()
+        })
+
+# Permission bits, in the order they are packed into a permission mask
+PERMISSIONS = [
+    'manage_channels',
+    'manage_server',
+    'manage_roles',
+    'manage_messages',
+    'kick_members',
+    'ban_members',
+    'create_invites',
+]
+PERMISSION_BITS = {name: 1 << index for index, name in enumerate(PERMISSIONS)}
+ALL_PERMISSIONS = sum(PERMISSION_BITS.values())
+
+# Permissions granted by ServerMember.role before any custom roles
+BASE_ROLE_PERMISSIONS = {
+    'owner': ALL_PERMISSIONS,
+    'admin': ALL_PERMISSIONS & ~PERMISSION_BITS['manage_server'],
+    'moderator': PERMISSION_BITS['manage_messages'] | PERMISSION_BITS['kick_members'] | PERMISSION_BITS['create_invites'],
+    # All members can create invites by default
+    'member': PERMISSION_BITS['create_invites'],
+}
+
+def has_permission(role, permission_mask, permission):
+    """
+    Whether a member with this base role and permission mask holds
+    ``permission``. Owners hold every permission and admins every one but
+    manage_server, including names outside PERMISSION_BITS.
+    """
+    if role == 'owner' or (role == 'admin' and permission != 'manage_server'):
+        return True
+    return bool(permission_mask & PERMISSION_BITS.get(permission, 0))
+
+def compile_permissions(obj):
+    """Pack the boolean permission attributes of ``obj`` into a bitmask"""
+    mask = 0
+    for name, bit in PERMISSION_BITS.items():
+        if getattr(obj, name, False):
+            mask |= bit
+    return mask
+
 # Create your models here.
 class Servers(models.Model):
     server_id = models.AutoField(primary_key=True)
@@ -15,6 +103,13 @@ class Servers(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Denormalized counters, kept up to date by the signals below
+    member_count = models.PositiveIntegerField(default=0)
+    roles_count = models.PositiveIntegerField(default=0)
+    invites_count = models.PositiveIntegerField(default=0)
+
+    objects = ServersQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
@@ -48,10 +143,19 @@ class ServerRole(models.Model):
     ban_members = models.BooleanField(default=False)
     create_invites = models.BooleanField(default=True)
 
+    # Bitmask of the permissions above, compiled on save
+    permissions = models.IntegerField(default=PERMISSION_BITS['create_invites'])
+
     class Meta:
         unique_together = ('server', 'name')
         ordering = ['-position']
 
+    def save(self, *args, **kwargs):
+        self.permissions = compile_permissions(self)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'permissions'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.name} in {self.server.name}"
 
@@ -82,6 +186,17 @@ class ServerInvite(models.Model):
     def __str__(self):
         return f"Invite {self.code} for {self.server.name}"
 
+class ServerMemberQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """Bulk updates of the base role recompute the affected permission masks"""
+        if 'role' not in kwargs:
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            member_ids = list(self.values_list('pk', flat=True))
+            updated = super().update(**kwargs)
+            recompute_member_permissions(member_ids)
+        return updated
+
 class ServerMember(models.Model):
     server = models.ForeignKey(Servers, on_delete=models.CASCADE, related_name='server_members')
     user = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='server_memberships')
@@ -99,35 +214,120 @@ class ServerMember(models.Model):
     )
     joined_at = models.DateTimeField(default=timezone.now)
 
+    # Effective permissions: the base role OR-ed with every custom role.
+    # Recomputed whenever the role, role assignments or a role's permissions change.
+    permission_mask = models.IntegerField(default=0)
+
+    objects = ServerMemberQuerySet.as_manager()
+
     class Meta:
         unique_together = ('server', 'user')
 
+    def save(self, *args, **kwargs):
+        roles_mask = 0
+        if self.pk is not None:
+            for permissions in self.roles.values_list('permissions', flat=True):
+                roles_mask |= permissions
+        self.permission_mask = BASE_ROLE_PERMISSIONS.get(self.role, 0) | roles_mask
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'permission_mask'}
+        super().save(*args, **kwargs)
+
     def has_permission(self, permission):
         """Check if the member has a specific permission"""
-        # Owner has all permissions
-        if self.role == 'owner':
-            return True
+        return has_permission(self.role, self.permission_mask, permission)
 
-        # Admin has all permissions except server ownership
-        if self.role == 'admin' and permission != 'manage_server':
-            return True
+    def __str__(self):
+        return f"{self.user.username} in {self.server.name}"
 
-        # Check custom role permissions
-        for role in self.roles.all():
-            if getattr(role, permission, False):
-                return True
+# Counter column on Servers for each counted relation
+COUNTER_COLUMNS = {
+    'members': 'member_count',
+    'roles': 'roles_count',
+    'invites': 'invites_count',
+}
+COUNTED_MODELS = {
+    'members': ServerMember,
+    'roles': ServerRole,
+    'invites': ServerInvite,
+}
 
-        # Moderator has specific permissions
-        if self.role == 'moderator':
-            mod_permissions = ['manage_messages', 'kick_members', 'create_invites']
-            if permission in mod_permissions:
-                return True
+# Signals to keep the denormalized server counters in step. They only run with
+# SERVER_COUNTER_COLUMNS on; after turning it on, run recount_server_counters.
+COUNTER_FIELDS = {
+    ServerMember: 'member_count',
+    ServerRole: 'roles_count',
+    ServerInvite: 'invites_count',
+}
 
-        # All members can create invites by default
-        if permission == 'create_invites':
-            return True
+def _adjust_server_counter(instance, delta):
+    field = COUNTER_FIELDS[type(instance)]
+    # Clamped, so rows written without the signals (bulk_create) can't push it below zero
+    Servers.objects.filter(pk=instance.server_id).update(**{field: Greatest(F(field) + delta, 0)})
 
-        return False
+@receiver(post_save, sender=ServerMember)
+@receiver(post_save, sender=ServerRole)
+@receiver(post_save, sender=ServerInvite)
+def increment_server_counter(sender, instance=None, created=False, **kwargs):
+    if created and use_counter_columns():
+        _adjust_server_counter(instance, 1)
 
-    def __str__(self):
-        return f"{self.user.username} in {self.server.name}"
+@receiver(post_delete, sender=ServerMember)
+@receiver(post_delete, sender=ServerRole)
+@receiver(post_delete, sender=ServerInvite)
+def decrement_server_counter(sender, instance=None, origin=None, **kwargs):
+    # Nothing to count when the server itself is being deleted
+    if isinstance(origin, Servers) or getattr(origin, 'model', None) is Servers:
+        return
+    if use_counter_columns():
+        _adjust_server_counter(instance, -1)
+
+# Signals to keep ServerMember.permission_mask in step with role changes
+def recompute_member_permissions(member_ids):
+    """Recompute the permission mask of the given members in two queries"""
+    member_ids = list(member_ids)
+    if not member_ids:
+        return
+
+    masks = {
+        member_id: BASE_ROLE_PERMISSIONS.get(role, 0)
+        for member_id, role in ServerMember.objects.filter(pk__in=member_ids).values_list('pk', 'role')
+    }
+    assignments = ServerMember.roles.through.objects.filter(servermember_id__in=member_ids)
+    for member_id, permissions in assignments.values_list('servermember_id', 'serverrole__permissions'):
+        masks[member_id] |= permissions
+
+    members = [ServerMember(pk=member_id, permission_mask=mask) for member_id, mask in masks.items()]
+    ServerMember.objects.bulk_update(members, ['permission_mask'], batch_size=1000)
+
+@receiver(m2m_changed, sender=ServerMember.roles.through)
+def member_roles_changed(sender, instance=None, action=None, reverse=False, pk_set=None, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+
+    if not reverse:
+        # member.roles.add/remove/clear
+        if action != 'pre_clear':
+            recompute_member_permissions([instance.pk])
+    elif action == 'pre_clear':
+        # role.members.clear(): remember who loses the role
+        instance._cleared_member_ids = list(instance.members.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        recompute_member_permissions(getattr(instance, '_cleared_member_ids', []))
+    else:
+        # role.members.add/remove
+        recompute_member_permissions(pk_set or [])
+
+@receiver(post_save, sender=ServerRole)
+def role_permissions_changed(sender, instance=None, created=False, **kwargs):
+    if not created:
+        recompute_member_permissions(instance.members.values_list('pk', flat=True))
+
+@receiver(pre_delete, sender=ServerRole)
+def remember_role_members(sender, instance=None, **kwargs):
+    # The assignments are cascade-deleted without an m2m_changed signal
+    instance._member_ids = list(instance.members.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=ServerRole)
+def role_deleted(sender, instance=None, **kwargs):
+    recompute_member_permissions(getattr(instance, '_member_ids', []))
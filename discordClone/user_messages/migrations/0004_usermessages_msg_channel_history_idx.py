@@ -0,0 +1,17 @@
+# Generated manually
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_messages', '0003_usermessages_dm_channel_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usermessages',
+            index=models.Index(fields=['message_channel_id', 'time_stamp', 'message_id'], name='msg_channel_history_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated manually
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_reaction_counts(apps, schema_editor):
+    MessageReaction = apps.get_model('user_messages', 'MessageReaction')
+    MessageReactionCount = apps.get_model('user_messages', 'MessageReactionCount')
+
+    rows = (
+        MessageReaction.objects
+        .values('message_id', 'emoji')
+        .annotate(total=models.Count('reaction_id'), first_at=models.Min('created_at'))
+        .order_by()
+    )
+    batch = []
+    for row in rows.iterator(chunk_size=2000):
+        batch.append(MessageReactionCount(
+            message_id=row['message_id'],
+            emoji=row['emoji'],
+            count=row['total'],
+            created_at=row['first_at'],
+        ))
+        if len(batch) >= 2000:
+            MessageReactionCount.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        MessageReactionCount.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_messages', '0004_usermessages_msg_channel_history_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageReactionCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('emoji', models.CharField(max_length=50)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reaction_counts', to='user_messages.usermessages')),
+            ],
+            options={
+                'unique_together': {('message', 'emoji')},
+            },
+        ),
+        migrations.RunPython(backfill_reaction_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 06:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_messages', '0005_messagereactioncount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usermessages',
+            name='mention_everyone',
+            field=models.BooleanField(default=False),
+        ),
+    ]
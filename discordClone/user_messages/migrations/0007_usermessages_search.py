@@ -0,0 +1,86 @@
+# Generated manually
+#
+# Full-text search index for message content. The index lives outside the
+# Django model: on PostgreSQL it is a generated tsvector column with a GIN
+# index, on SQLite (local development and tests) an FTS5 table kept in sync
+# by triggers. Other backends get no index and search is unavailable.
+#
+# Note: on SQLite, a later migration that rebuilds user_messages_usermessages
+# drops the triggers; re-create them the same way if that happens.
+
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE user_messages_usermessages
+    ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english'::regconfig, coalesce(content, ''))) STORED
+    """,
+    # Built concurrently so existing deployments keep accepting messages
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS msg_search_vector_idx
+    ON user_messages_usermessages USING GIN (search_vector)
+    """,
+]
+POSTGRES_REVERSE = [
+    "DROP INDEX CONCURRENTLY IF EXISTS msg_search_vector_idx",
+    "ALTER TABLE user_messages_usermessages DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS user_messages_search USING fts5(
+        content,
+        content='user_messages_usermessages',
+        content_rowid='message_id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS user_messages_search_ai AFTER INSERT ON user_messages_usermessages BEGIN
+        INSERT INTO user_messages_search(rowid, content) VALUES (new.message_id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS user_messages_search_ad AFTER DELETE ON user_messages_usermessages BEGIN
+        INSERT INTO user_messages_search(user_messages_search, rowid, content) VALUES ('delete', old.message_id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS user_messages_search_au AFTER UPDATE OF content ON user_messages_usermessages BEGIN
+        INSERT INTO user_messages_search(user_messages_search, rowid, content) VALUES ('delete', old.message_id, old.content);
+        INSERT INTO user_messages_search(rowid, content) VALUES (new.message_id, new.content);
+    END
+    """,
+    "INSERT INTO user_messages_search(user_messages_search) VALUES ('rebuild')",
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS user_messages_search_au",
+    "DROP TRIGGER IF EXISTS user_messages_search_ad",
+    "DROP TRIGGER IF EXISTS user_messages_search_ai",
+    "DROP TABLE IF EXISTS user_messages_search",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        statements = statements_by_vendor.get(schema_editor.connection.vendor, [])
+        with schema_editor.connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('user_messages', '0006_usermessages_mention_everyone'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            _run({'postgresql': POSTGRES_REVERSE, 'sqlite': SQLITE_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.1.7 on 2026-10-17 06:15
+#
+# Cold-tier archive for old messages. On PostgreSQL the table is created by
+# hand as a range-partitioned table on time_stamp (the monthly partitions are
+# created by the archive_messages command as they are needed); the primary key
+# has to include the partition key there. Other backends get the plain table
+# Django would create.
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+POSTGRES_FORWARD = [
+    """
+    CREATE TABLE IF NOT EXISTS user_messages_archivedmessage (
+        message_id integer NOT NULL,
+        message_channel_id_id integer NULL,
+        dm_channel_id integer NULL,
+        user_channel_id_id integer NOT NULL,
+        time_stamp timestamp with time zone NOT NULL,
+        payload bytea NOT NULL,
+        PRIMARY KEY (message_id, time_stamp)
+    ) PARTITION BY RANGE (time_stamp)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS msg_archive_channel_idx
+    ON user_messages_archivedmessage (message_channel_id_id, time_stamp, message_id)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS msg_archive_dm_idx
+    ON user_messages_archivedmessage (dm_channel_id, time_stamp, message_id)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS msg_archive_author_idx
+    ON user_messages_archivedmessage (user_channel_id_id)
+    """,
+]
+POSTGRES_REVERSE = [
+    # Drops every partition with it
+    "DROP TABLE IF EXISTS user_messages_archivedmessage",
+]
+
+
+def create_archive_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        with schema_editor.connection.cursor() as cursor:
+            for sql in POSTGRES_FORWARD:
+                cursor.execute(sql)
+    else:
+        schema_editor.create_model(apps.get_model('user_messages', 'ArchivedMessage'))
+
+
+def drop_archive_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        with schema_editor.connection.cursor() as cursor:
+            for sql in POSTGRES_REVERSE:
+                cursor.execute(sql)
+    else:
+        schema_editor.delete_model(apps.get_model('user_messages', 'ArchivedMessage'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channels', '0004_read_states'),
+        ('user_messages', '0007_usermessages_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ArchivedMessage',
+                    fields=[
+                        ('message_id', models.IntegerField(primary_key=True, serialize=False)),
+                        ('time_stamp', models.DateTimeField()),
+                        ('payload', models.BinaryField()),
+                        ('dm_channel', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='channels.directmessagechannel')),
+                        ('message_channel_id', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='channels.channels')),
+                        ('user_channel_id', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'ordering': ['time_stamp'],
+                        'indexes': [models.Index(fields=['message_channel_id', 'time_stamp', 'message_id'], name='msg_archive_channel_idx'), models.Index(fields=['dm_channel', 'time_stamp', 'message_id'], name='msg_archive_dm_idx')],
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_archive_table, drop_archive_table),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-17 07:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channels', '0009_remove_readstate_unread_count'),
+        ('user_messages', '0008_archivedmessage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usermessages',
+            index=models.Index(fields=['message_channel_id', 'message_id'], name='msg_channel_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usermessages',
+            index=models.Index(fields=['dm_channel', 'message_id'], name='msg_dm_unread_idx'),
+        ),
+    ]
@@ -4,6 +4,13 @@ from channels.models import Channels, DirectMessageChannel
 from users.models import Users
 
 
+class UserMessagesQuerySet(models.QuerySet):
+    def with_related(self):
+        """Load message authors in the same query as the messages, and mentions in one more"""
+        return self.select_related('user_channel_id').prefetch_related(
+            models.Prefetch('mentions', queryset=Users.objects.only('user_id'))
+        )
+
 # Create your models here.
 class UserMessages(models.Model):
     message_id = models.AutoField(primary_key=True)
@@ -17,8 +24,11 @@ class UserMessages(models.Model):
     edited_at = models.DateTimeField(blank=True, null=True)
     is_pinned = models.BooleanField(default=False)
     mentions = models.ManyToManyField(Users, related_name='mentioned_in', blank=True)
+    mention_everyone = models.BooleanField(default=False)
     time_stamp = models.DateTimeField(default=timezone.now)
 
+    objects = UserMessagesQuerySet.as_manager()
+
     def __str__(self):
         if self.message_channel_id:
             return f"{self.user_channel_id.username} in #{self.message_channel_id.name}: {self.content[:50]}"
@@ -29,6 +39,13 @@ class UserMessages(models.Model):
         verbose_name = 'Message'
         verbose_name_plural = 'Messages'
         ordering = ['time_stamp']
+        indexes = [
+            # Keyset index for paginated channel history
+            models.Index(fields=['message_channel_id', 'time_stamp', 'message_id'], name='msg_channel_history_idx'),
+            # Unread counts range over the messages after a read marker
+            models.Index(fields=['message_channel_id', 'message_id'], name='msg_channel_unread_idx'),
+            models.Index(fields=['dm_channel', 'message_id'], name='msg_dm_unread_idx'),
+        ]
 
 class MessageReaction(models.Model):
     reaction_id = models.AutoField(primary_key=True)
@@ -41,4 +58,47 @@ class MessageReaction(models.Model):
         unique_together = ('message', 'user', 'emoji')
 
     def __str__(self):
-        return f"{self.user.username} reacted with {self.emoji} to message {self.message.message_id}"
\ No newline at end of file
+        return f"{self.user.username} reacted with {self.emoji} to message {self.message.message_id}"
+
+class MessageReactionCount(models.Model):
+    """Denormalized per-emoji reaction counter for a message"""
+    message = models.ForeignKey(UserMessages, on_delete=models.CASCADE, related_name='reaction_counts')
+    emoji = models.CharField(max_length=50)
+    count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('message', 'emoji')
+
+    def __str__(self):
+        return f"{self.emoji} x{self.count} on message {self.message_id}"
+
+class ArchivedMessage(models.Model):
+    """
+    Cold-tier copy of an old message, moved here by the archive_messages
+    command. The body, mentions and reaction counts are kept in a
+    zlib-compressed JSON payload. On PostgreSQL the table is range-partitioned
+    by month on time_stamp, so whole months can be detached, backed up or
+    dropped; elsewhere it is a single table.
+    """
+    message_id = models.IntegerField(primary_key=True)
+    # No database constraints: partitions are managed outside the ORM, and
+    # deletes still cascade through Django
+    message_channel_id = models.ForeignKey(Channels, on_delete=models.CASCADE, related_name='archived_messages',
+                                           null=True, blank=True, db_constraint=False)
+    dm_channel = models.ForeignKey(DirectMessageChannel, on_delete=models.CASCADE, related_name='archived_messages',
+                                   null=True, blank=True, db_constraint=False)
+    user_channel_id = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='archived_messages',
+                                        db_constraint=False)
+    time_stamp = models.DateTimeField()
+    payload = models.BinaryField()
+
+    def __str__(self):
+        return f"Archived message {self.message_id}"
+
+    class Meta:
+        ordering = ['time_stamp']
+        indexes = [
+            models.Index(fields=['message_channel_id', 'time_stamp', 'message_id'], name='msg_archive_channel_idx'),
+            models.Index(fields=['dm_channel', 'time_stamp', 'message_id'], name='msg_archive_dm_idx'),
+        ]
@@ -0,0 +1,52 @@
+# Generated manually
+#
+# Indexes for user discovery (api.user_search). On PostgreSQL these are
+# pg_trgm GIN indexes matching the UPPER(...) LIKE expressions Django uses
+# for icontains/istartswith; on SQLite, NOCASE indexes serve prefix LIKEs.
+
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS users_username_trgm_idx '
+    'ON users_users USING GIN (UPPER(username::text) gin_trgm_ops)',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS users_display_name_trgm_idx '
+    'ON users_users USING GIN (UPPER(display_name::text) gin_trgm_ops)',
+]
+POSTGRES_REVERSE = [
+    'DROP INDEX CONCURRENTLY IF EXISTS users_display_name_trgm_idx',
+    'DROP INDEX CONCURRENTLY IF EXISTS users_username_trgm_idx',
+]
+
+SQLITE_FORWARD = [
+    'CREATE INDEX IF NOT EXISTS users_username_nocase_idx ON users_users (username COLLATE NOCASE)',
+    'CREATE INDEX IF NOT EXISTS users_display_name_nocase_idx ON users_users (display_name COLLATE NOCASE)',
+]
+SQLITE_REVERSE = [
+    'DROP INDEX IF EXISTS users_display_name_nocase_idx',
+    'DROP INDEX IF EXISTS users_username_nocase_idx',
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        statements = statements_by_vendor.get(schema_editor.connection.vendor, [])
+        with schema_editor.connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('users', '0005_users_avatar_users_display_name_users_last_seen_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            _run({'postgresql': POSTGRES_REVERSE, 'sqlite': SQLITE_REVERSE}),
+        ),
+    ]
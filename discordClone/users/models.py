@@ -1,9 +1,21 @@
 from django.db import models
+from django.dispatch import Signal
 from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 
+# Sent after a queryset update() of users, which bypasses post_save, with the
+# updated ``user_ids`` and the ``fields`` written
+users_updated = Signal()
+
+class UsersQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        user_ids = list(self.values_list('pk', flat=True))
+        updated = super().update(**kwargs)
+        users_updated.send(sender=self.model, user_ids=user_ids, fields=set(kwargs))
+        return updated
+
 # Custom User Manager
-class UsersManager(BaseUserManager):
+class UsersManager(BaseUserManager.from_queryset(UsersQuerySet)):
     def create_user(self, username, email, password=None, **extra_fields):
         if not email:
             raise ValueError('The Email field must be set')